@@ -0,0 +1,518 @@
+"""
+Benchmark the core models on synthetic country-scale inputs:
+
+    python -m benchmark.run --size 4000 --workers 4
+
+Each model runs in a process of its own, so that its peak memory use is
+measured separately. Wall time, peak resident memory and the temporary
+files written are appended to a JSON history, and compared with the last
+run with the same settings, so regressions show up between versions. The
+Python interpreter has to be one that can import the QGIS libraries, like
+for mcda.batch.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmark.synthetic import generate_inputs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HISTORY = os.path.join(ROOT, "benchmark", "history.json")
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "mcda-benchmark")
+
+# Models in the order they are run, by their batch step name, with the steps
+# whose results they take as inputs
+MODELS: Dict[str, List[str]] = {
+    "hri": [],
+    "environmental": ["hri"],
+    "economic": [],
+    "infrastructure": [],
+    "mcda": ["environmental", "economic", "infrastructure"],
+}
+# Seconds between measurements of the temporary directory
+SAMPLE_INTERVAL = 0.25
+
+
+def model_parameters(
+    name: str, inputs: Dict[str, str], outputs: Dict[str, str]
+) -> Dict[str, Any]:
+    """
+    Parameters of a model in the format of its panel, reading the synthetic
+    inputs and the outputs of the models run before it.
+    """
+    if name == "hri":
+        return {
+            "Layers": [inputs["flood"], inputs["landslide"], inputs["drought"]],
+            "Weights": [0.4, 0.3, 0.3],
+            "NormalizeLayers": True,
+            "Schools": inputs["schools"],
+            "OutputRaster": outputs["hri"],
+            "SampledOutput": outputs["hri_schools"],
+            "LayerNames": {
+                "OutputRaster": "Hazard Index",
+                "SampledOutput": "Hazard Index at Schools",
+            },
+        }
+    if name == "environmental":
+        return {
+            "MultiHazardRisk": outputs["hri"],
+            "DigitalElevationModel": inputs["dem"],
+            "ForestVegetationClassified": inputs["forest"],
+            "WeightforMultiHazardRisk": 0.4,
+            "WeightforElevation": 0.3,
+            "WeightforVegetation": 0.3,
+            "EnvironmentalSuitability": outputs["environmental"],
+        }
+    if name == "economic":
+        return {
+            "Roads": inputs["roads"],
+            "MaxRoadDistance": 10000,
+            "Minimumsuitabledistancetotheroad": 500,
+            "Arelocationsclosetoroadsmoresuitable": True,
+            "WeightforRoads": 0.5,
+            "Waterways": inputs["waterways"],
+            "MaxWaterDistance": 10000,
+            "Minimumsuitabledistancetoawaterway": 1000,
+            "Arelocationsclosetowaterwaysmoresuitable": False,
+            "WeightforWaterways": 0.5,
+            "EconomicSuitability": outputs["economic"],
+        }
+    if name == "infrastructure":
+        return {
+            "Schools": inputs["schools"],
+            "MaxDistancefromExistingSchools": 5000,
+            "Minimumsuitabledistancetoanotherschool": 1000,
+            "Newschoolsshouldbelocatedfurtherfromexistingschoolsratherthanclosetothem": True,  # noqa: E501
+            "SchoolWeight": 0.5,
+            "PopulationDensity": inputs["population"],
+            "PopulationThreshold": 100,
+            "Newschoolsshouldideallybelocatedinsparselypopulatedareas": False,
+            "PopWeight": 0.5,
+            "InfrastructureSuitability": outputs["infrastructure"],
+        }
+    if name == "mcda":
+        return {
+            "Layers": [
+                outputs["environmental"],
+                outputs["economic"],
+                outputs["infrastructure"],
+            ],
+            "Weights": [0.4, 0.3, 0.3],
+            "NormalizeLayers": False,
+            "OutputRaster": outputs["mcda"],
+            "LayerNames": {"OutputRaster": "MCDA", "SampledOutput": None},
+        }
+    raise ValueError(f"Unknown model {name}")
+
+
+class HelperTimer:
+    """
+    Counts the calls of the helper methods of a model and the time spent in
+    them. Times are inclusive, so nested helpers are counted in their
+    callers too, and helpers run in parallel branches add up to more than
+    the wall time.
+    """
+
+    def __init__(self, algorithm_class: type) -> None:
+        from mcda.core.base_model import BaseModel
+
+        self.classes = [
+            cls for cls in algorithm_class.__mro__ if issubclass(cls, BaseModel)
+        ]
+        self.helpers: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._originals: List[tuple] = []
+
+    def __enter__(self) -> "HelperTimer":
+        patched = set()
+        for cls in self.classes:
+            for name, method in list(vars(cls).items()):
+                if (
+                    name in patched
+                    or not name.startswith("_")
+                    or name.startswith("__")
+                    or not inspect.isfunction(method)
+                ):
+                    continue
+                patched.add(name)
+                self._originals.append((cls, name, method))
+                setattr(cls, name, self._timed(name, method))
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        for cls, name, method in reversed(self._originals):
+            setattr(cls, name, method)
+        self._originals = []
+
+    def _timed(self, name: str, method: Callable) -> Callable:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    helper = self.helpers.setdefault(name, {"calls": 0, "seconds": 0.0})
+                    helper["calls"] += 1
+                    helper["seconds"] += elapsed
+
+        return timed
+
+
+class DirectorySampler(threading.Thread):
+    """
+    Measures the size of a directory in the background and keeps the peak,
+    as temporary files are removed by the end of the run.
+    """
+
+    def __init__(self, directory: str) -> None:
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.peak = 0
+        self._finished = threading.Event()
+
+    def run(self) -> None:
+        while not self._finished.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _directory_size(self.directory))
+
+    def stop(self) -> int:
+        self._finished.set()
+        self.join()
+        self.peak = max(self.peak, _directory_size(self.directory))
+        return self.peak
+
+
+def _directory_size(directory: str) -> int:
+    size = 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                # Removed while walking
+                pass
+    return size
+
+
+def _peak_rss() -> Optional[int]:
+    """
+    Peak resident memory of the process in bytes, where it is available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _written_bytes() -> Optional[int]:
+    """
+    Bytes the process has written to storage, where it is available.
+    """
+    try:
+        with open("/proc/self/io", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def run_model(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one model in this process and return its measurements.
+    """
+    from qgis.core import (
+        QgsApplication,
+        QgsNativeAlgorithms,
+        QgsProcessingContext,
+        QgsProcessingException,
+        QgsProcessingFeedback,
+        QgsVectorLayer,
+    )
+
+    application = QgsApplication([], False)
+    application.initQgis()
+    # Processing is a plugin, so it is not on the path of standalone scripts
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), "python", "plugins"))
+    from processing.core.Processing import Processing
+
+    Processing.initialize()
+    registry = QgsApplication.processingRegistry()
+    if registry.providerById("native") is None:
+        registry.addProvider(QgsNativeAlgorithms())
+
+    # The models import processing, so they can only be imported now
+    from mcda.core.batch import STEPS
+
+    name = settings["model"]
+    algorithm_class = STEPS[name][0]
+    temporary = settings["temporary"]
+    parameters = {
+        **model_parameters(name, settings["inputs"], settings["outputs"]),
+        "Studyarea": QgsVectorLayer(
+            settings["inputs"]["studyarea"], "studyarea", "ogr"
+        ),
+        "ProjectedReferenceSystem": "EPSG:3857",
+        "Workers": settings["workers"],
+        # Every run starts cold
+        "UseCache": False,
+        "TemporaryDirectory": temporary,
+    }
+    context = QgsProcessingContext()
+    feedback = QgsProcessingFeedback()
+    baseline_rss = _peak_rss()
+    written = _written_bytes()
+    sampler = DirectorySampler(temporary)
+    sampler.start()
+    try:
+        with HelperTimer(algorithm_class) as timer:
+            start = time.perf_counter()
+            algorithm = algorithm_class()
+            algorithm.initAlgorithm()
+            if not algorithm.prepare(parameters, context, feedback):
+                raise QgsProcessingException(f"Could not prepare model {name}")
+            algorithm.runPrepared(parameters, context, feedback)
+            algorithm.postProcess(context, feedback)
+            wall = time.perf_counter() - start
+    finally:
+        temporary_peak = sampler.stop()
+    written_after = _written_bytes()
+    application.exitQgis()
+    return {
+        "wall_seconds": wall,
+        "peak_rss_bytes": _peak_rss(),
+        "baseline_rss_bytes": baseline_rss,
+        "temporary_peak_bytes": temporary_peak,
+        "written_bytes": (
+            written_after - written
+            if written is not None and written_after is not None
+            else None
+        ),
+        "helpers": dict(
+            sorted(timer.helpers.items(), key=lambda item: -item[1]["seconds"])
+        ),
+    }
+
+
+def _run_in_subprocess(settings: Dict[str, Any], directory: str) -> Dict[str, Any]:
+    settings_path = os.path.join(directory, f"{settings['model']}_settings.json")
+    result_path = os.path.join(directory, f"{settings['model']}_result.json")
+    with open(settings_path, "w", encoding="utf-8") as file:
+        json.dump(settings, file)
+    # Processing writes the outputs of child algorithms to the system
+    # temporary directory, so they are counted with the temporary files
+    environment = {**os.environ, "TMPDIR": settings["temporary"]}
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmark.run",
+            "--run-model",
+            settings_path,
+            "--result",
+            result_path,
+        ],
+        cwd=ROOT,
+        env=environment,
+        check=True,
+    )
+    with open(result_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _models_to_run(names: List[str], outputs: Dict[str, str]) -> List[str]:
+    """
+    The models asked for and the models their inputs come from, unless
+    their outputs are there from an earlier run, in the order they are run.
+    """
+    selected = set()
+
+    def select(name: str) -> None:
+        selected.add(name)
+        for dependency in MODELS[name]:
+            if dependency not in selected and not os.path.exists(outputs[dependency]):
+                select(dependency)
+
+    for name in names:
+        select(name)
+    return [name for name in MODELS if name in selected]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _plugin_version() -> Optional[str]:
+    with open(os.path.join(ROOT, "mcda", "metadata.txt"), encoding="utf-8") as file:
+        for line in file:
+            if line.startswith("version="):
+                return line.split("=", 1)[1].strip()
+    return None
+
+
+def _load_history(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _report(record: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+    megabyte = 1024 * 1024
+    print(f"{'model':<16}{'wall s':>10}{'change':>10}{'peak MB':>10}{'temp MB':>10}")
+    for name, result in record["models"].items():
+        change = ""
+        if previous and name in previous["models"]:
+            before = previous["models"][name]["wall_seconds"]
+            change = f"{100 * (result['wall_seconds'] - before) / before:+.0f}%"
+        peak = result["peak_rss_bytes"]
+        print(
+            f"{name:<16}{result['wall_seconds']:>10.1f}{change:>10}"
+            f"{peak / megabyte if peak else float('nan'):>10.0f}"
+            f"{result['temporary_peak_bytes'] / megabyte:>10.0f}"
+        )
+    if previous:
+        print(
+            f"Compared with {previous['timestamp']} "
+            f"(version {previous['version']}, commit {previous['commit']})"
+        )
+
+
+def main(arguments: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.run", description=__doc__.split(":")[0].strip()
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=2000,
+        help="width and height of the inputs in pixels",
+    )
+    parser.add_argument(
+        "--resolution", type=float, default=100, help="pixel size of the inputs in m"
+    )
+    parser.add_argument(
+        "--schools", type=int, default=5000, help="number of existing schools"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="seed of the inputs")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="workers per model"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        choices=list(MODELS),
+        default=list(MODELS),
+        help="models to run",
+    )
+    parser.add_argument(
+        "--workdir", default=DEFAULT_WORKDIR, help="directory for inputs and outputs"
+    )
+    parser.add_argument(
+        "--history", default=DEFAULT_HISTORY, help="JSON file the runs are added to"
+    )
+    # Used to run each model in a process of its own
+    parser.add_argument("--run-model", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(arguments)
+
+    if args.run_model:
+        with open(args.run_model, encoding="utf-8") as file:
+            result = run_model(json.load(file))
+        with open(args.result, "w", encoding="utf-8") as file:
+            json.dump(result, file)
+        return 0
+
+    settings = {
+        "size": args.size,
+        "resolution": args.resolution,
+        "schools": args.schools,
+        "seed": args.seed,
+        "workers": args.workers,
+    }
+    run_directory = os.path.join(
+        args.workdir, f"{args.size}_{args.resolution:g}_{args.schools}_{args.seed}"
+    )
+    print(f"Generating inputs in {run_directory}")
+    inputs = generate_inputs(
+        os.path.join(run_directory, "inputs"),
+        args.size,
+        args.resolution,
+        args.seed,
+        args.schools,
+    )
+    output_directory = os.path.join(run_directory, "outputs")
+    os.makedirs(output_directory, exist_ok=True)
+    outputs = {name: os.path.join(output_directory, f"{name}.tif") for name in MODELS}
+    outputs["hri_schools"] = os.path.join(output_directory, "hri_schools.gpkg")
+
+    results = {}
+    for name in _models_to_run(args.models, outputs):
+        print(f"Running {name}")
+        temporary = os.path.join(run_directory, "temporary", name)
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        try:
+            results[name] = _run_in_subprocess(
+                {
+                    "model": name,
+                    "inputs": inputs,
+                    "outputs": outputs,
+                    "workers": args.workers,
+                    "temporary": temporary,
+                },
+                run_directory,
+            )
+        finally:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    from osgeo import gdal
+
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "version": _plugin_version(),
+        "commit": _git_commit(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "gdal": gdal.__version__,
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "models": results,
+    }
+    history = _load_history(args.history)
+    previous = next(
+        (run for run in reversed(history) if run["settings"] == settings), None
+    )
+    history.append(record)
+    with open(f"{args.history}.partial", "w", encoding="utf-8") as file:
+        json.dump(history, file, indent=2)
+    os.replace(f"{args.history}.partial", args.history)
+    _report(record, previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""
+Synthetic country-scale inputs for the benchmarks.
+
+All inputs are generated from a seed, so the same size and seed always give
+the same inputs. Rasters are generated and written in strips of rows, so
+inputs much larger than memory can be generated.
+"""
+import json
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+# Inputs are placed in East Africa, in the default projected reference system
+# of the models
+CRS = "EPSG:3857"
+ORIGIN = (3_800_000.0, 200_000.0)
+# Rows generated and written at a time
+STRIP_ROWS = 512
+# Difference between the lowest and the highest elevation in meters
+RELIEF = 2500.0
+
+RASTERS = ["dem", "forest", "flood", "landslide", "drought", "population"]
+VECTORS = ["studyarea", "roads", "waterways", "schools"]
+
+
+class FractalNoise:
+    """
+    Sum of bilinearly interpolated random grids, from a coarse grid of four
+    cells across down to a few pixels per cell. Values are in 0...1. Any
+    strip of rows can be generated on its own.
+    """
+
+    # Sums of many octaves are close to their mean, so they are stretched to
+    # use the whole range
+    contrast = 2.0
+
+    def __init__(
+        self, size: int, seed: int, persistence: float = 0.6, finest: int = 4
+    ) -> None:
+        rng = np.random.default_rng(seed)
+        self.size = size
+        self.octaves: List[Tuple[np.ndarray, float]] = []
+        cells, amplitude = 4, 1.0
+        while cells <= max(size // finest, 4):
+            self.octaves.append((rng.random((cells + 1, cells + 1)), amplitude))
+            cells *= 2
+            amplitude *= persistence
+        self.total = sum(amplitude for _, amplitude in self.octaves)
+
+    def rows(self, start: int, count: int) -> np.ndarray:
+        result = np.zeros((count, self.size))
+        for grid, amplitude in self.octaves:
+            cells = grid.shape[0] - 1
+            y = (np.arange(start, start + count) + 0.5) * cells / self.size
+            x = (np.arange(self.size) + 0.5) * cells / self.size
+            y0 = np.minimum(y.astype(int), cells - 1)
+            x0 = np.minimum(x.astype(int), cells - 1)
+            fy = (y - y0)[:, np.newaxis]
+            fx = (x - x0)[np.newaxis, :]
+            rows = grid[y0] * (1 - fy) + grid[y0 + 1] * fy
+            result += amplitude * (rows[:, x0] * (1 - fx) + rows[:, x0 + 1] * fx)
+        return np.clip((result / self.total - 0.5) * self.contrast + 0.5, 0, 1)
+
+
+def _srs() -> osr.SpatialReference:
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(CRS)
+    return srs
+
+
+def _write_raster(
+    path: str,
+    size: int,
+    resolution: float,
+    data_type: int,
+    nodata: float,
+    strip: Any,
+) -> None:
+    """
+    Write a raster of size x size pixels, with the values of each strip of
+    rows given by strip(start, count).
+    """
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        path,
+        size,
+        size,
+        1,
+        data_type,
+        ["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"],
+    )
+    dataset.SetGeoTransform(
+        (ORIGIN[0], resolution, 0, ORIGIN[1] + size * resolution, 0, -resolution)
+    )
+    dataset.SetProjection(_srs().ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    for start in range(0, size, STRIP_ROWS):
+        count = min(STRIP_ROWS, size - start)
+        band.WriteArray(strip(start, count), 0, start)
+    band.FlushCache()
+    dataset = None
+
+
+def _write_vector(
+    path: str, geometry_type: int, geometries: List[ogr.Geometry]
+) -> None:
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    dataset = driver.CreateDataSource(path)
+    layer = dataset.CreateLayer(
+        os.path.splitext(os.path.basename(path))[0], _srs(), geometry_type
+    )
+    layer.CreateField(ogr.FieldDefn("id", ogr.OFTInteger))
+    definition = layer.GetLayerDefn()
+    layer.StartTransaction()
+    for index, geometry in enumerate(geometries):
+        feature = ogr.Feature(definition)
+        feature.SetField("id", index + 1)
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    dataset = None
+
+
+def _line(points: np.ndarray) -> ogr.Geometry:
+    line = ogr.Geometry(ogr.wkbLineString)
+    for x, y in points:
+        line.AddPoint_2D(float(x), float(y))
+    return line
+
+
+def _meander(
+    rng: np.random.Generator,
+    start: np.ndarray,
+    heading: float,
+    length: float,
+    step: float,
+    wiggle: float,
+) -> np.ndarray:
+    """
+    Vertices of a line turning randomly from the heading.
+    """
+    steps = max(int(length / step), 2)
+    headings = heading + np.cumsum(rng.normal(0, wiggle, steps))
+    # Pull the heading back, so lines keep their general direction
+    headings = heading + (headings - heading) * 0.5
+    offsets = np.cumsum(
+        np.column_stack([np.cos(headings), np.sin(headings)]) * step, axis=0
+    )
+    return np.vstack([start, start + offsets])
+
+
+def study_area(rng: np.random.Generator, size: int, resolution: float) -> ogr.Geometry:
+    """
+    Irregular country-like polygon covering most of the extent, with a
+    detailed boundary like administrative boundaries have.
+    """
+    extent = size * resolution
+    center = np.array(ORIGIN) + extent / 2
+    vertices = 4000
+    angles = np.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    # Smooth variation of the radius plus boundary detail
+    radius = np.ones(vertices)
+    for frequency in range(2, 40):
+        radius += rng.normal(0, 0.6 / frequency**1.2) * np.sin(
+            frequency * angles + rng.uniform(0, 2 * math.pi)
+        )
+    radius = np.clip(radius, 0.5, 1.3) * extent * 0.38
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for angle, distance in zip(angles, radius):
+        ring.AddPoint_2D(
+            float(center[0] + distance * math.cos(angle)),
+            float(center[1] + distance * math.sin(angle)),
+        )
+    ring.CloseRings()
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    return polygon
+
+
+def road_network(
+    rng: np.random.Generator, size: int, resolution: float, spacing: float = 15_000
+) -> List[ogr.Geometry]:
+    """
+    Roughly gridded main roads across the extent, with winding local roads
+    branching off them.
+    """
+    extent = size * resolution
+    origin = np.array(ORIGIN)
+    roads = []
+    count = max(int(extent / spacing), 1)
+    for index in range(count):
+        offset = (index + rng.uniform(0.2, 0.8)) * spacing
+        for start, heading in (
+            (origin + [0, offset], 0.0),
+            (origin + [offset, 0], math.pi / 2),
+        ):
+            main = _meander(rng, start, heading, extent, 500, 0.05)
+            roads.append(_line(main))
+            for branch in rng.choice(len(main), size=min(3, len(main)), replace=False):
+                roads.append(
+                    _line(
+                        _meander(
+                            rng,
+                            main[branch],
+                            heading + rng.choice([-1, 1]) * math.pi / 2,
+                            rng.uniform(2_000, spacing / 2),
+                            250,
+                            0.3,
+                        )
+                    )
+                )
+    return roads
+
+
+def waterways(
+    rng: np.random.Generator, size: int, resolution: float
+) -> List[ogr.Geometry]:
+    """
+    Meandering rivers across the extent, with tributaries.
+    """
+    extent = size * resolution
+    origin = np.array(ORIGIN)
+    rivers = []
+    for _ in range(max(int(extent / 40_000), 1)):
+        start = origin + [0, rng.uniform(0, extent)]
+        river = _meander(rng, start, rng.normal(0, 0.3), extent * 1.2, 300, 0.15)
+        rivers.append(_line(river))
+        for branch in rng.choice(len(river), size=min(5, len(river)), replace=False):
+            rivers.append(
+                _line(
+                    _meander(
+                        rng,
+                        river[branch],
+                        rng.uniform(0, 2 * math.pi),
+                        rng.uniform(5_000, 20_000),
+                        300,
+                        0.2,
+                    )
+                )
+            )
+    return rivers
+
+
+def schools(
+    rng: np.random.Generator, size: int, resolution: float, count: int
+) -> List[ogr.Geometry]:
+    """
+    School points, half of them in towns and half scattered.
+    """
+    extent = size * resolution
+    towns = rng.uniform(0, extent, (max(count // 200, 1), 2))
+    clustered = towns[rng.integers(0, len(towns), count // 2)] + rng.normal(
+        0, 3_000, (count // 2, 2)
+    )
+    scattered = rng.uniform(0, extent, (count - count // 2, 2))
+    points = np.clip(np.vstack([clustered, scattered]), 0, extent) + ORIGIN
+    result = []
+    for x, y in points:
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(float(x), float(y))
+        result.append(point)
+    return result
+
+
+def generate_inputs(
+    directory: str,
+    size: int = 2000,
+    resolution: float = 100,
+    seed: int = 1,
+    school_count: int = 5000,
+) -> Dict[str, str]:
+    """
+    Generate all the inputs in the directory and return their paths by
+    name. Inputs already generated with the same settings are reused.
+    """
+    os.makedirs(directory, exist_ok=True)
+    settings = {
+        "size": size,
+        "resolution": resolution,
+        "seed": seed,
+        "school_count": school_count,
+    }
+    paths = {
+        **{name: os.path.join(directory, f"{name}.tif") for name in RASTERS},
+        **{name: os.path.join(directory, f"{name}.gpkg") for name in VECTORS},
+    }
+    settings_path = os.path.join(directory, "settings.json")
+    if os.path.exists(settings_path) and all(map(os.path.exists, paths.values())):
+        with open(settings_path, encoding="utf-8") as file:
+            if json.load(file) == settings:
+                return paths
+
+    terrain = FractalNoise(size, seed)
+    vegetation = FractalNoise(size, seed + 1)
+    hazards = [FractalNoise(size, seed + index) for index in (2, 3, 4)]
+    people = FractalNoise(size, seed + 5, persistence=0.7)
+
+    _write_raster(
+        paths["dem"],
+        size,
+        resolution,
+        gdal.GDT_Float32,
+        -9999,
+        lambda start, count: 300 + RELIEF * terrain.rows(start, count) ** 1.5,
+    )
+    _write_raster(
+        paths["forest"],
+        size,
+        resolution,
+        gdal.GDT_Byte,
+        255,
+        lambda start, count: (vegetation.rows(start, count) > 0.55).astype(np.uint8),
+    )
+    # Floods are more likely in the lowlands, landslides on the slopes
+    _write_raster(
+        paths["flood"],
+        size,
+        resolution,
+        gdal.GDT_Float32,
+        -9999,
+        lambda start, count: (1 - terrain.rows(start, count))
+        * hazards[0].rows(start, count),
+    )
+    _write_raster(
+        paths["landslide"],
+        size,
+        resolution,
+        gdal.GDT_Float32,
+        -9999,
+        lambda start, count: terrain.rows(start, count) * hazards[1].rows(start, count),
+    )
+    _write_raster(
+        paths["drought"],
+        size,
+        resolution,
+        gdal.GDT_Float32,
+        -9999,
+        lambda start, count: hazards[2].rows(start, count),
+    )
+    # Population per square kilometer, mostly sparse with dense towns
+    _write_raster(
+        paths["population"],
+        size,
+        resolution,
+        gdal.GDT_Float32,
+        -9999,
+        lambda start, count: np.exp(9 * people.rows(start, count) - 2),
+    )
+
+    rng = np.random.default_rng(seed)
+    _write_vector(
+        paths["studyarea"], ogr.wkbPolygon, [study_area(rng, size, resolution)]
+    )
+    _write_vector(
+        paths["roads"], ogr.wkbLineString, road_network(rng, size, resolution)
+    )
+    _write_vector(
+        paths["waterways"], ogr.wkbLineString, waterways(rng, size, resolution)
+    )
+    _write_vector(
+        paths["schools"], ogr.wkbPoint, schools(rng, size, resolution, school_count)
+    )
+    with open(settings_path, "w", encoding="utf-8") as file:
+        json.dump(settings, file)
+    return paths
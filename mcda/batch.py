@@ -0,0 +1,69 @@
+"""
+Run the models for many study areas without the QGIS GUI:
+
+    python -m mcda.batch parameters.json --workers 4
+
+The Python interpreter has to be one that can import the QGIS libraries,
+e.g. python-qgis.bat on Windows. The same runs are available with
+qgis_process as the algorithm mcda:batchrun once the plugin is enabled.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+from typing import List, Optional
+
+from qgis.core import QgsApplication, QgsNativeAlgorithms, QgsProcessingFeedback
+
+
+class ConsoleFeedback(QgsProcessingFeedback):
+    """Prints messages of the run to the console."""
+
+    def pushInfo(self, info: str) -> None:  # noqa: N802
+        print(info)
+
+    def reportError(  # noqa: N802
+        self, error: str, fatalError: bool = False  # noqa: N803
+    ) -> None:
+        print(error, file=sys.stderr)
+
+
+def main(arguments: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m mcda.batch", description=__doc__.split(":")[0].strip()
+    )
+    parser.add_argument("parameter_file", help="batch parameter file (JSON)")
+    parser.add_argument(
+        "--workers", type=int, help="number of study areas run at the same time"
+    )
+    args = parser.parse_args(arguments)
+
+    application = QgsApplication([], False)
+    application.initQgis()
+    # Processing is a plugin, so it is not on the path of standalone scripts
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), "python", "plugins"))
+    from processing.core.Processing import Processing
+
+    Processing.initialize()
+    registry = QgsApplication.processingRegistry()
+    if registry.providerById("native") is None:
+        registry.addProvider(QgsNativeAlgorithms())
+
+    # The models import processing, so they can only be imported now
+    from mcda.core.batch import run_batch
+
+    feedback = ConsoleFeedback()
+    signal.signal(signal.SIGINT, lambda *_: feedback.cancel())
+    try:
+        manifest = run_batch(args.parameter_file, feedback, workers=args.workers)
+    finally:
+        application.exitQgis()
+    print(f"Manifest written to {manifest}")
+    with open(manifest, encoding="utf-8") as file:
+        areas = json.load(file)["areas"].values()
+    return 0 if all(area["status"] == "ok" for area in areas) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
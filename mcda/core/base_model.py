@@ -1,16 +1,76 @@
 import os
 import sys
-from typing import Any, Dict, List, Optional
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import processing
+from osgeo import gdal
 from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsMemoryProviderUtils,
     QgsProcessing,
     QgsProcessingAlgorithm,
     QgsProcessingContext,
+    QgsProcessingException,
     QgsProcessingFeedback,
     QgsProcessingMultiStepFeedback,
+    QgsProcessingOutputRasterLayer,
+    QgsProcessingOutputVectorLayer,
+    QgsProcessingUtils,
     QgsRasterLayer,
+    QgsRectangle,
+    QgsVectorFileWriter,
     QgsVectorLayer,
+    QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import QVariant
+
+from .distance_transform import DistanceClassRaster
+from .intermediates import IntermediateStore, estimated_size
+from .raster_engine import (
+    CLASS_NODATA,
+    CLASS_RANGE,
+    OUTPUT_PROFILES,
+    VALUE_CLASS_EXPRESSION,
+    FileRaster,
+    LazyRaster,
+    RasterGrid,
+    RasterSource,
+    Window,
+    as_classes,
+    as_scaled_sum,
+    classify_value,
+    copy_scaling,
+    copy_to_profile,
+    cutline_nodata,
+    output_profile,
+    stored_values,
+    sum_range,
+    weighted_sum,
+    write_raster,
+)
+from .raster_statistics import (
+    StatisticsAccumulator,
+    ZonalAccumulator,
+    cache_statistics,
+    get_stack_statistics,
+    get_statistics,
+)
+from .result_cache import ResultCache, identity_key
+from .study_area import StudyArea
+from .task_graph import TaskGraph
+from .vector_distance import (
+    VectorDistanceClassRaster,
+    VectorDistanceIndex,
+    shared_index,
 )
 
 # Mac OS PROJ path fix until https://github.com/qgis/QGIS-Mac-Packager/issues/151 is
@@ -18,6 +78,19 @@ from qgis.core import (
 if "darwin" in sys.platform:
     os.environ["PROJ_LIB"] = os.environ["GDAL_DATA"].replace("/gdal", "/proj")
 
+# Default size budget of the intermediate result cache in megabytes
+DEFAULT_CACHE_SIZE = 2000
+# Default memory budget of intermediate rasters kept in memory in megabytes
+DEFAULT_INTERMEDIATE_MEMORY = 512
+# Cache key of rasters warped on the analysis grid in process
+WARP_TO_GRID = "mcda:warptogrid"
+# Default pixel size of the analysis grid in projected_reference_system units.
+# 100x100 meter resolution with ideal PRS.
+ANALYSIS_RESOLUTION = 100
+# Coarsest default pixel size of preview runs, which check the parameters of a
+# model in seconds before the full resolution run
+PREVIEW_RESOLUTION = 1000
+
 
 class BaseModel(QgsProcessingAlgorithm):
     """
@@ -29,6 +102,70 @@ class BaseModel(QgsProcessingAlgorithm):
         self.parameters: Dict[str, Any] = {}
         self.studyarea: Optional[QgsVectorLayer] = None
         self.projected_reference_system: str = "EPSG:3857"
+        # Run raster calculator steps in process with the block engine instead
+        # of separate GDAL runs
+        self.use_block_engine: bool = True
+        # Compute distances directly from vector features instead of
+        # rasterizing them
+        self.use_vector_distances: bool = False
+        # Cache for intermediate results of child algorithms
+        self.cache: Optional[ResultCache] = None
+        # Intermediate rasters of the block engine, in memory if they fit
+        self.intermediates: Optional[IntermediateStore] = None
+        # Number of threads computing blocks and warping in parallel
+        self.workers: int = 1
+        # Data type weighted sums are stored as: scaled Byte or UInt16, or
+        # Float32. Sums of unknown range are always stored as Float32, and
+        # classes are always stored as bytes.
+        self.sum_data_type: str = "UInt16"
+        # Output profile of the final results, see OUTPUT_PROFILES. Temporary
+        # results are always written in the fast-temp profile.
+        self.output_profile: str = "deliverable"
+        # Pixel size of the analysis grid in projected_reference_system units
+        self.resolution: float = ANALYSIS_RESOLUTION
+        # Common grid all rasters are warped and rasterized to
+        self.analysis_grid: Optional[RasterGrid] = None
+        # Study area buffered by the largest distance that affects the results.
+        # Vector inputs are clipped to it before any further processing.
+        self.clip_area: Optional[Union[QgsVectorLayer, str]] = None
+        # Study area prepared once per run, shared with pipeline stages
+        self.study_area: Optional[StudyArea] = None
+        # Study area file for warps with the GDAL library
+        self.cutline: Optional[str] = None
+        # Zones, e.g. districts, to summarize the result of the model by, and
+        # the path or temporary layer id of the summary once it is written
+        self.zones: Optional[QgsVectorLayer] = None
+        self.zonal_statistics: Optional[str] = None
+        # Directory of the temporary files of the run. The caller removes it
+        # once the run has finished, apart from the results.
+        self.temporary_directory: Optional[str] = None
+        # Context, feedback and workers of the task graph branch run by each
+        # thread
+        self._branch = threading.local()
+
+    @property
+    def context(self) -> QgsProcessingContext:
+        return getattr(self._branch, "context", None) or self._context
+
+    @context.setter
+    def context(self, context: QgsProcessingContext) -> None:
+        self._context = context
+
+    @property
+    def workers(self) -> int:
+        return getattr(self._branch, "workers", None) or self._workers
+
+    @workers.setter
+    def workers(self, workers: int) -> None:
+        self._workers = workers
+
+    @property
+    def feedback(self) -> QgsProcessingFeedback:
+        return getattr(self._branch, "feedback", None) or self._feedback
+
+    @feedback.setter
+    def feedback(self, feedback: QgsProcessingFeedback) -> None:
+        self._feedback = feedback
 
     def initAlgorithm(self, configuration: Dict[str, Any] = ...) -> None:  # noqa: N802
         """
@@ -47,6 +184,33 @@ class BaseModel(QgsProcessingAlgorithm):
         """
         raise NotImplementedError()
 
+    def _criteria(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[List[Union[QgsRasterLayer, RasterSource]], List[float]]]:
+        """
+        Layers whose weighted sum is the result of the model, and their
+        weights. Returns None if the run is canceled.
+        """
+        raise NotImplementedError()
+
+    def _criteria_range(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Smallest and largest value of the criteria, or None if it is unknown.
+        The criteria of the suitability models are suitability classes.
+        """
+        return CLASS_RANGE
+
+    def _sum_range(
+        self, parameters: Dict[str, Any], weights: List[float]
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Smallest and largest value of the weighted sum of the criteria, which
+        the weights need not sum to one for.
+        """
+        return sum_range(weights, [self._criteria_range(parameters)] * len(weights))
+
     def startAlgorithm(  # noqa: N802
         self,
         parameters: Dict[str, Any],
@@ -64,25 +228,310 @@ class BaseModel(QgsProcessingAlgorithm):
         self.context = context
         if parameters["ProjectedReferenceSystem"]:
             self.projected_reference_system = parameters["ProjectedReferenceSystem"]
-        if parameters["Studyarea"]:
-            # In case there are problems (self-intersections) in the area vector, we
-            # want to fix them before proceeding.
-            self.studyarea = self._fix_vector_layer(parameters["Studyarea"])
-            # Also indexing the study area may help in speeding up??
-            # self.studyarea = self._create_spatial_index(self.studyarea)
+        self.use_block_engine = parameters.get("UseBlockEngine", True)
+        # Vector distances are only supported by the block engine
+        self.use_vector_distances = self.use_block_engine and parameters.get(
+            "VectorDistances", False
+        )
+        self.workers = parameters.get("Workers") or os.cpu_count() or 1
+        self.sum_data_type = parameters.get("SumDataType") or "UInt16"
+        self.resolution = self._resolution(parameters)
+        self.output_profile = parameters.get("OutputProfile") or "deliverable"
+        # Fail before any work is done if the profile is unknown
+        output_profile(self.output_profile)
+        if parameters.get("UseCache", True):
+            self.cache = ResultCache(
+                parameters.get("CacheDirectory")
+                or os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "mcda"),
+                int(parameters.get("CacheSize") or DEFAULT_CACHE_SIZE) * 1024 * 1024,
+            )
+        self.temporary_directory = parameters.get("TemporaryDirectory")
+        self.intermediates = IntermediateStore(
+            int(parameters.get("IntermediateMemory") or DEFAULT_INTERMEDIATE_MEMORY)
+            * 1024
+            * 1024,
+            self.temporary_directory or QgsProcessingUtils.tempFolder(),
+        )
+        zones = parameters.get("Zones")
+        if isinstance(zones, str):
+            zones = QgsProcessingUtils.mapLayerFromString(zones, context, True)
+        self.zones = zones or None
+        studyarea = parameters["Studyarea"]
+        if isinstance(studyarea, StudyArea) and (
+            studyarea.crs == self.projected_reference_system
+            and studyarea.grid.pixel_width == self.resolution
+        ):
+            # Prepared by the pipeline running the model as a stage
+            self.study_area = studyarea
+        elif studyarea:
+            self.study_area = self._prepare_study_area(
+                studyarea.layer if isinstance(studyarea, StudyArea) else studyarea
+            )
+        if self.study_area:
+            self.studyarea = self.study_area.layer
+            self.analysis_grid = self.study_area.grid
+            buffer = self._analysis_buffer()
+            self.clip_area = (
+                self.study_area.buffered(buffer) if buffer else self.studyarea
+            )
+            if self.use_block_engine:
+                self.cutline = self.study_area.cutline
+
+    def _resolution(self, parameters: Dict[str, Any]) -> float:
+        """
+        Pixel size of the analysis grid. Preview runs use the same steps at a
+        coarse resolution, so inputs are read decimated or from their
+        overviews when they are warped on the grid.
+        """
+        resolution = float(parameters.get("Resolution") or ANALYSIS_RESOLUTION)
+        if resolution <= 0:
+            raise QgsProcessingException("Resolution must be positive")
+        if parameters.get("Preview"):
+            resolution = max(resolution, PREVIEW_RESOLUTION)
+        return resolution
+
+    def _prepare_study_area(self, layer: Union[QgsVectorLayer, str]) -> StudyArea:
+        """
+        Fix and reproject the study area once for the whole run.
+        """
+        # In case there are problems (self-intersections) in the area vector, we
+        # want to fix them before proceeding.
+        fixed = self._fix_vector_layer(layer)
+        projected = self._reproject_vector_to_crs(
+            fixed, self.projected_reference_system
+        )
+        study_area = StudyArea(
+            fixed,
+            projected,
+            self.projected_reference_system,
+            self._analysis_grid(projected.extent()),
+            # Simplifying by a fraction of the pixel size speeds up clipping
+            # detailed boundaries without visibly changing the results
+            float(self.parameters.get("StudyareaTolerance") or 0),
+        )
+        study_area.cutline = self._write_cutline(study_area)
+        return study_area
+
+    def _analysis_buffer(self) -> float:
+        """
+        Largest distance from the study area at which vector features may
+        still affect the results, in projected_reference_system units. Models
+        with distance thresholds should return their largest threshold.
+        """
+        return 0
+
+    def _run_algorithm(self, algorithm: str, alg_params: Dict[str, Any]) -> Any:
+        """
+        Run child algorithm. Temporary raster and vector outputs are taken from
+        the result cache if the same algorithm has already been run with the
+        same parameters and inputs.
+        """
+        if alg_params.get("OUTPUT") != QgsProcessing.TEMPORARY_OUTPUT:
+            return processing.run(
+                algorithm,
+                alg_params,
+                context=self.context,
+                feedback=self.feedback,
+                is_child_algorithm=True,
+            )
+        output = (
+            QgsApplication.processingRegistry()
+            .algorithmById(algorithm)
+            .outputDefinition("OUTPUT")
+        )
+        if isinstance(output, QgsProcessingOutputRasterLayer):
+            extension = ".tif"
+        elif isinstance(output, QgsProcessingOutputVectorLayer):
+            extension = ".gpkg"
+        else:
+            extension = None
+        # Threads of the run do not change the result
+        inputs = {
+            key: value
+            for key, value in alg_params.items()
+            if key not in ("OUTPUT", "MULTITHREADING")
+        }
+        if isinstance(inputs.get("EXTRA"), str) and self._warp_threads():
+            inputs["EXTRA"] = inputs["EXTRA"].replace(self._warp_threads(), "").strip()
+        key = (
+            self.cache.key(algorithm, inputs, self.context)
+            if self.cache is not None and extension
+            else None
+        )
+        if key is None:
+            if extension == ".tif" and self.temporary_directory:
+                # Temporary rasters are removed with the directory of the run.
+                # Temporary vectors are memory layers of the context.
+                alg_params = {
+                    **alg_params,
+                    "OUTPUT": self._temporary_path("OUTPUT.tif"),
+                }
+            return processing.run(
+                algorithm,
+                alg_params,
+                context=self.context,
+                feedback=self.feedback,
+                is_child_algorithm=True,
+            )
+        cached = self.cache.get(key, extension)
+        if cached:
+            self.feedback.pushInfo(f"Using cached result of {algorithm}")
+            return {"OUTPUT": cached}
+        results = processing.run(
+            algorithm,
+            {**alg_params, "OUTPUT": self.cache.partial_path(key, extension)},
+            context=self.context,
+            feedback=self.feedback,
+            is_child_algorithm=True,
+        )
+        if self.feedback.isCanceled():
+            return results
+        return {**results, "OUTPUT": self.cache.add(key, extension)}
+
+    def _temporary_path(self, name: str) -> str:
+        """
+        Path for a temporary file of the run with the given file name.
+        """
+        if not self.temporary_directory:
+            return QgsProcessingUtils.generateTempFilename(name)
+        os.makedirs(self.temporary_directory, exist_ok=True)
+        return os.path.join(self.temporary_directory, f"{uuid.uuid4().hex}_{name}")
+
+    def _run_graph(self, graph: TaskGraph) -> Dict[str, Any]:
+        """
+        Run independent branches of the model concurrently. Each branch gets
+        its own processing context and feedback, since neither may be shared
+        between threads. Progress of the current step is the average progress
+        of the branches. Branch results should be rasters or layer objects,
+        because memory layers of a branch context are not kept. The workers
+        are divided between the branches that may run at the same time, so
+        that they do not start more threads than there are workers.
+        """
+        parent = self.feedback
+        branch_workers = max(self.workers // graph.width(), 1)
+        feedbacks = {name: QgsProcessingFeedback() for name in graph.tasks}
+        done: Dict[str, bool] = {}
+
+        def report_progress(progress: float) -> None:
+            total = sum(
+                100 if done.get(name) else feedback.progress()
+                for name, feedback in feedbacks.items()
+            )
+            parent.setProgress(total / len(feedbacks))
+
+        for feedback in feedbacks.values():
+            feedback.progressChanged.connect(report_progress)
+            parent.canceled.connect(feedback.cancel)
+
+        def wrap(name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+            def run_branch(*arguments: Any) -> Any:
+                context = QgsProcessingContext()
+                context.copyThreadSafeSettings(self._context)
+                self._branch.context = context
+                self._branch.feedback = feedbacks[name]
+                self._branch.workers = branch_workers
+                try:
+                    if feedbacks[name].isCanceled():
+                        return None
+                    return func(*arguments)
+                finally:
+                    self._branch.context = None
+                    self._branch.feedback = None
+                    self._branch.workers = None
+
+            return run_branch
+
+        def on_done(name: str, result: Any) -> None:
+            done[name] = True
+            report_progress(0)
+
+        try:
+            return graph.run(self.workers, wrap=wrap, on_done=on_done)
+        finally:
+            for feedback in feedbacks.values():
+                parent.canceled.disconnect(feedback.cancel)
 
     def _create_spatial_index(self, input: QgsVectorLayer) -> QgsVectorLayer:
         """
         Add spatial index to input layer
         """
         alg_params = {"INPUT": input}
-        return processing.run(
-            "native:createspatialindex",
-            alg_params,
-            context=self.context,
+        return self._run_algorithm("native:createspatialindex", alg_params)["OUTPUT"]
+
+    def _raster_source(
+        self, layer: Union[QgsRasterLayer, LazyRaster, str]
+    ) -> RasterSource:
+        """
+        Get block engine source for a raster layer, raster path or lazy raster.
+        """
+        if isinstance(layer, RasterSource):
+            return layer
+        if isinstance(layer, QgsRasterLayer):
+            return FileRaster(layer.source())
+        return FileRaster(layer)
+
+    def _write_raster(
+        self,
+        source: RasterSource,
+        write_to_layer: Optional[str] = None,
+        data_type: Optional[str] = None,
+        observers: Sequence[Callable[[Window, np.ndarray], None]] = (),
+    ) -> str:
+        """
+        Evaluate a block engine raster and write it to the given path in the
+        output profile, or to a temporary file. By default, the data type of
+        the source is used. Observers get the blocks as they are written.
+        """
+        path = write_to_layer if write_to_layer else self._temporary_path("OUTPUT.tif")
+        # Gather statistics of the values as stored while writing, so the
+        # result never has to be scanned again for them
+        statistics = StatisticsAccumulator()
+
+        def gather(window: Window, block: np.ndarray) -> None:
+            statistics.update(stored_values(source, block, data_type))
+
+        write_raster(
+            source,
+            path,
+            data_type=data_type,
             feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+            observers=[gather, *observers],
+            workers=self.workers,
+            profile=self.output_profile if write_to_layer else "fast-temp",
+        )
+        if not self.feedback.isCanceled():
+            cache_statistics(path, statistics.result())
+        return path
+
+    def _creation_options(self) -> str:
+        """
+        Creation options of temporary rasters written by GDAL algorithms.
+        """
+        return "|".join(OUTPUT_PROFILES["fast-temp"].options)
+
+    def _write_output(
+        self, output: Union[QgsRasterLayer, str], write_to_layer: Optional[str]
+    ) -> Union[QgsRasterLayer, str]:
+        """
+        Copy a temporary result of GDAL algorithms to the given path in the
+        output profile. Without a path, the temporary result is returned.
+        """
+        if not write_to_layer or self.feedback.isCanceled():
+            return output
+        if isinstance(output, QgsRasterLayer):
+            output = output.source()
+        return copy_to_profile(output, write_to_layer, self.output_profile)
+
+    def _materialize(
+        self, layer: Union[QgsRasterLayer, LazyRaster, str]
+    ) -> Union[QgsRasterLayer, str]:
+        """
+        Write lazy rasters to disk, so they can be used as input to processing
+        algorithms. Other layers are returned as is.
+        """
+        if isinstance(layer, RasterSource):
+            return self._write_raster(layer)
+        return layer
 
     def _fix_vector_layer(self, input: QgsVectorLayer) -> QgsVectorLayer:
         """
@@ -92,64 +541,70 @@ class BaseModel(QgsProcessingAlgorithm):
             "INPUT": input,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "native:fixgeometries",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("native:fixgeometries", alg_params)["OUTPUT"]
 
     def _clip_vector_to_studyarea(self, input: QgsVectorLayer) -> QgsVectorLayer:
         """
-        Clip vector layer to algorithm study area.
+        Clip vector layer to algorithm study area, buffered by the largest
+        distance that affects the results.
         """
+        if (
+            self.study_area
+            and isinstance(input, QgsVectorLayer)
+            and (input.geometryType() == QgsWkbTypes.PointGeometry)
+        ):
+            return self.study_area.points_within(
+                input, self._analysis_buffer(), self.context.transformContext()
+            )
         alg_params = {
             "INPUT": input,
-            "OVERLAY": self.studyarea,
+            "OVERLAY": self.clip_area if self.clip_area else self.studyarea,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "native:clip",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("native:clip", alg_params)["OUTPUT"]
 
     def _clip_raster_to_studyarea(
         self, input: QgsRasterLayer, write_to_layer: Optional[str] = None
     ) -> QgsRasterLayer:
         """
-        Clip raster layer to algorithm study area.
+        Clip raster layer to algorithm study area. The block engine masks the
+        layer with the rasterized study area instead of a vector cutline.
         """
+        if self.use_block_engine:
+            return self._write_raster(
+                self._mask_to_study_area(self._raster_source(input)), write_to_layer
+            )
         alg_params = {
             "ALPHA_BAND": False,
             "CROP_TO_CUTLINE": True,
             "DATA_TYPE": 0,
-            "EXTRA": "",
+            "EXTRA": self._warp_threads(),
             "INPUT": input,
             "KEEP_RESOLUTION": False,
             "MASK": self.studyarea,
             "MULTITHREADING": False,
-            "NODATA": None,
-            "OPTIONS": "",
+            "NODATA": self._cutline_nodata(input),
+            "OPTIONS": self._creation_options(),
             "SET_RESOLUTION": False,
             "SOURCE_CRS": None,
             "TARGET_CRS": None,
             "X_RESOLUTION": None,
             "Y_RESOLUTION": None,
-            "OUTPUT": write_to_layer
-            if write_to_layer
-            else QgsProcessing.TEMPORARY_OUTPUT,
+            "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:cliprasterbymasklayer",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        output = self._run_algorithm("gdal:cliprasterbymasklayer", alg_params)
+        return self._write_output(
+            self._keep_scaling(input, output["OUTPUT"]), write_to_layer
+        )
+
+    def _mask_to_study_area(self, source: RasterSource) -> RasterSource:
+        """
+        Set pixels outside the study area to nodata while the source is
+        written. Blocks outside the study area are not computed at all.
+        """
+        if not self.study_area:
+            return source
+        return source.masked(self.study_area.mask())
 
     def _reproject_vector_to_crs(
         self, input: QgsVectorLayer, crs: str
@@ -163,31 +618,42 @@ class BaseModel(QgsProcessingAlgorithm):
             "TARGET_CRS": crs,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
+        output = self._run_algorithm("native:reprojectlayer", alg_params)["OUTPUT"]
         # memory vector layer has to be dug up from the processing context again
-        return self.context.takeResultLayer(
-            processing.run(
-                "native:reprojectlayer",
-                alg_params,
-                context=self.context,
-                feedback=self.feedback,
-                is_child_algorithm=True,
-            )["OUTPUT"]
-        )
+        layer = self.context.takeResultLayer(output)
+        if layer is None:
+            # cached results are files instead
+            layer = QgsVectorLayer(output, "", "ogr")
+        return layer
 
     def _reproject_raster_to_crs(
-        self, input: QgsRasterLayer, crs: str, nodata: int = None
-    ) -> QgsRasterLayer:
+        self,
+        input: Union[QgsRasterLayer, RasterSource],
+        crs: str,
+        nodata: int = None,
+    ) -> Union[QgsRasterLayer, RasterSource]:
 
         """
         Reproject raster layer to given CRS. Optionally, set nodata to desired value.
         """
+        if isinstance(input, RasterSource):
+            if (
+                self.analysis_grid
+                and crs == self.projected_reference_system
+                and input.grid.matches(self.analysis_grid)
+            ):
+                # Results of earlier pipeline stages are already on the grid
+                return input
+            input = self._materialize(input)
+        if self.analysis_grid and crs == self.projected_reference_system:
+            return self._warp_to_grid(input, nodata)
         alg_params = {
             "DATA_TYPE": 0,
-            "EXTRA": "",
+            "EXTRA": self._warp_threads(),
             "INPUT": input,
             "MULTITHREADING": False,
             "NODATA": nodata,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "RESAMPLING": 0,
             "SOURCE_CRS": None,
             "TARGET_CRS": crs,
@@ -196,38 +662,317 @@ class BaseModel(QgsProcessingAlgorithm):
             "TARGET_RESOLUTION": None,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:warpreproject",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        output = self._run_algorithm("gdal:warpreproject", alg_params)["OUTPUT"]
+        return self._keep_scaling(input, output)
+
+    def _warp_to_grid(
+        self, input: QgsRasterLayer, nodata: Optional[int] = None
+    ) -> Optional[Union[QgsRasterLayer, RasterSource]]:
+        """
+        Clip and reproject raster layer on the analysis grid in a single warp.
+        Only the window of the input covering the grid is read, and pixels
+        outside the study area are set to nodata. With the block engine, the
+        warp is run in process and the result kept in memory if it fits.
+        """
+        if self.cutline:
+            source = input.source() if isinstance(input, QgsRasterLayer) else input
+            dataset = gdal.Open(source) if isinstance(source, str) else None
+            # Rasters of other providers are warped by processing instead
+            if dataset is not None:
+                return self._warp_in_process(dataset, input, nodata)
+        xmin, ymin, xmax, ymax = self.analysis_grid.bounds
+        alg_params = {
+            "ALPHA_BAND": False,
+            "CROP_TO_CUTLINE": False,
+            "DATA_TYPE": 0,
+            # Target extent of the analysis grid
+            "EXTRA": f"-te {xmin} {ymin} {xmax} {ymax} {self._warp_threads()}",
+            "INPUT": input,
+            "KEEP_RESOLUTION": False,
+            "MASK": self.studyarea,
+            "MULTITHREADING": False,
+            "NODATA": self._cutline_nodata(input, nodata),
+            "OPTIONS": self._creation_options(),
+            "SET_RESOLUTION": True,
+            "SOURCE_CRS": None,
+            "TARGET_CRS": self.projected_reference_system,
+            "X_RESOLUTION": self.resolution,
+            "Y_RESOLUTION": self.resolution,
+            "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
+        }
+        output = self._run_algorithm("gdal:cliprasterbymasklayer", alg_params)
+        return self._keep_scaling(input, output["OUTPUT"])
+
+    def _warp_in_process(
+        self,
+        dataset: gdal.Dataset,
+        input: Union[QgsRasterLayer, str],
+        nodata: Optional[int] = None,
+    ) -> Optional[FileRaster]:
+        """
+        Warp a raster on the analysis grid with the GDAL library instead of a
+        GDAL process, so the result can be kept in memory. Results that do
+        not fit the memory budget are cached on disk like processing results.
+        Results in memory are not cached, since warping them again is cheaper
+        than reading them from disk. Returns None if the run is canceled.
+        """
+        grid = self.analysis_grid
+        size = estimated_size(grid, dataset.GetRasterBand(1).DataType)
+        key = None
+        if self.cache is not None and not self.intermediates.fits(size):
+            key = self.cache.key(
+                WARP_TO_GRID,
+                {
+                    "INPUT": input,
+                    "MASK": self.studyarea,
+                    "GRID": [grid.geotransform, grid.xsize, grid.ysize, grid.crs_wkt],
+                    "NODATA": nodata,
+                },
+                self.context,
+            )
+            cached = self.cache.get(key, ".tif") if key else None
+            if cached:
+                self.feedback.pushInfo("Using cached result of warping to the grid")
+                return FileRaster(cached)
+        spill_path = self.cache.partial_path(key, ".tif") if key else None
+        path = self.intermediates.path("warped.tif", size, spill_path)
+
+        def progress(complete: float, message: str, data: Any) -> int:
+            self.feedback.setProgress(100 * complete)
+            return 0 if self.feedback.isCanceled() else 1
+
+        options = gdal.WarpOptions(
+            format="GTiff",
+            outputBounds=grid.bounds,
+            width=grid.xsize,
+            height=grid.ysize,
+            dstSRS=grid.crs_wkt,
+            cutlineDSName=self.cutline,
+            dstNodata=cutline_nodata(dataset.GetDescription(), nodata),
+            multithread=self.workers > 1,
+            warpOptions=[f"NUM_THREADS={self.workers}"],
+            creationOptions=list(OUTPUT_PROFILES["fast-temp"].options),
+            callback=progress,
+        )
+        warped = gdal.Warp(path, dataset, options=options)
+        if warped is None:
+            self.intermediates.release(path)
+            if self.feedback.isCanceled():
+                return None
+            raise QgsProcessingException(f"Could not warp {dataset.GetDescription()}")
+        warped = None
+        copy_scaling(dataset.GetDescription(), path)
+        if path == spill_path:
+            return FileRaster(self.cache.add(key, ".tif"))
+        return self.intermediates.raster(path)
+
+    def _write_cutline(self, study_area: StudyArea) -> str:
+        """
+        Write the dissolved study area to a file GDAL can read, e.g. as a warp
+        cutline. The study area may be a memory layer only processing can read.
+        """
+        return self._save_vector(
+            study_area.buffered(0), self._temporary_path("studyarea.gpkg")
+        )
+
+    def _save_vector(self, layer: QgsVectorLayer, output: Optional[str]) -> str:
+        """
+        Save a layer built by the model to the output path, in the format of
+        its extension. Without a path, the layer is kept in the context as a
+        temporary layer and its id is returned, like processing does.
+        """
+        if not output:
+            self.context.temporaryLayerStore().addMapLayer(layer)
+            return layer.id()
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = QgsVectorFileWriter.driverForExtension(
+            os.path.splitext(output)[1]
+        )
+        error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+            layer, output, self.context.transformContext(), options
+        )
+        if error != QgsVectorFileWriter.NoError:
+            raise QgsProcessingException(f"Could not write {output}: {message}")
+        return output
+
+    def _zonal_accumulator(
+        self, grid: RasterGrid
+    ) -> Optional[Tuple[ZonalAccumulator, List[QgsFeature]]]:
+        """
+        Accumulator of the statistics of a result on the grid per zone, and
+        the zones in the order of their ids. The zones are rasterized on the
+        grid once, so the statistics can be gathered while the result is
+        written. Returns None if there are no zones.
+        """
+        if self.zones is None:
+            return None
+        crs = QgsCoordinateReferenceSystem.fromWkt(grid.crs_wkt)
+        transform = QgsCoordinateTransform(
+            self.zones.crs(), crs, self.context.transformContext()
+        )
+        fields = QgsFields()
+        fields.append(QgsField("zone", QVariant.Int))
+        ids = QgsMemoryProviderUtils.createMemoryLayer(
+            "zones", fields, self.zones.wkbType(), crs
+        )
+        zones = list(self.zones.getFeatures())
+        features = []
+        for zone_id, zone in enumerate(zones, 1):
+            geometry = QgsGeometry(zone.geometry())
+            geometry.transform(transform)
+            feature = QgsFeature(fields)
+            feature.setGeometry(geometry)
+            feature.setAttributes([zone_id])
+            features.append(feature)
+        ids.dataProvider().addFeatures(features)
+        vector = self._save_vector(ids, self._temporary_path("zones.gpkg"))
+        path = self.intermediates.path(
+            "zones.tif", estimated_size(grid, gdal.GDT_Int32)
+        )
+        options = gdal.RasterizeOptions(
+            format="GTiff",
+            outputType=gdal.GDT_Int32,
+            outputBounds=grid.bounds,
+            width=grid.xsize,
+            height=grid.ysize,
+            outputSRS=grid.crs_wkt,
+            attribute="zone",
+            initValues=[0],
+            noData=0,
+            creationOptions=list(OUTPUT_PROFILES["fast-temp"].options),
+        )
+        if gdal.Rasterize(path, vector, options=options) is None:
+            self.intermediates.release(path)
+            raise QgsProcessingException("Could not rasterize the zones")
+        return ZonalAccumulator(self.intermediates.raster(path), len(zones)), zones
+
+    def _write_zonal_statistics(
+        self, zonal: Optional[Tuple[ZonalAccumulator, List[QgsFeature]]]
+    ) -> None:
+        """
+        Write the statistics of each zone with the zone attributes: number of
+        pixels with a value, mean, minimum, maximum and number of pixels in
+        each class.
+        """
+        if zonal is None or self.feedback.isCanceled():
+            return
+        accumulator, zones = zonal
+        fields = QgsFields(self.zones.fields())
+        fields.append(QgsField("pixels", QVariant.Int))
+        for name in ("mean", "min", "max"):
+            fields.append(QgsField(name, QVariant.Double))
+        for suitability_class in range(1, accumulator.class_count + 1):
+            fields.append(QgsField(f"class_{suitability_class}", QVariant.Int))
+        layer = QgsMemoryProviderUtils.createMemoryLayer(
+            "Zonal statistics", fields, self.zones.wkbType(), self.zones.crs()
+        )
+        features = []
+        for zone, statistics in zip(zones, accumulator.result()):
+            feature = QgsFeature(fields)
+            feature.setGeometry(zone.geometry())
+            summary = [statistics.mean, statistics.min, statistics.max]
+            feature.setAttributes(
+                zone.attributes()
+                + [statistics.count]
+                + [None if np.isnan(value) else value for value in summary]
+                + statistics.histogram.tolist()
+            )
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        layer.updateExtents()
+        self.zonal_statistics = self._save_vector(
+            layer, self.parameters.get("ZonalStatistics")
+        )
+
+    def _zonal_results(self) -> Dict[str, str]:
+        """
+        Zonal statistics to add to the results of the model, if any.
+        """
+        if not self.zonal_statistics:
+            return {}
+        return {"ZonalStatistics": self.zonal_statistics}
+
+    def _keep_scaling(
+        self, input: Union[QgsRasterLayer, str], output: Union[QgsRasterLayer, str]
+    ) -> Union[QgsRasterLayer, str]:
+        """
+        Keep the scale and offset of weighted sums stored as scaled integers
+        in rasters warped from them.
+        """
+        if isinstance(input, QgsRasterLayer):
+            input = input.source()
+        if isinstance(input, str) and isinstance(output, str):
+            copy_scaling(input, output)
+        return output
+
+    def _warp_threads(self) -> str:
+        """
+        Extra gdalwarp arguments to warp with the workers of the branch.
+        Processing would use all the cores instead.
+        """
+        if self.workers <= 1:
+            return ""
+        return f"-multi -wo NUM_THREADS={self.workers}"
+
+    def _cutline_nodata(
+        self, input: Union[QgsRasterLayer, str], nodata: Optional[float] = None
+    ) -> float:
+        """
+        Nodata value for warping the input with the study area as cutline.
+        """
+        if isinstance(input, QgsRasterLayer):
+            input = input.source()
+        return cutline_nodata(input, nodata)
 
     def _get_layer_statistics(self, layer: QgsRasterLayer) -> Dict[str, float]:
         """
         Get raster layer statistics.
         """
+        if self.use_block_engine:
+            # Single block pass, memoized per raster file
+            return get_statistics(self._raster_source(layer)).as_dict()
         alg_params = {
             "BAND": 1,
-            "INPUT": layer,
+            "INPUT": self._materialize(layer),
         }
-        statistics = processing.run(
-            "native:rasterlayerstatistics",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )
+        statistics = self._run_algorithm("native:rasterlayerstatistics", alg_params)
         return statistics
 
-    def _normalize_layer(self, layer: QgsRasterLayer) -> QgsRasterLayer:
+    def _get_stack_statistics(
+        self, layers: List[Union[QgsRasterLayer, RasterSource]]
+    ) -> List[Dict[str, float]]:
+        """
+        Get statistics of several raster layers. The block engine reads the
+        layers on the same grid in one shared pass.
         """
-        Scale layer to 0...1.
+        if self.use_block_engine:
+            return [
+                statistics.as_dict()
+                for statistics in get_stack_statistics(
+                    [self._raster_source(layer) for layer in layers],
+                    workers=self.workers,
+                )
+            ]
+        return [self._get_layer_statistics(layer) for layer in layers]
+
+    def _normalize_layer(
+        self,
+        layer: QgsRasterLayer,
+        statistics: Optional[Dict[str, float]] = None,
+    ) -> Union[QgsRasterLayer, LazyRaster]:
         """
-        statistics = self._get_layer_statistics(layer)
+        Scale layer to 0...1. If the minimum and maximum of the layer are
+        already known, e.g. from the stage that produced the layer, they may
+        be given in statistics to avoid scanning the layer.
+        """
+        if statistics is None:
+            statistics = self._get_layer_statistics(layer)
         min = statistics["MIN"]
         max = statistics["MAX"]
+        if self.use_block_engine:
+            return self._raster_source(layer).map(
+                lambda values: (values - min) / (max - min)
+            )
         expression = f"(A - {min})/({max} - {min})"
         alg_params = {
             "BAND_A": 1,
@@ -235,32 +980,70 @@ class BaseModel(QgsProcessingAlgorithm):
             "FORMULA": expression,
             "INPUT_A": layer,
             "NO_DATA": None,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "RTYPE": 5,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:rastercalculator",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:rastercalculator", alg_params)["OUTPUT"]
 
     def _merge_layers(
         self,
-        layers: List[QgsRasterLayer],
+        layers: List[Union[QgsRasterLayer, LazyRaster]],
         weights: List[float],
         write_to_layer: Optional[str] = None,
+        clip: bool = False,
     ) -> QgsRasterLayer:
         """
         Merge raster layers together and calculate their weighted sum. Note
         that the layers have to be normalized or otherwise use common units.
+        If clip is set, the sum is clipped to the study area. The block engine
+        masks the sum while writing it, without a separate clip pass. If zones
+        were given, the sum is also summarized by zone.
 
         Note that all the raster layers must have the same CRS. They are not
         reprojected here.
         """
+        if self.use_block_engine:
+            sum = self._weighted_sum(layers, weights)
+            if clip:
+                sum = self._mask_to_study_area(sum)
+            stored = as_scaled_sum(
+                sum, self.sum_data_type, self._sum_range(self.parameters, weights)
+            )
+            # Zonal statistics are gathered in the same pass
+            zonal = self._zonal_accumulator(stored.grid)
+            result = self._write_raster(
+                stored,
+                write_to_layer,
+                observers=[zonal[0].update] if zonal else (),
+            )
+            self._write_zonal_statistics(zonal)
+            return result
+        if clip and self.studyarea:
+            result = self._clip_raster_to_studyarea(
+                self._merge_with_gdal(layers, weights), write_to_layer
+            )
+        else:
+            result = self._merge_with_gdal(layers, weights, write_to_layer)
+        if self.zones is not None and not self.feedback.isCanceled():
+            # GDAL algorithms have no block pass to hook into, so the result
+            # is read once more
+            source = self._raster_source(result)
+            zonal = self._zonal_accumulator(source.grid)
+            for window in source.grid.windows():
+                zonal[0].update(window, source.read(window))
+            self._write_zonal_statistics(zonal)
+        return result
 
+    def _merge_with_gdal(
+        self,
+        layers: List[QgsRasterLayer],
+        weights: List[float],
+        write_to_layer: Optional[str] = None,
+    ) -> QgsRasterLayer:
+        """
+        Weighted sum of raster layers with GDAL algorithms.
+        """
         # Merge to separate channels
         alg_params = {
             "DATA_TYPE": 5,
@@ -268,18 +1051,12 @@ class BaseModel(QgsProcessingAlgorithm):
             "INPUT": layers,
             "NODATA_INPUT": None,
             "NODATA_OUTPUT": None,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "PCT": False,
             "SEPARATE": True,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        merged = processing.run(
-            "gdal:merge",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        merged = self._run_algorithm("gdal:merge", alg_params)["OUTPUT"]
 
         # Raster calculator
         band_params = {}
@@ -297,66 +1074,115 @@ class BaseModel(QgsProcessingAlgorithm):
             "FORMULA": sum_expression,
             **input_params,
             "NO_DATA": None,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "RTYPE": 5,
-            "OUTPUT": write_to_layer
-            if write_to_layer
-            else QgsProcessing.TEMPORARY_OUTPUT,
+            "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:rastercalculator",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        output = self._run_algorithm("gdal:rastercalculator", alg_params)["OUTPUT"]
+        return self._write_output(output, write_to_layer)
+
+    def _weighted_sum(
+        self,
+        layers: List[Union[QgsRasterLayer, RasterSource]],
+        weights: List[float],
+    ) -> RasterSource:
+        """
+        Lazy weighted sum of raster layers with the block engine. Layers on
+        different grids are stacked virtually and resampled on the fly, so
+        there is no need for a merged multiband copy.
+        """
+        sources = [self._raster_source(layer) for layer in layers]
+        return weighted_sum(sources, weights)
+
+    def _analysis_grid(self, extent: QgsRectangle) -> RasterGrid:
+        """
+        Analysis grid covering the extent, snapped to the analysis resolution.
+        """
+        crs = QgsCoordinateReferenceSystem(self.projected_reference_system)
+        return RasterGrid.from_bounds(
+            (
+                extent.xMinimum(),
+                extent.yMinimum(),
+                extent.xMaximum(),
+                extent.yMaximum(),
+            ),
+            self.resolution,
+            crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL),
+        )
+
+    def _grid_extent(self, grid: Optional[RasterGrid] = None) -> str:
+        """
+        Extent of the grid, by default the analysis grid, in the format of
+        processing extent parameters.
+        """
+        xmin, ymin, xmax, ymax = (grid or self.analysis_grid).bounds
+        return f"{xmin},{xmax},{ymin},{ymax} [{self.projected_reference_system}]"
+
+    def _distance_grid(self) -> RasterGrid:
+        """
+        Analysis grid expanded by the largest distance that affects the
+        results, so that features outside the study area are rasterized and
+        still count for the distances inside it.
+        """
+        return self.analysis_grid.expanded(self._analysis_buffer())
+
+    def _crop_to_analysis_grid(
+        self, input: Union[QgsRasterLayer, RasterSource]
+    ) -> Union[QgsRasterLayer, RasterSource]:
+        """
+        Crop a raster on the distance grid to the analysis grid.
+        """
+        if isinstance(input, RasterSource):
+            return input.cropped(self.analysis_grid)
+        alg_params = {
+            "DATA_TYPE": 0,
+            "EXTRA": "",
+            "INPUT": input,
+            "NODATA": None,
+            "OPTIONS": self._creation_options(),
+            "OVERCRS": False,
+            "PROJWIN": self._grid_extent(),
+            "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
+        }
+        return self._run_algorithm("gdal:cliprasterbyextent", alg_params)["OUTPUT"]
 
     def _rasterize_vector(self, input: QgsVectorLayer) -> QgsRasterLayer:
         """
-        Rasterize input layer within the model study area.
+        Rasterize input layer within the model study area, buffered by the
+        largest distance that affects the results.
 
         The vector rasterization assumes projected_reference_system will have units
         of approximately one meter. The more the coordinate system unit differs
         from meter, the larger the error in all distances.
 
         Since the study size can be small or large, the default is EPSG:3857. That way
-        we will get 100x100m resolution on the equator and larger away from the
+        the default resolution is 100x100m on the equator and larger away from the
         equator. Similarly, the extent has to be calculated in the same crs.
         """
-        area_projected = self._reproject_vector_to_crs(
-            self.studyarea, self.projected_reference_system
-        )
         input_projected = self._reproject_vector_to_crs(
             input, self.projected_reference_system
         )
-        extent = area_projected.extent()
-        self.feedback.pushInfo(str(extent.area()))
-        self.feedback.pushInfo(
-            f"{extent.xMinimum()},{extent.xMaximum()},{extent.yMinimum()},{extent.yMaximum()}"  # noqa
-        )
+        # The vector is burned directly on the analysis grid, expanded so that
+        # features just outside the study area are kept
+        extent = self._grid_extent(self._distance_grid())
+        self.feedback.pushInfo(extent)
         alg_params = {
             "BURN": 1,  # Just burn any non-zero value
-            "DATA_TYPE": 5,
-            "EXTENT": f"{extent.xMinimum()},{extent.xMaximum()},{extent.yMinimum()},{extent.yMaximum()}",  # noqa
+            "DATA_TYPE": 0,
+            "EXTENT": extent,
             "EXTRA": "",
-            "HEIGHT": 100,  # 100x100 meter resolution with ideal PRS
+            "HEIGHT": self.resolution,
             "INIT": None,
             "INPUT": input_projected,
             "INVERT": False,
             "NODATA": 0,  # Zero (no schools in pixel) must be nodata in our result!
-            "OPTIONS": "",
-            "UNITS": 1,  # 100x100 meter resolution with ideal PRS
+            "OPTIONS": self._creation_options(),
+            "UNITS": 1,  # Georeferenced units, i.e. meters with ideal PRS
             "USE_Z": False,
-            "WIDTH": 100,  # 100x100 meter resolution with ideal PRS
+            "WIDTH": self.resolution,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:rasterize",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:rasterize", alg_params)["OUTPUT"]
 
     def _proximity_map(
         self, input: QgsRasterLayer, max_distance: float
@@ -371,19 +1197,13 @@ class BaseModel(QgsProcessingAlgorithm):
             "INPUT": input,
             "MAX_DISTANCE": max_distance,
             "NODATA": max_distance,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "REPLACE": 0,
             "UNITS": 0,
             "VALUES": "",
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:proximity",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:proximity", alg_params)["OUTPUT"]
 
     def _classify_by_distance(
         self,
@@ -393,7 +1213,7 @@ class BaseModel(QgsProcessingAlgorithm):
         further_is_better: bool = False,
         too_close_classification: int = 4,
         too_far_classification: int = 4,
-    ) -> QgsRasterLayer:
+    ) -> Union[QgsRasterLayer, LazyRaster]:
         """
         Returns area classification raster around location raster input. Input
         layer is assumed to be in a projected CRS with units in meters. Points within
@@ -404,6 +1224,17 @@ class BaseModel(QgsProcessingAlgorithm):
         max_distance: Maximum acceptable distance in meters for classification 1-3.
         further_is_better: Whether class will decrease or increase by distance.
         """
+        if self.use_block_engine:
+            # Exact distances are computed block by block from the input
+            # pixels, without an intermediate proximity raster
+            return DistanceClassRaster(
+                self._raster_source(input),
+                min_distance,
+                max_distance,
+                further_is_better,
+                too_close_classification,
+                too_far_classification,
+            )
         proximity_layer = self._proximity_map(input, max_distance)
         # concentric buffers around input non-zero pixels will have different
         # suitability values
@@ -421,18 +1252,90 @@ class BaseModel(QgsProcessingAlgorithm):
             "EXTRA": "",
             "FORMULA": expression,
             "INPUT_A": proximity_layer,
-            "NO_DATA": None,  # The result will not have nodata pixels
-            "OPTIONS": "",
-            "RTYPE": 4,
+            "NO_DATA": CLASS_NODATA,
+            "OPTIONS": self._creation_options(),
+            "RTYPE": 0,  # Classes are stored as bytes
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:rastercalculator",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:rastercalculator", alg_params)["OUTPUT"]
+
+    def _classify_by_vector_distance(
+        self,
+        input: QgsVectorLayer,
+        min_distance: float,
+        max_distance: float,
+        further_is_better: bool = False,
+        too_close_classification: int = 4,
+        too_far_classification: int = 4,
+    ) -> VectorDistanceClassRaster:
+        """
+        Same classification as _classify_by_distance, but the distances are
+        computed directly from the point or line features of the input layer,
+        on the analysis grid. There is no need to rasterize
+        the features first, so sparse layers only cost work near the features.
+        The index of the features is shared by the runs with the same input.
+        """
+        crs = self.projected_reference_system
+        index = shared_index(
+            identity_key([VectorDistanceIndex.__name__, input, crs], self.context),
+            lambda: VectorDistanceIndex(self._reproject_vector_to_crs(input, crs)),
+        )
+        return VectorDistanceClassRaster(
+            index,
+            self.analysis_grid,
+            min_distance,
+            max_distance,
+            further_is_better,
+            too_close_classification,
+            too_far_classification,
+        )
+
+    def _classify_features_by_distance(
+        self,
+        input: QgsVectorLayer,
+        min_distance: float,
+        max_distance: float,
+        further_is_better: bool = False,
+        too_close_classification: int = 4,
+        too_far_classification: int = 4,
+    ) -> Optional[Union[QgsRasterLayer, RasterSource]]:
+        """
+        Classify by distance to the features of a vector layer: either
+        compute the distances from the vectors directly, or clip the features
+        to the buffered study area, rasterize them on the distance grid,
+        classify and crop the classes to the analysis grid.
+        """
+        # The clip is buffered by the largest distance, so features outside
+        # it do not change the distances in the study area. Distances from
+        # the vectors are computed from the whole layer instead, so that its
+        # index is shared by all the study areas of a batch.
+        if self.studyarea and not self.use_vector_distances:
+            input = self._clip_vector_to_studyarea(input)
+        if self.feedback.isCanceled():
+            return None
+        if self.use_vector_distances:
+            return self._classify_by_vector_distance(
+                input,
+                min_distance,
+                max_distance,
+                further_is_better,
+                too_close_classification,
+                too_far_classification,
+            )
+        rasterized = self._rasterize_vector(input)
+        if self.feedback.isCanceled():
+            return None
+        classified = self._classify_by_distance(
+            rasterized,
+            min_distance,
+            max_distance,
+            further_is_better,
+            too_close_classification,
+            too_far_classification,
+        )
+        if self.feedback.isCanceled():
+            return None
+        return self._crop_to_analysis_grid(classified)
 
     def _fill_nodata(self, input: QgsRasterLayer, value: int) -> QgsRasterLayer:
         """
@@ -444,13 +1347,7 @@ class BaseModel(QgsProcessingAlgorithm):
             "INPUT": input,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "native:fillnodata",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("native:fillnodata", alg_params)["OUTPUT"]
 
     def _classify_by_threshold(
         self,
@@ -458,7 +1355,7 @@ class BaseModel(QgsProcessingAlgorithm):
         threshold: int,
         invert: bool = False,
         nodata_suitability: int = 4,
-    ) -> QgsRasterLayer:
+    ) -> Union[QgsRasterLayer, LazyRaster]:
         """
         Classify raster to suitable (1) or unsuitable (4) by threshold value. Also
         the suitability value for nodata pixels can be set. By default, nodata
@@ -472,6 +1369,17 @@ class BaseModel(QgsProcessingAlgorithm):
         # invert: True returns 0 (above 100) or 1 (below 100) or 4 (zero density)
         # 0 will always be the best, i.e. the result is opposite to that intended!!
         # Nodata will always be the worst.
+        if self.use_block_engine:
+
+            def _threshold(values: np.ndarray) -> np.ndarray:
+                suitable = values < threshold if invert else values >= threshold
+                return np.where(
+                    np.isnan(values), nodata_suitability, np.where(suitable, 1, 4)
+                )
+
+            return as_classes(
+                self._raster_source(input).map(_threshold, propagate_nodata=False)
+            )
         if invert:
             expression = f"(A < {threshold}) + 4*(A >= {threshold})"
         else:
@@ -482,48 +1390,45 @@ class BaseModel(QgsProcessingAlgorithm):
             "FORMULA": expression,
             "INPUT_A": input,
             "NO_DATA": 0,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "RTYPE": 0,  # We don't want a huge 32bit geotiff
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        thresholded = processing.run(
-            "gdal:rastercalculator",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        thresholded = self._run_algorithm("gdal:rastercalculator", alg_params)["OUTPUT"]
         filled_and_thresholded = self._fill_nodata(thresholded, nodata_suitability)
         return filled_and_thresholded
 
-    def _classify_by_value(self, layer: QgsRasterLayer) -> QgsRasterLayer:
+    def _classify_by_value(
+        self,
+        layer: QgsRasterLayer,
+        statistics: Optional[Dict[str, float]] = None,
+    ) -> Union[QgsRasterLayer, LazyRaster]:
         """
         Classify raster from suitable (1) to unsuitable (4) and in between,
-        dividing positive value range to four parts.
+        dividing positive value range to four parts. Known layer minimum and
+        maximum may be given in statistics.
         """
         # First we need layer statistics
-        statistics = self._get_layer_statistics(layer)
+        if statistics is None:
+            statistics = self._get_layer_statistics(layer)
         min = statistics["MIN"]
         max = statistics["MAX"]
-        scale = 4
-        # Use the ceiling function to get the scale 1 to 4.
-        # However, index values of exactly zero must be handled separately to
-        # map to 1.
-        expression = f"ceil({scale}*(A - {min})/({max} - {min}))*(A > 0) + (A == 0)"
+        # Use the ceiling function to get the scale 1 to 4, the same in both
+        # implementations
+        if self.use_block_engine:
+            return as_classes(
+                self._raster_source(layer).map(
+                    lambda values: classify_value(values, min, max)
+                )
+            )
         alg_params = {
             "BAND_A": 1,
             "EXTRA": "",
-            "FORMULA": expression,
+            "FORMULA": VALUE_CLASS_EXPRESSION.format(minimum=min, maximum=max),
             "INPUT_A": layer,
-            "NO_DATA": None,
-            "OPTIONS": "",
-            "RTYPE": 5,
+            "NO_DATA": CLASS_NODATA,
+            "OPTIONS": self._creation_options(),
+            "RTYPE": 0,  # Classes are stored as bytes
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:rastercalculator",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:rastercalculator", alg_params)["OUTPUT"]
@@ -0,0 +1,391 @@
+"""
+Batch runs of the model chain for many study areas.
+
+A parameter file gives the parameters of each step of the chain, e.g.
+
+    {
+        "studyareas": "districts.gpkg",
+        "id_field": "district_id",
+        "output_directory": "results",
+        "defaults": {"ProjectedReferenceSystem": "EPSG:32736"},
+        "steps": {
+            "hri": {"Layers": ["floods.tif", "landslides.tif"], ...},
+            "environmental": {"MultiHazardRisk": "@hri", ...},
+            "mcda": {"Layers": ["@economic", "@environmental"], ...},
+            "candidates": {"Suitability": "@mcda", "CandidateCount": 10}
+        }
+    }
+
+Study areas are either the features of one layer, grouped by id_field, or a
+list of polygon files. Step parameters are those the panels give to the
+algorithms, and "@step" refers to the result of an earlier step for the same
+area. Relative paths are relative to the parameter file.
+
+The areas are run on a thread pool. QGIS layers must not be used by several
+threads at once, so each area opens the inputs in a context of its own.
+Results that do not depend on the area, e.g. fixed road
+geometries, are computed by the first area and found in the result cache by
+the rest. Outputs of each area are written to a directory of their own, and
+a manifest of the run to the output directory.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from qgis.core import (
+    QgsExpression,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingException,
+    QgsProcessingFeedback,
+    QgsProcessingMultiStepFeedback,
+    QgsProcessingUtils,
+    QgsVectorLayer,
+)
+
+from .candidates_model import CandidateSites
+from .economic_model import EconomicSuitability
+from .environmental_model import EnvironmentalSuitability
+from .hri_model import NaturalHazardRisksForSchools
+from .infrastructure_model import InfrastructureSuitability
+from .intermediates import remove_temporary_directory
+from .mcda_model import Mcda
+
+# Steps of the chain in the order they are run, with their algorithm and output
+# parameters. Other steps refer to the first output.
+STEPS: Dict[str, Tuple[Type[QgsProcessingAlgorithm], List[str]]] = {
+    "hri": (NaturalHazardRisksForSchools, ["OutputRaster", "SampledOutput"]),
+    "environmental": (EnvironmentalSuitability, ["EnvironmentalSuitability"]),
+    "economic": (EconomicSuitability, ["EconomicSuitability"]),
+    "infrastructure": (InfrastructureSuitability, ["InfrastructureSuitability"]),
+    "mcda": (Mcda, ["OutputRaster"]),
+    "candidates": (CandidateSites, ["CandidatesOutput"]),
+}
+
+# Outputs that are vector layers, the rest are rasters
+VECTOR_OUTPUTS = ["SampledOutput", "CandidatesOutput"]
+
+MANIFEST_NAME = "manifest.json"
+
+
+def load_parameter_file(path: str) -> Dict[str, Any]:
+    """
+    Read a batch parameter file and make the paths in it absolute.
+    """
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    def absolute(value: Any) -> Any:
+        if isinstance(value, list):
+            return [absolute(item) for item in value]
+        if isinstance(value, dict):
+            return {key: absolute(item) for key, item in value.items()}
+        if (
+            isinstance(value, str)
+            and not value.startswith("@")
+            and not os.path.isabs(value)
+            and os.path.exists(os.path.join(directory, value.split("|")[0]))
+        ):
+            return os.path.join(directory, value)
+        return value
+
+    config = absolute(config)
+    config["parameter_file"] = os.path.abspath(path)
+    config["output_directory"] = os.path.join(
+        directory, config.get("output_directory", "results")
+    )
+    steps = _steps(config)
+    unknown = set(steps) - set(STEPS)
+    if unknown:
+        raise ValueError(f"Unknown steps {', '.join(sorted(unknown))}")
+    for name, parameters in steps.items():
+        for reference in _references(parameters):
+            if reference not in steps or list(STEPS).index(reference) >= list(
+                STEPS
+            ).index(name):
+                raise ValueError(f"Step {name} refers to {reference} before it is run")
+    return config
+
+
+def _steps(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Parameters of the steps of a parameter file by step name.
+    """
+    steps = config.get("steps")
+    if not steps:
+        raise ValueError("The parameter file has no steps")
+    return steps
+
+
+def _references(value: Any) -> List[str]:
+    """
+    Steps referred to by a parameter value.
+    """
+    if isinstance(value, list):
+        return [reference for item in value for reference in _references(item)]
+    if isinstance(value, dict):
+        return [reference for item in value.values() for reference in _references(item)]
+    if isinstance(value, str) and value.startswith("@"):
+        return [value[1:]]
+    return []
+
+
+def study_areas(config: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """
+    Id, source and subset string of each study area.
+    """
+    areas = config["studyareas"]
+    if isinstance(areas, list):
+        return [
+            (os.path.splitext(os.path.basename(path.split("|")[0]))[0], path, "")
+            for path in areas
+        ]
+    field = config["id_field"]
+    layer = QgsVectorLayer(areas, "studyareas", "ogr")
+    if not layer.isValid():
+        raise QgsProcessingException(f"Could not open study areas {areas}")
+    index = layer.fields().indexOf(field)
+    if index < 0:
+        raise QgsProcessingException(f"Study areas have no field {field}")
+    return [
+        (
+            str(value),
+            areas,
+            f"{QgsExpression.quotedColumnRef(field)} = "
+            f"{QgsExpression.quotedValue(value)}",
+        )
+        for value in sorted(layer.uniqueValues(index), key=str)
+        if value is not None
+    ]
+
+
+def _open_inputs(value: Any, context: QgsProcessingContext) -> Any:
+    """
+    Replace input paths in parameter values with layers owned by the context.
+    """
+    if isinstance(value, list):
+        return [_open_inputs(item, context) for item in value]
+    if isinstance(value, dict):
+        return {key: _open_inputs(item, context) for key, item in value.items()}
+    if isinstance(value, str) and os.path.exists(value.split("|")[0]):
+        layer = QgsProcessingUtils.mapLayerFromString(value, context, True)
+        if layer is not None:
+            return layer
+    return value
+
+
+def _resolve(value: Any, results: Dict[str, str]) -> Any:
+    if isinstance(value, list):
+        return [_resolve(item, results) for item in value]
+    if isinstance(value, dict):
+        return {key: _resolve(item, results) for key, item in value.items()}
+    if isinstance(value, str) and value.startswith("@"):
+        return results[value[1:]]
+    return value
+
+
+def _directory_name(area_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", area_id)
+
+
+class BatchRunner:
+    """
+    Run the steps of a parameter file for all its study areas.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.config = config
+        self.context = context
+        self.feedback = feedback
+        self.workers = max(workers or config.get("workers") or 1, 1)
+        self.output_directory: str = config["output_directory"]
+        # Parameters common to all the steps, by default dividing the cores
+        # between the areas run at the same time
+        self.defaults: Dict[str, Any] = {
+            "ProjectedReferenceSystem": "EPSG:3857",
+            "Workers": max((os.cpu_count() or 1) // self.workers, 1),
+            **config.get("defaults", {}),
+        }
+        steps = _steps(config)
+        self.steps: Dict[str, Dict[str, Any]] = {
+            name: steps[name] for name in STEPS if name in steps
+        }
+        self.manifest: Dict[str, Any] = {}
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run all the areas and return the manifest of the run.
+        """
+        areas = study_areas(self.config)
+        os.makedirs(self.output_directory, exist_ok=True)
+        self.manifest = {
+            "parameter_file": self.config.get("parameter_file"),
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "steps": list(self.steps),
+            "areas": {},
+        }
+        if not areas:
+            self.feedback.reportError("No study areas to run")
+            return self.manifest
+        progress: Dict[str, float] = {}
+
+        def report_progress(area_id: str, value: float) -> None:
+            progress[area_id] = value
+            self.feedback.setProgress(sum(progress.values()) / len(areas))
+
+        def finish(area_id: str, entry: Dict[str, Any]) -> None:
+            self.manifest["areas"][area_id] = entry
+            report_progress(area_id, 100)
+            if entry["status"] == "failed":
+                self.feedback.reportError(f"{area_id}: {entry['error']}")
+            else:
+                self.feedback.pushInfo(
+                    f"{area_id}: {entry['status']} in {entry['seconds']} s "
+                    f"({len(self.manifest['areas'])}/{len(areas)})"
+                )
+            self._write_manifest()
+
+        # The first area fills the result cache with the results shared by all
+        first, rest = areas[0], areas[1:]
+        finish(first[0], self._run_area(*first, report_progress))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self._run_area, *area, report_progress): area[0]
+                for area in rest
+            }
+            for future in as_completed(futures):
+                finish(futures[future], future.result())
+        self.manifest["finished"] = datetime.now().isoformat(timespec="seconds")
+        self._write_manifest()
+        return self.manifest
+
+    def _run_area(
+        self, area_id: str, source: str, subset: str, report_progress: Any
+    ) -> Dict[str, Any]:
+        """
+        Run the steps for one area. Errors are recorded in the manifest entry
+        of the area, so that one failing area does not stop the batch.
+        """
+        start = time.time()
+        entry: Dict[str, Any] = {"status": "canceled", "outputs": {}}
+        if self.feedback.isCanceled():
+            return entry
+        feedback = QgsProcessingFeedback()
+        self.feedback.canceled.connect(feedback.cancel)
+        feedback.progressChanged.connect(lambda value: report_progress(area_id, value))
+        steps = QgsProcessingMultiStepFeedback(len(self.steps), feedback)
+        # Each thread needs a context of its own
+        context = QgsProcessingContext()
+        context.copyThreadSafeSettings(self.context)
+        directory = os.path.join(self.output_directory, _directory_name(area_id))
+        os.makedirs(directory, exist_ok=True)
+        # Intermediates of the area are removed once the area is done
+        temporary = tempfile.mkdtemp(
+            prefix=f"{_directory_name(area_id)}_", dir=QgsProcessingUtils.tempFolder()
+        )
+        try:
+            studyarea = QgsVectorLayer(source, area_id, "ogr")
+            if subset:
+                studyarea.setSubsetString(subset)
+            results: Dict[str, str] = {}
+            inputs = _open_inputs(self.steps, context)
+            for index, (name, parameters) in enumerate(inputs.items()):
+                steps.setCurrentStep(index)
+                outputs = self._run_step(
+                    name,
+                    parameters,
+                    studyarea,
+                    results,
+                    directory,
+                    temporary,
+                    context,
+                    steps,
+                )
+                if feedback.isCanceled():
+                    return entry
+                entry["outputs"][name] = outputs
+                results[name] = outputs[STEPS[name][1][0]]
+            entry["status"] = "ok"
+        except Exception as error:
+            entry["status"] = "failed"
+            entry["error"] = str(error)
+        finally:
+            self.feedback.canceled.disconnect(feedback.cancel)
+            remove_temporary_directory(
+                temporary,
+                [
+                    path
+                    for outputs in entry["outputs"].values()
+                    for path in outputs.values()
+                ],
+            )
+            entry["seconds"] = round(time.time() - start, 1)
+        return entry
+
+    def _run_step(
+        self,
+        name: str,
+        parameters: Dict[str, Any],
+        studyarea: QgsVectorLayer,
+        results: Dict[str, str],
+        directory: str,
+        temporary: str,
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+    ) -> Dict[str, str]:
+        """
+        Run the algorithm of a step like the panels do and return its outputs.
+        """
+        algorithm_class, output_names = STEPS[name]
+        parameters = {
+            **self.defaults,
+            "Studyarea": studyarea,
+            "LayerNames": {output: output for output in output_names},
+            "TemporaryDirectory": temporary,
+            **_resolve(parameters, results),
+        }
+        for output in output_names:
+            extension = ".gpkg" if output in VECTOR_OUTPUTS else ".tif"
+            suffix = "" if output == output_names[0] else f"_{output}"
+            parameters[output] = os.path.join(directory, f"{name}{suffix}{extension}")
+        algorithm = algorithm_class()
+        algorithm.initAlgorithm()
+        if not algorithm.prepare(parameters, context, feedback):
+            raise QgsProcessingException(f"Could not prepare step {name}")
+        outputs = algorithm.runPrepared(parameters, context, feedback)
+        algorithm.postProcess(context, feedback)
+        return {output: path for output, path in outputs.items() if path}
+
+    def _write_manifest(self) -> None:
+        path = os.path.join(self.output_directory, MANIFEST_NAME)
+        with open(f"{path}.partial", "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(f"{path}.partial", path)
+
+
+def run_batch(
+    path: str,
+    feedback: QgsProcessingFeedback,
+    workers: Optional[int] = None,
+    context: Optional[QgsProcessingContext] = None,
+) -> str:
+    """
+    Run a batch parameter file and return the path of the manifest.
+    """
+    batch = BatchRunner(
+        load_parameter_file(path), context or QgsProcessingContext(), feedback, workers
+    )
+    batch.run()
+    return os.path.join(batch.output_directory, MANIFEST_NAME)
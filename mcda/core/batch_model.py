@@ -0,0 +1,96 @@
+"""
+Name : Batch run
+Group : Final models
+"""
+
+from typing import Any, Dict
+
+from qgis.core import (
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingFeedback,
+    QgsProcessingOutputFile,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterNumber,
+)
+
+from .batch import run_batch
+
+
+class BatchRun(QgsProcessingAlgorithm):
+    """
+    This class implements an algorithm for running the model chain for many
+    study areas, e.g. with qgis_process.
+    """
+
+    def initAlgorithm(self, config=None):  # noqa: N802
+        self.addParameter(
+            QgsProcessingParameterFile(
+                "ParameterFile", "Batch parameter file", extension="json"
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "Workers",
+                "Number of study areas run at the same time",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                optional=True,
+                defaultValue=None,
+            )
+        )
+        self.addOutput(QgsProcessingOutputFile("Manifest", "Run manifest"))
+
+    def processAlgorithm(  # noqa: N802
+        self,
+        parameters: Dict[str, Any],
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+    ) -> Dict[str, Any]:
+        manifest = run_batch(
+            self.parameterAsFile(parameters, "ParameterFile", context),
+            feedback,
+            workers=parameters.get("Workers"),
+            context=context,
+        )
+        return {"Manifest": manifest}
+
+    def name(self):
+        return "batchrun"
+
+    def displayName(self):  # noqa: N802
+        return "Batch run"
+
+    def group(self):
+        return "Final models"
+
+    def groupId(self):  # noqa: N802
+        return "Final models"
+
+    @classmethod
+    def shortHelpString(cls):  # noqa: N802
+        return """<html><body><h2>Algorithm description</h2>
+<p>This algorithm runs the hazard risk, suitability and MCDA models for
+many study areas in one go, e.g. for all the districts of a country.
+Shared national inputs are opened only once, and the study areas are run
+in parallel.</p>
+<h2>Input parameters</h2>
+<h3>Batch parameter file</h3>
+<p>A JSON file with the study areas, either a list of polygon files or
+a layer and the name of its district id field, the output directory and
+the parameters of each model. A model may use the result of an earlier
+model for the same study area, e.g. "MultiHazardRisk": "@hri".</p>
+<h3>Number of study areas run at the same time</h3>
+<p>By default, one study area is run at a time.</p>
+<h2>Outputs</h2>
+<h3>Run manifest</h3>
+<p>A JSON file listing the status, run time and outputs of each study
+area. The outputs of each study area are written to a directory of their
+own.</p>
+<br><p>Algorithm author: Development unit at IIEP-UNESCO
+(development@iiep.unesco.org)</p><p>Algorithm version: 1.0</p>
+</body></html>
+"""
+
+    def createInstance(self):  # noqa: N802
+        return BatchRun()
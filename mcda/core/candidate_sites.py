@@ -0,0 +1,185 @@
+"""
+Shortlist of candidate sites from a suitability raster.
+
+The raster is streamed block by block and only the best candidates found so
+far are kept, so memory use depends on the number of candidates instead of
+the size of the raster. Candidates closer to a better candidate than the
+minimum separation are suppressed as they stream in, with a grid index of
+the kept candidates for the distance checks. Suitability is best when it is
+lowest, like the suitability classes.
+"""
+import heapq
+import itertools
+import math
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from .raster_engine import BLOCK_SIZE, RasterSource, Window, compute_blocks
+
+
+class Candidate(NamedTuple):
+    x: float
+    y: float
+    score: float
+
+
+class _CandidatePool:
+    """
+    The best candidates so far, at least the separation apart. Candidates
+    are kept in a heap with the worst on top, so it can be dropped once
+    there are more than count candidates.
+    """
+
+    def __init__(self, count: int, separation: float) -> None:
+        self.count = count
+        self.separation = separation
+        # Grid cells of the size of the separation, so that candidates within
+        # the separation are always in the same or neighbouring cells
+        self.cell_size = separation if separation > 0 else math.inf
+        self.candidates: Dict[int, Candidate] = {}
+        self.cells: Dict[Tuple[int, int], Set[int]] = {}
+        self.heap: List[Tuple[float, int]] = []
+        self.ids = itertools.count()
+
+    @property
+    def full(self) -> bool:
+        return len(self.candidates) >= self.count
+
+    def worst(self) -> float:
+        """
+        Score a candidate has to beat to get into a full pool.
+        """
+        self._drop_removed()
+        return -self.heap[0][0] if self.full else math.inf
+
+    def add(self, candidate: Candidate) -> None:
+        """
+        Add a candidate unless a candidate at least as good is within the
+        separation. Worse candidates within the separation are removed.
+        """
+        if self.full and candidate.score >= self.worst():
+            return
+        nearby = list(self._nearby(candidate))
+        if any(self.candidates[id].score <= candidate.score for id in nearby):
+            return
+        for id in nearby:
+            self._remove(id)
+        id = next(self.ids)
+        self.candidates[id] = candidate
+        self.cells.setdefault(self._cell(candidate), set()).add(id)
+        heapq.heappush(self.heap, (-candidate.score, id))
+        if len(self.candidates) > self.count:
+            self._drop_removed()
+            self._remove(heapq.heappop(self.heap)[1])
+
+    def result(self) -> List[Candidate]:
+        """
+        Candidates from the best to the worst.
+        """
+        return sorted(self.candidates.values(), key=lambda candidate: candidate.score)
+
+    def _cell(self, candidate: Candidate) -> Tuple[int, int]:
+        if math.isinf(self.cell_size):
+            return (0, 0)
+        return (
+            math.floor(candidate.x / self.cell_size),
+            math.floor(candidate.y / self.cell_size),
+        )
+
+    def _nearby(self, candidate: Candidate) -> Iterator[int]:
+        if self.separation <= 0:
+            return
+        column, row = self._cell(candidate)
+        for cell in itertools.product(
+            (column - 1, column, column + 1), (row - 1, row, row + 1)
+        ):
+            for id in self.cells.get(cell, ()):
+                other = self.candidates[id]
+                if math.hypot(other.x - candidate.x, other.y - candidate.y) < (
+                    self.separation
+                ):
+                    yield id
+
+    def _remove(self, id: int) -> None:
+        # Removed candidates are left in the heap until they reach the top
+        candidate = self.candidates.pop(id)
+        cell = self.cells[self._cell(candidate)]
+        cell.discard(id)
+        if not cell:
+            del self.cells[self._cell(candidate)]
+
+    def _drop_removed(self) -> None:
+        while self.heap and self.heap[0][1] not in self.candidates:
+            heapq.heappop(self.heap)
+
+
+def _block_candidates(
+    block: np.ndarray, window: Window, cell: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rows, columns and scores of the best pixel in each cell of cell x cell
+    pixels of the block, from the best to the worst. Pixels in the same cell
+    are always within the separation, so only the best one can be a
+    candidate. Cells are aligned to the whole raster.
+    """
+    top = window.yoff % cell
+    left = window.xoff % cell
+    rows = -(-(top + window.ysize) // cell)
+    columns = -(-(left + window.xsize) // cell)
+    padded = np.full((rows * cell, columns * cell), np.nan)
+    padded[top : top + window.ysize, left : left + window.xsize] = block
+    cells = padded.reshape(rows, cell, columns, cell).transpose(0, 2, 1, 3)
+    cells = cells.reshape(rows, columns, cell * cell)
+    valid = ~np.isnan(cells).all(axis=2)
+    best = np.argmin(np.where(np.isnan(cells), np.inf, cells), axis=2)[valid]
+    cell_rows, cell_columns = np.nonzero(valid)
+    pixel_rows = cell_rows * cell + best // cell - top
+    pixel_columns = cell_columns * cell + best % cell - left
+    scores = block[pixel_rows, pixel_columns]
+    order = np.argsort(scores, kind="stable")
+    return pixel_rows[order], pixel_columns[order], scores[order]
+
+
+def top_candidates(
+    source: RasterSource,
+    count: int,
+    separation: float = 0,
+    block_size: int = BLOCK_SIZE,
+    workers: int = 1,
+    feedback: Optional[Any] = None,
+) -> List[Candidate]:
+    """
+    The count best pixels of the source, at least the separation apart, as
+    candidates at the pixel centers in the coordinates of the grid. The
+    separation is in the same units. Candidates are suppressed greedily as
+    blocks are read, so a candidate suppressed by a candidate that is later
+    suppressed itself does not come back. Feedback may be any QgsFeedback,
+    like in write_raster.
+    """
+    grid = source.grid
+    x0, pixel_width, _, y0, _, pixel_height = grid.geotransform
+    # Diagonal of the cells within the separation
+    pixel_size = max(abs(pixel_width), abs(pixel_height))
+    cell = max(int(separation / math.sqrt(2) / pixel_size), 1)
+    pool = _CandidatePool(count, separation)
+    total = grid.window_count(block_size)
+    blocks = compute_blocks(source.read, grid.windows(block_size), workers)
+    for index, (window, block) in enumerate(blocks):
+        if feedback and feedback.isCanceled():
+            break
+        rows, columns, scores = _block_candidates(block, window, cell)
+        for row, column, score in zip(rows, columns, scores.tolist()):
+            if pool.full and score >= pool.worst():
+                # The rest of the block is no better
+                break
+            pool.add(
+                Candidate(
+                    x0 + (window.xoff + column + 0.5) * pixel_width,
+                    y0 + (window.yoff + row + 0.5) * pixel_height,
+                    score,
+                )
+            )
+        if feedback:
+            feedback.setProgress(100 * (index + 1) / total)
+    return pool.result()
@@ -0,0 +1,253 @@
+"""
+Name : Candidate sites
+Group : Multi-criteria decision analysis
+"""
+
+import os
+from typing import Any, Dict, List, Union
+
+import numpy as np
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsMemoryProviderUtils,
+    QgsPointXY,
+    QgsProcessing,
+    QgsProcessingContext,
+    QgsProcessingFeedback,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterVectorDestination,
+    QgsProcessingParameterVectorLayer,
+    QgsRasterLayer,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import QVariant
+
+from .base_model import BaseModel
+from .candidate_sites import Candidate, top_candidates
+from .point_sampling import sample_points
+
+
+class CandidateSites(BaseModel):
+    """
+    This class implements an algorithm picking a shortlist of candidate
+    school sites from a suitability raster, e.g. the MCDA result. The raster
+    is streamed once and only the best candidates are kept in memory.
+    """
+
+    def initAlgorithm(self, config=None):  # noqa: N802
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                "Suitability", "Suitability", defaultValue=None
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                "Components",
+                "Component suitability layers",
+                layerType=QgsProcessing.TypeRaster,
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "CandidateCount",
+                "Number of candidate sites",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=20,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "MinimumSeparation",
+                "Minimum distance between candidate sites",
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=2000,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                "ProjectedReferenceSystem",
+                "Projected Reference System",
+                defaultValue="EPSG:4326",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "Studyarea",
+                "Study area",
+                types=[QgsProcessing.TypeVectorPolygon],
+                optional=True,
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorDestination(
+                "CandidatesOutput",
+                "Candidate sites",
+                type=QgsProcessing.TypeVectorPoint,
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+
+    def processAlgorithm(  # noqa: N802
+        self,
+        parameters: Dict[str, Any],
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+    ) -> Dict[str, Any]:
+        self.startAlgorithm(parameters, context, feedback, steps=3)
+        # Distances between candidates are measured on the projected grid
+        suitability = self._reproject_raster_to_crs(
+            parameters["Suitability"], self.projected_reference_system
+        )
+        if suitability is None or self.feedback.isCanceled():
+            return {}
+
+        self.feedback.setCurrentStep(1)
+        candidates = top_candidates(
+            self._raster_source(suitability),
+            parameters.get("CandidateCount") or 20,
+            parameters.get("MinimumSeparation") or 0,
+            workers=self.workers,
+            feedback=self.feedback,
+        )
+        if self.feedback.isCanceled():
+            return {}
+
+        # Component scores are only read at the candidates
+        self.feedback.setCurrentStep(2)
+        components = parameters.get("Components") or []
+        scores = [
+            self._component_scores(component, candidates) for component in components
+        ]
+        output = self._save_vector(
+            self._candidate_layer(
+                candidates,
+                [self._layer_name(component) for component in components],
+                scores,
+            ),
+            parameters.get("CandidatesOutput"),
+        )
+        return {"CandidatesOutput": output}
+
+    def _component_scores(
+        self, component: Union[QgsRasterLayer, str], candidates: List[Candidate]
+    ) -> np.ndarray:
+        """
+        Values of a component layer at the candidates, in any CRS.
+        """
+        source = self._raster_source(component)
+        transform = QgsCoordinateTransform(
+            QgsCoordinateReferenceSystem(self.projected_reference_system),
+            QgsCoordinateReferenceSystem.fromWkt(source.grid.crs_wkt),
+            self.context.transformContext(),
+        )
+        points = [
+            transform.transform(QgsPointXY(candidate.x, candidate.y))
+            for candidate in candidates
+        ]
+        return sample_points(
+            source,
+            [point.x() for point in points],
+            [point.y() for point in points],
+            workers=self.workers,
+        )
+
+    def _layer_name(self, layer: Union[QgsRasterLayer, str]) -> str:
+        if isinstance(layer, QgsRasterLayer):
+            return layer.name()
+        return os.path.splitext(os.path.basename(layer))[0]
+
+    def _candidate_layer(
+        self,
+        candidates: List[Candidate],
+        names: List[str],
+        scores: List[np.ndarray],
+    ) -> QgsVectorLayer:
+        """
+        Point layer of the candidates from the best to the worst, with the
+        suitability and the component scores of each.
+        """
+        fields = QgsFields()
+        fields.append(QgsField("rank", QVariant.Int))
+        fields.append(QgsField("suitability", QVariant.Double))
+        for name in names:
+            fields.append(QgsField(name, QVariant.Double))
+        layer = QgsMemoryProviderUtils.createMemoryLayer(
+            "Candidate sites",
+            fields,
+            QgsWkbTypes.Point,
+            QgsCoordinateReferenceSystem(self.projected_reference_system),
+        )
+        features = []
+        for rank, candidate in enumerate(candidates):
+            feature = QgsFeature(fields)
+            feature.setGeometry(
+                QgsGeometry.fromPointXY(QgsPointXY(candidate.x, candidate.y))
+            )
+            component_scores = [float(values[rank]) for values in scores]
+            feature.setAttributes(
+                [rank + 1, candidate.score]
+                + [None if np.isnan(value) else value for value in component_scores]
+            )
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        layer.updateExtents()
+        return layer
+
+    def name(self):
+        return "Candidate sites"
+
+    def displayName(self):  # noqa: N802
+        return "Candidate sites"
+
+    def group(self):
+        return "Multi-criteria decision analysis"
+
+    def groupId(self):  # noqa: N802
+        return "Multi-criteria decision analysis"
+
+    @classmethod
+    def shortHelpString(cls):  # noqa: N802
+        return """<html><body><h2>Algorithm description</h2>
+<p>This algorithm picks a shortlist of candidate school sites from a
+suitability raster, e.g. the MCDA result. The most suitable locations
+are picked, keeping the candidates at least the minimum distance apart.
+The raster is read once, and only the candidates are kept in memory.</p>
+<h2>Input parameters</h2>
+<h3>Suitability</h3>
+<p>Raster layer where lower values are more suitable, e.g. the MCDA
+result ranging from 1 (More suitable) to 4 (Less suitable).</p>
+<h3>Component suitability layers</h3>
+<p>Optional raster layers whose values at the candidates are added to the
+output, e.g. the environmental, economic and infrastructure
+suitability.</p>
+<h3>Number of candidate sites</h3>
+<p>Maximum number of candidates.</p>
+<h3>Minimum distance between candidate sites</h3>
+<p>In the units of the projected reference system.</p>
+<h3>Study area</h3>
+<p>A polygon vector layer delimiting the area of analysis.</p>
+<h2>Outputs</h2>
+<h3>Candidate sites</h3>
+<p>Point layer of the candidates from the most to the least suitable,
+with their rank, suitability and component values.</p>
+<br><p>Algorithm author: Development unit at IIEP-UNESCO
+(development@iiep.unesco.org)</p><p>Algorithm version: 1.0</p>
+</body></html>
+"""
+
+    def createInstance(self):  # noqa: N802
+        return CandidateSites()
@@ -1,17 +1,54 @@
-from typing import Any, Dict, List
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-import processing
+import numpy as np
+from osgeo import gdal
 from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsField,
+    QgsFields,
+    QgsMemoryProviderUtils,
+    QgsPointXY,
     QgsProcessing,
     QgsProcessingContext,
     QgsProcessingFeedback,
     QgsProcessingParameterCrs,
     QgsProcessingParameterVectorLayer,
+    QgsProcessingUtils,
     QgsRasterLayer,
     QgsVectorLayer,
 )
+from qgis.PyQt.QtCore import QVariant
 
 from .base_model import BaseModel
+from .point_sampling import sample_points
+from .raster_engine import FileRaster, LazyRaster, RasterSource
+from .result_cache import identity_key
+
+# Field of sampled values, named like the band fields of native:rastersampling
+# with the HazardIndex prefix, so outputs keep their earlier schema
+SAMPLE_FIELD = "HazardIndex1"
+
+# Number of reprojected input stacks kept between runs
+PREPARED_STACK_COUNT = 4
+
+# Reprojected input layer paths of recent runs, by the identity of the inputs.
+# Panels run a new instance of the algorithm every time, so the stacks are kept
+# on module level. Layers warped in memory are kept as block engine sources,
+# which keeps them in memory as long as the stack is kept.
+_prepared_stacks: "OrderedDict[str, List[Union[str, RasterSource]]]" = OrderedDict()
+_stacks_lock = threading.Lock()
+
+
+def _available(layer: Union[str, RasterSource]) -> bool:
+    if isinstance(layer, FileRaster):
+        layer = layer.path
+    elif isinstance(layer, RasterSource):
+        return True
+    return gdal.VSIStatL(layer) is not None
 
 
 class CombineRasters(BaseModel):
@@ -54,46 +91,24 @@ class CombineRasters(BaseModel):
         feedback: QgsProcessingFeedback,
     ) -> Dict[str, Any]:
         self.startAlgorithm(
-            parameters, context, feedback, steps=2 * len(parameters["Layers"]) + 4
+            parameters, context, feedback, steps=2 * len(parameters["Layers"]) + 3
         )
 
-        layers: List[QgsRasterLayer] = []
-        # Why do we only reproject rasters but not vectors here?
-        for index, layer in enumerate(parameters["Layers"]):
-            # reproject layers to the same CRS so they can be merged
-            reprojected = self._reproject_raster_to_crs(
-                layer, self.projected_reference_system, nodata=0
-            )
-            if self.feedback.isCanceled():
-                return {}
-
-            self.feedback.setCurrentStep(1 + 2 * index)
-            if parameters["NormalizeLayers"]:
-                layers.append(self._normalize_layer(reprojected))
-            else:
-                layers.append(reprojected)
-            if self.feedback.isCanceled():
-                return {}
-
-        self.feedback.setCurrentStep(2 + 2 * index)
-        # calculate raster
-        sum = self._merge_layers(layers, parameters["Weights"])
-        if self.feedback.isCanceled():
+        criteria = self._criteria(parameters)
+        if criteria is None:
             return {}
+        count = len(parameters["Layers"])
 
-        # clip to area if provided
-        self.feedback.setCurrentStep(2 * index + 3)
-        if self.studyarea:
-            result = self._clip_raster_to_studyarea(
-                sum, write_to_layer=parameters["OutputRaster"]
-            )
-        else:
-            result = sum
+        self.feedback.setCurrentStep(2 * count)
+        # calculate raster, clipped to area if provided
+        result = self._merge_layers(
+            *criteria, write_to_layer=parameters["OutputRaster"], clip=True
+        )
         if self.feedback.isCanceled():
             return {}
 
         # sample schools if provided
-        self.feedback.setCurrentStep(2 * index + 4)
+        self.feedback.setCurrentStep(2 * count + 1)
         if "Schools" in parameters and parameters["Schools"]:
             if self.studyarea:
                 clipped_schools = self._clip_vector_to_studyarea(parameters["Schools"])
@@ -106,27 +121,129 @@ class CombineRasters(BaseModel):
         return {
             parameters["LayerNames"]["OutputRaster"]: result,
             parameters["LayerNames"]["SampledOutput"]: school_raster_values,
+            **self._zonal_results(),
         }
 
+    def _criteria(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[List[Union[QgsRasterLayer, LazyRaster]], List[float]]]:
+        layers = self._prepare_layers(parameters)
+        if layers is None:
+            return None
+        return layers, parameters["Weights"]
+
+    def _criteria_range(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[float, float]]:
+        # Layers that are not normalized may have any values
+        return (0.0, 1.0) if parameters["NormalizeLayers"] else None
+
+    def _prepare_layers(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[List[Union[QgsRasterLayer, LazyRaster]]]:
+        """
+        Reproject and optionally normalize the input layers. Returns None if
+        the run is canceled.
+        """
+        # The reprojected stack only depends on the layers, the grid and the
+        # study area they are clipped to, so runs with only different weights
+        # can skip reprojecting the layers again
+        grid = self.analysis_grid
+        stack_key = identity_key(
+            [
+                parameters["Layers"],
+                self.projected_reference_system,
+                [grid.geotransform, grid.xsize, grid.ysize] if grid else None,
+                self.study_area.identity() if self.study_area else None,
+                # The cutline file is written again by each run
+                self.cutline is not None,
+            ],
+            self.context,
+        )
+        with _stacks_lock:
+            stack = _prepared_stacks.get(stack_key) if stack_key else None
+            if stack:
+                _prepared_stacks.move_to_end(stack_key)
+        if stack and all(_available(layer) for layer in stack):
+            self.feedback.pushInfo("Reusing reprojected layers of an earlier run")
+        else:
+            stack = []
+            # Why do we only reproject rasters but not vectors here?
+            for index, layer in enumerate(parameters["Layers"]):
+                self.feedback.setCurrentStep(2 * index)
+                # reproject layers to the same CRS so they can be merged
+                stack.append(
+                    self._reproject_raster_to_crs(
+                        layer, self.projected_reference_system, nodata=0
+                    )
+                )
+                if self.feedback.isCanceled():
+                    return None
+            if stack_key:
+                with _stacks_lock:
+                    _prepared_stacks[stack_key] = stack
+                    while len(_prepared_stacks) > PREPARED_STACK_COUNT:
+                        _prepared_stacks.popitem(last=False)
+
+        # Statistics of all the layers to normalize are gathered in one pass
+        statistics = (
+            self._get_stack_statistics(stack) if parameters["NormalizeLayers"] else []
+        )
+        layers: List[Union[QgsRasterLayer, LazyRaster]] = []
+        for index, reprojected in enumerate(stack):
+            self.feedback.setCurrentStep(1 + 2 * index)
+            if parameters["NormalizeLayers"]:
+                layers.append(self._normalize_layer(reprojected, statistics[index]))
+            else:
+                layers.append(reprojected)
+            if self.feedback.isCanceled():
+                return None
+
+        return layers
+
     def _sample_layer(
-        self, layer: QgsRasterLayer, points: QgsVectorLayer
-    ) -> QgsVectorLayer:
+        self,
+        layer: Union[QgsRasterLayer, RasterSource, str],
+        points: Union[QgsVectorLayer, str],
+    ) -> str:
         """
-        Sample raster layer at vector layer points.
+        Sample raster layer at vector layer points. The raster may also be a
+        block engine source that has not been written. Returns the path of
+        the sampled output, or the id of a temporary layer in the context.
         """
-        # Sample raster values
-        alg_params = {
-            "COLUMN_PREFIX": "HazardIndex",
-            "INPUT": points,
-            "RASTERCOPY": layer,
-            "OUTPUT": self.parameters["SampledOutput"]
-            if self.parameters["SampledOutput"]
-            else QgsProcessing.TEMPORARY_OUTPUT,
-        }
-        return processing.run(
-            "native:rastersampling",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        if isinstance(points, str):
+            points = QgsProcessingUtils.mapLayerFromString(points, self.context, True)
+        source = self._raster_source(layer)
+        transform = QgsCoordinateTransform(
+            points.crs(),
+            QgsCoordinateReferenceSystem.fromWkt(source.grid.crs_wkt),
+            self.context.transformContext(),
+        )
+        features = list(points.getFeatures())
+        coordinates = np.full((len(features), 2), np.nan)
+        for index, feature in enumerate(features):
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            # Multipoints are sampled at their first point
+            point = transform.transform(QgsPointXY(geometry.vertexAt(0)))
+            coordinates[index] = point.x(), point.y()
+        values = sample_points(
+            source, coordinates[:, 0], coordinates[:, 1], workers=self.workers
+        )
+
+        fields = QgsFields(points.fields())
+        fields.append(QgsField(SAMPLE_FIELD, QVariant.Double))
+        sampled = QgsMemoryProviderUtils.createMemoryLayer(
+            points.name(), fields, points.wkbType(), points.crs()
+        )
+        for feature, value in zip(features, values.tolist()):
+            feature.setFields(fields, False)
+            feature.setAttributes(
+                feature.attributes() + [None if math.isnan(value) else value]
+            )
+        # All the features are added in a single edit
+        sampled.dataProvider().addFeatures(features)
+        sampled.updateExtents()
+
+        return self._save_vector(sampled, self.parameters.get("SampledOutput"))
@@ -0,0 +1,217 @@
+"""
+Exact Euclidean distance transform.
+
+Distances are computed in two separable passes, like in the linear time
+algorithms by Meijster et al. (2000) and Felzenszwalb and Huttenlocher
+(2012). The first pass finds the distance to the nearest feature in each
+column with cumulative scans. The second pass combines the column
+distances along rows, either with the lower envelope of parabolas or, when
+distances are only needed up to a few pixels, with a bounded minimum over
+row offsets. All passes run over whole tiles at once with NumPy.
+
+Since distances are only needed up to a maximum distance, each block only
+has to see its features within that distance. Blocks are computed from a
+tile padded with a halo of max_distance, so every block is independent.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+from .raster_engine import (
+    CLASS_DATA_TYPE,
+    CLASS_NODATA,
+    RasterGrid,
+    RasterSource,
+    Window,
+    classify_distance,
+    padded_window,
+)
+
+
+def _squared_distance_1d(f: np.ndarray, spacing: float) -> np.ndarray:
+    """
+    One-dimensional squared distance transform of sampled function f along
+    the last axis, for all rows at once. Samples are spacing units apart.
+    """
+    rows, n = f.shape
+    result = np.empty_like(f)
+    if n == 1:
+        result[:] = f
+        return result
+    row = np.arange(rows)
+    position = np.arange(n, dtype=np.float64) * spacing
+    # f(q) + q^2 is needed for every parabola intersection
+    shifted = f + position**2
+    # Locations of parabolas in the lower envelope, and the boundaries
+    # between them, for each row
+    locations = np.zeros((rows, n), dtype=np.int64)
+    boundaries = np.empty((rows, n + 1), dtype=np.float64)
+    boundaries[:, 0] = -np.inf
+    boundaries[:, 1] = np.inf
+    k = np.zeros(rows, dtype=np.int64)
+    for q in range(1, n):
+        while True:
+            vertex = locations[row, k]
+            intersection = (shifted[:, q] - shifted[row, vertex]) / (
+                2 * (position[q] - position[vertex])
+            )
+            hidden = intersection <= boundaries[row, k]
+            if not hidden.any():
+                break
+            k[hidden] -= 1
+        k += 1
+        locations[row, k] = q
+        boundaries[row, k] = intersection
+        boundaries[row, k + 1] = np.inf
+    k[:] = 0
+    for q in range(n):
+        while True:
+            passed = boundaries[row, k + 1] < position[q]
+            if not passed.any():
+                break
+            k[passed] += 1
+        vertex = locations[row, k]
+        result[:, q] = (position[q] - position[vertex]) ** 2 + f[row, vertex]
+    return result
+
+
+# Largest halo in pixels for which the bounded minimum is used in the row pass.
+# The bounded minimum needs one NumPy pass per pixel of halo, the lower
+# envelope a Python loop over the tile width.
+BOUNDED_PASS_MAX_HALO = 64
+
+
+def _squared_column_distance(
+    features: np.ndarray, pixel_width: float, pixel_height: float
+) -> np.ndarray:
+    """
+    Squared distance to the nearest feature in the same column. Columns
+    without features get a value larger than any distance on the tile.
+    """
+    rows, columns = features.shape
+    index = np.arange(rows)[:, np.newaxis]
+    above = np.maximum.accumulate(np.where(features, index, -2 * rows), axis=0)
+    below = np.where(features, index, 3 * rows)
+    below = np.minimum.accumulate(below[::-1], axis=0)[::-1]
+    distance = np.minimum(index - above, below - index).astype(np.float64)
+    squared = (distance * pixel_height) ** 2
+    far = 4 * ((rows * pixel_height) ** 2 + (columns * pixel_width) ** 2) + 1
+    squared[distance > rows] = far
+    return squared
+
+
+def _bounded_row_pass(squared: np.ndarray, pixel_width: float, halo: int) -> np.ndarray:
+    """
+    Combine squared column distances along rows, considering only features at
+    most halo pixels away horizontally.
+    """
+    result = squared.copy()
+    for offset in range(1, min(halo, squared.shape[1] - 1) + 1):
+        cost = (offset * pixel_width) ** 2
+        right = result[:, offset:]
+        np.minimum(right, squared[:, :-offset] + cost, out=right)
+        left = result[:, :-offset]
+        np.minimum(left, squared[:, offset:] + cost, out=left)
+    return result
+
+
+def euclidean_distance(
+    features: np.ndarray,
+    pixel_width: float = 1,
+    pixel_height: float = 1,
+    max_distance: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Exact Euclidean distance from each pixel center to the nearest feature
+    pixel center, in the units of the pixel size. Pixels are features where
+    the boolean features array is True. If there are no features, all
+    distances are infinite.
+
+    If max_distance is given, distances are exact up to max_distance and
+    larger than max_distance elsewhere.
+    """
+    if not features.any():
+        return np.full(features.shape, np.inf)
+    squared = _squared_column_distance(features, pixel_width, pixel_height)
+    halo = math.ceil(max_distance / pixel_width) if max_distance is not None else None
+    if halo is not None and halo <= BOUNDED_PASS_MAX_HALO:
+        squared = _bounded_row_pass(squared, pixel_width, halo)
+    else:
+        squared = _squared_distance_1d(squared, pixel_width)
+    return np.sqrt(squared)
+
+
+class DistanceClassRaster(RasterSource):
+    """
+    Suitability classes by distance to the non-zero pixels of a raster,
+    computed directly from the features without a proximity raster.
+    """
+
+    data_type = CLASS_DATA_TYPE
+    output_nodata = CLASS_NODATA
+
+    def __init__(
+        self,
+        features: RasterSource,
+        min_distance: float,
+        max_distance: float,
+        further_is_better: bool = False,
+        too_close_classification: int = 4,
+        too_far_classification: int = 4,
+    ) -> None:
+        self.features = features
+        self.grid = features.grid
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.further_is_better = further_is_better
+        self.too_close_classification = too_close_classification
+        self.too_far_classification = too_far_classification
+        # Features further than max_distance do not affect the classes
+        self.halo = (
+            math.ceil(max_distance / self.grid.pixel_width),
+            math.ceil(max_distance / self.grid.pixel_height),
+        )
+
+    def distances(self, window: Window) -> np.ndarray:
+        """
+        Distances to the nearest feature, capped at max_distance.
+        """
+        padded, x, y = padded_window(self.grid, window, self.halo)
+        tile = self.features.read(padded)
+        features = ~np.isnan(tile) & (tile != 0)
+        if not features.any():
+            return np.full((window.ysize, window.xsize), float(self.max_distance))
+        distance = euclidean_distance(
+            features, self.grid.pixel_width, self.grid.pixel_height, self.max_distance
+        )[y : y + window.ysize, x : x + window.xsize]
+        return np.minimum(distance, self.max_distance)
+
+    def classes(self, window: Window) -> np.ndarray:
+        """
+        Suitability class codes of the window as UInt8.
+        """
+        return classify_distance(
+            self.distances(window),
+            self.min_distance,
+            self.max_distance,
+            self.further_is_better,
+            self.too_close_classification,
+            self.too_far_classification,
+        ).astype(np.uint8)
+
+    def read(self, window: Window) -> np.ndarray:
+        return self.classes(window).astype(np.float64)
+
+    def resampled(self, grid: RasterGrid) -> "DistanceClassRaster":
+        if grid.matches(self.grid):
+            return self
+        # Distances are computed from the features on the new grid
+        return DistanceClassRaster(
+            self.features.resampled(grid),
+            self.min_distance,
+            self.max_distance,
+            self.further_is_better,
+            self.too_close_classification,
+            self.too_far_classification,
+        )
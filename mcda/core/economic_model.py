@@ -5,7 +5,7 @@ Group : Multi-criteria decision analysis
 With QGIS : 31600
 """
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from qgis.core import (
     QgsProcessing,
@@ -16,9 +16,12 @@ from qgis.core import (
     QgsProcessingParameterNumber,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterVectorLayer,
+    QgsRasterLayer,
 )
 
 from .base_model import BaseModel
+from .raster_engine import RasterSource
+from .task_graph import TaskGraph
 
 
 class EconomicSuitability(BaseModel):
@@ -119,6 +122,13 @@ class EconomicSuitability(BaseModel):
                 "CRS", "Projected reference system", defaultValue="EPSG:4326"
             )
         )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "VectorDistances",
+                "Compute distances directly from the vector features",
+                defaultValue=False,
+            )
+        )
         self.addParameter(
             QgsProcessingParameterRasterDestination(
                 "EconomicSuitability",
@@ -134,54 +144,55 @@ class EconomicSuitability(BaseModel):
         context: QgsProcessingContext,
         feedback: QgsProcessingFeedback,
     ) -> Dict[str, Any]:
-        self.startAlgorithm(parameters, context, feedback, steps=5)
-
-        # Fix roads geometries
-        roads = self._fix_vector_layer(parameters["Roads"])
-        # Fix waterways geometries
-        waterways = self._fix_vector_layer(parameters["Waterways"])
-        if self.feedback.isCanceled():
+        self.startAlgorithm(parameters, context, feedback, steps=2)
+        criteria = self._criteria(parameters)
+        if criteria is None:
             return {}
 
         self.feedback.setCurrentStep(1)
-        # Clip if studyarea given
-        if self.studyarea:
-            roads = self._clip_vector_to_studyarea(roads)
-            waterways = self._clip_vector_to_studyarea(waterways)
-        if self.feedback.isCanceled():
-            return {}
-
-        self.feedback.setCurrentStep(2)
-        # Rasterize
-        rasterized_roads = self._rasterize_vector(roads)
-        rasterized_waterways = self._rasterize_vector(waterways)
-        if self.feedback.isCanceled():
-            return {}
+        sum = self._merge_layers(
+            *criteria, write_to_layer=self.parameters["EconomicSuitability"]
+        )
+        return {"EconomicSuitability": sum, **self._zonal_results()}
 
-        self.feedback.setCurrentStep(3)
-        # Classify
-        road_classification = self._classify_by_distance(
-            rasterized_roads,
-            parameters["Minimumsuitabledistancetotheroad"],
-            parameters["MaxRoadDistance"],
-            not parameters["Arelocationsclosetoroadsmoresuitable"],
+    def _criteria(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[List[Union[QgsRasterLayer, RasterSource]], List[float]]]:
+        # Roads and waterways are independent branches, run concurrently
+        graph = TaskGraph()
+        graph.add(
+            "roads",
+            lambda: self._classify_features_by_distance(
+                # Fix roads geometries
+                self._fix_vector_layer(parameters["Roads"]),
+                parameters["Minimumsuitabledistancetotheroad"],
+                parameters["MaxRoadDistance"],
+                not parameters["Arelocationsclosetoroadsmoresuitable"],
+            ),
         )
-        waterway_classification = self._classify_by_distance(
-            rasterized_waterways,
-            parameters["Minimumsuitabledistancetoawaterway"],
-            parameters["MaxWaterDistance"],
-            not parameters["Arelocationsclosetowaterwaysmoresuitable"],
+        graph.add(
+            "waterways",
+            lambda: self._classify_features_by_distance(
+                # Fix waterways geometries
+                self._fix_vector_layer(parameters["Waterways"]),
+                parameters["Minimumsuitabledistancetoawaterway"],
+                parameters["MaxWaterDistance"],
+                not parameters["Arelocationsclosetowaterwaysmoresuitable"],
+            ),
         )
+        classifications = self._run_graph(graph)
         if self.feedback.isCanceled():
-            return {}
+            return None
+        return (
+            [classifications["roads"], classifications["waterways"]],
+            [parameters["WeightforRoads"], parameters["WeightforWaterways"]],
+        )
 
-        self.feedback.setCurrentStep(4)
-        sum = self._merge_layers(
-            [road_classification, waterway_classification],
-            [self.parameters["WeightforRoads"], self.parameters["WeightforWaterways"]],
-            write_to_layer=self.parameters["EconomicSuitability"],
+    def _analysis_buffer(self) -> float:
+        # Roads and waterways outside the study area affect the distances
+        return max(
+            self.parameters["MaxRoadDistance"], self.parameters["MaxWaterDistance"]
         )
-        return {"EconomicSuitability": sum}
 
     def name(self):
         return "Economic suitability"
@@ -4,9 +4,8 @@ Name : Environmental suitability
 Group : Multi-criteria decision analysis
 With QGIS : 31600
 """
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-import processing
 from qgis.core import (
     QgsProcessing,
     QgsProcessingContext,
@@ -20,6 +19,9 @@ from qgis.core import (
 )
 
 from .base_model import BaseModel
+from .raster_engine import CLASS_NODATA, LazyRaster, RasterSource, as_classes
+from .task_graph import TaskGraph
+from .terrain import SlopeRaster
 
 
 class EnvironmentalSuitability(BaseModel):
@@ -97,65 +99,67 @@ class EnvironmentalSuitability(BaseModel):
         context: QgsProcessingContext,
         feedback: QgsProcessingFeedback,
     ) -> Dict[str, Any]:
-        self.startAlgorithm(parameters, context, feedback, steps=6)
-
-        # Reproject
-        dem = self._reproject_raster_to_crs(
-            parameters["DigitalElevationModel"], self.projected_reference_system
-        )
-        forest = self._reproject_raster_to_crs(
-            parameters["ForestVegetationClassified"], self.projected_reference_system
-        )
-        hri = self._reproject_raster_to_crs(
-            parameters["MultiHazardRisk"], self.projected_reference_system
-        )
-        if feedback.isCanceled():
+        self.startAlgorithm(parameters, context, feedback, steps=2)
+        criteria = self._criteria(parameters)
+        if criteria is None:
             return {}
 
         self.feedback.setCurrentStep(1)
-        # Forest classification (4 if forest is too dense, otherwise 1)
-        classified_forest = self._classify_by_threshold(
-            forest, 1, invert=True, nodata_suitability=1
+        # calculate raster, clipped to area if provided
+        result = self._merge_layers(
+            *criteria, write_to_layer=parameters["EnvironmentalSuitability"], clip=True
         )
-        if self.feedback.isCanceled():
-            return {}
+        return {"EnvironmentalSuitability": result, **self._zonal_results()}
 
-        self.feedback.setCurrentStep(2)
+    def _criteria(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[List[Union[QgsRasterLayer, RasterSource]], List[float]]]:
+        # The DEM, forest and HRI branches are independent, run concurrently
+        def reproject(name: str) -> QgsRasterLayer:
+            return self._reproject_raster_to_crs(
+                parameters[name], self.projected_reference_system
+            )
+
+        graph = TaskGraph()
+        graph.add("dem", lambda: reproject("DigitalElevationModel"))
+        graph.add("forest", lambda: reproject("ForestVegetationClassified"))
+        graph.add("hri", lambda: reproject("MultiHazardRisk"))
+        # Slope classification
+        graph.add("slope_index", self._classify_by_slope, ["dem"])
+        # Forest classification (4 if forest is too dense, otherwise 1)
+        graph.add(
+            "classified_forest",
+            lambda forest: self._classify_by_threshold(
+                forest, 1, invert=True, nodata_suitability=1
+            ),
+            ["forest"],
+        )
         # We want to divide hri equally to classes 1, 2, 3 and 4
         # Standardize from min...max to 0...4, rounding up
         # Allow no pixels exactly zero (round up to 1).
-        classified_hri = self._classify_by_value(hri)
-        if self.feedback.isCanceled():
-            return {}
-
-        self.feedback.setCurrentStep(3)
-        # Slope classification
-        slope_index = self._classify_by_slope(dem)
+        # The pipeline gives the statistics of the hazard index it computed
+        graph.add(
+            "classified_hri",
+            lambda hri: self._classify_by_value(
+                hri, parameters.get("MultiHazardRiskStatistics")
+            ),
+            ["hri"],
+        )
+        results = self._run_graph(graph)
         if self.feedback.isCanceled():
-            return {}
-
-        self.feedback.setCurrentStep(4)
-        # calculate raster
-        sum = self._merge_layers(
-            [slope_index, classified_forest, classified_hri],
+            return None
+        return (
+            [
+                results["slope_index"],
+                results["classified_forest"],
+                results["classified_hri"],
+            ],
             [
                 parameters["WeightforElevation"],
                 parameters["WeightforVegetation"],
                 parameters["WeightforMultiHazardRisk"],
             ],
         )
-        if self.feedback.isCanceled():
-            return {}
-
-        self.feedback.setCurrentStep(5)
-        # clip to area if provided
-        if self.studyarea:
-            result = self._clip_raster_to_studyarea(
-                sum, write_to_layer=parameters["EnvironmentalSuitability"]
-            )
-        else:
-            result = sum
-        return {"EnvironmentalSuitability": result}
 
     def _calculate_slope(self, dem: QgsRasterLayer) -> QgsRasterLayer:
         """
@@ -165,28 +169,38 @@ class EnvironmentalSuitability(BaseModel):
         alg_params = {
             "AS_PERCENT": False,
             "BAND": 1,
-            "COMPUTE_EDGES": False,
+            # The DEM is clipped to the study area, so compute slope up to
+            # its edges
+            "COMPUTE_EDGES": True,
             "EXTRA": "",
             "INPUT": dem,
-            "OPTIONS": "",
+            "OPTIONS": self._creation_options(),
             "SCALE": 1,
             "ZEVENBERGEN": False,
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:slope",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:slope", alg_params)["OUTPUT"]
 
-    def _classify_by_slope(self, dem: QgsRasterLayer) -> QgsRasterLayer:
+    def _classify_by_slope(
+        self, dem: QgsRasterLayer
+    ) -> Union[QgsRasterLayer, LazyRaster]:
         """
         Classify DEM layer from suitable (1) to unsuitable (4) and in between,
         based on the slope in the model. The layer has to be in
         a metric projected coordinate system.
         """
+        if self.use_block_engine:
+            # Slope is computed block by block with a one pixel halo, fused
+            # with the classification
+            slope = SlopeRaster(self._raster_source(dem))
+            return as_classes(
+                slope.map(
+                    lambda values: 1 * (values < 1)
+                    + 2 * (values >= 1) * (values < 10)
+                    + 3 * (values >= 10) * (values < 20)
+                    + 4 * (values >= 20)
+                )
+            )
         slope = self._calculate_slope(dem)
         expression = "1*(A<1) + 2*(A>=1)*(A<10) + 3*(A>=10)*(A<20) + 4*(A>=20)"
         alg_params = {
@@ -194,18 +208,12 @@ class EnvironmentalSuitability(BaseModel):
             "EXTRA": "",
             "FORMULA": expression,
             "INPUT_A": slope,
-            "NO_DATA": None,
-            "OPTIONS": "",
-            "RTYPE": 1,
+            "NO_DATA": CLASS_NODATA,
+            "OPTIONS": self._creation_options(),
+            "RTYPE": 0,  # Classes are stored as bytes
             "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT,
         }
-        return processing.run(
-            "gdal:rastercalculator",
-            alg_params,
-            context=self.context,
-            feedback=self.feedback,
-            is_child_algorithm=True,
-        )["OUTPUT"]
+        return self._run_algorithm("gdal:rastercalculator", alg_params)["OUTPUT"]
 
     def name(self):
         return "Environmental suitability"
@@ -5,7 +5,7 @@ Group : Multi-criteria decision analysis
 With QGIS : 31600
 """
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from qgis.core import (
     QgsProcessing,
@@ -18,9 +18,12 @@ from qgis.core import (
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterVectorLayer,
+    QgsRasterLayer,
 )
 
 from .base_model import BaseModel
+from .raster_engine import LazyRaster, RasterSource
+from .task_graph import TaskGraph
 
 
 class InfrastructureSuitability(BaseModel):
@@ -115,6 +118,13 @@ class InfrastructureSuitability(BaseModel):
                 defaultValue=None,
             )
         )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "VectorDistances",
+                "Compute distances directly from the vector features",
+                defaultValue=False,
+            )
+        )
         self.addParameter(
             QgsProcessingParameterRasterDestination(
                 "SocialSuitability",
@@ -130,71 +140,70 @@ class InfrastructureSuitability(BaseModel):
         context: QgsProcessingContext,
         feedback: QgsProcessingFeedback,
     ) -> Dict[str, Any]:
-        self.startAlgorithm(parameters, context, feedback, steps=6)
-
-        # first clip to area if provided. This will speed up the raster calculation
-        # significantly, and lower the file size.
-        if self.studyarea:
-            clipped_population = self._clip_raster_to_studyarea(
-                parameters["PopulationDensity"]
-            )
-            clipped_schools = self._clip_vector_to_studyarea(parameters["Schools"])
-        else:
-            clipped_population = parameters["PopulationDensity"]
-            clipped_schools = parameters["Schools"]
-        if self.feedback.isCanceled():
+        self.startAlgorithm(parameters, context, feedback, steps=2)
+        criteria = self._criteria(parameters)
+        if criteria is None:
             return {}
 
         self.feedback.setCurrentStep(1)
-        # reproject layers to the same CRS so they can be merged
-        projected_population = self._reproject_raster_to_crs(
-            clipped_population, self.parameters["ProjectedReferenceSystem"]
+        sum = self._merge_layers(
+            *criteria, write_to_layer=self.parameters["InfrastructureSuitability"]
         )
+        return {"InfrastructureSuitability": sum, **self._zonal_results()}
+
+    def _criteria(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Tuple[List[Union[QgsRasterLayer, RasterSource]], List[float]]]:
+        # Population and schools are independent branches, run concurrently
+        graph = TaskGraph()
+        graph.add("population", lambda: self._classify_population(parameters))
+        further_is_better = parameters[
+            "Newschoolsshouldbelocatedfurtherfromexistingschoolsratherthanclosetothem"
+        ]
+        graph.add(
+            "schools",
+            # School proximity and classification
+            lambda: self._classify_features_by_distance(
+                parameters["Schools"],
+                parameters["Minimumsuitabledistancetoanotherschool"],
+                parameters["MaxDistancefromExistingSchools"],
+                further_is_better=further_is_better,
+                # if schools further away are favored, too_far areas should have
+                # class 1
+                too_far_classification=1 if further_is_better else 4,
+            ),
+        )
+        classifications = self._run_graph(graph)
         if self.feedback.isCanceled():
-            return {}
+            return None
+        return (
+            [classifications["schools"], classifications["population"]],
+            [parameters["SchoolWeight"], parameters["PopWeight"]],
+        )
 
-        self.feedback.setCurrentStep(2)
+    def _classify_population(
+        self, parameters: Dict[str, Any]
+    ) -> Optional[Union[QgsRasterLayer, LazyRaster]]:
+        """
+        Classify population density by the threshold in the parameters.
+        """
+        # reproject layers to the same CRS so they can be merged. With a study
+        # area, the population is clipped to it in the same warp.
+        projected_population = self._reproject_raster_to_crs(
+            parameters["PopulationDensity"], self.projected_reference_system
+        )
+        if self.feedback.isCanceled():
+            return None
         # density to 1-bit bitmap (plus nodata, so we'll use 8bit for now)
-        thresholded_population = self._classify_by_threshold(
+        return self._classify_by_threshold(
             projected_population,
             parameters["PopulationThreshold"],
             parameters["Newschoolsshouldideallybelocatedinsparselypopulatedareas"],
         )
-        if self.feedback.isCanceled():
-            return {}
-
-        self.feedback.setCurrentStep(3)
-        # Rasterize (vector to raster)
-        rasterized_schools = self._rasterize_vector(clipped_schools)
-        if self.feedback.isCanceled():
-            return {}
-
-        self.feedback.setCurrentStep(4)
-        # School proximity and classification
-        school_classification = self._classify_by_distance(
-            rasterized_schools,
-            parameters["Minimumsuitabledistancetoanotherschool"],
-            parameters["MaxDistancefromExistingSchools"],
-            further_is_better=parameters[
-                "Newschoolsshouldbelocatedfurtherfromexistingschoolsratherthanclosetothem"  # noqa
-            ],
-            # if schools further away are favored, too_far areas should have class 1
-            too_far_classification=1
-            if parameters[
-                "Newschoolsshouldbelocatedfurtherfromexistingschoolsratherthanclosetothem"  # noqa
-            ]
-            else 4,
-        )
-        if self.feedback.isCanceled():
-            return {}
 
-        self.feedback.setCurrentStep(5)
-        sum = self._merge_layers(
-            [school_classification, thresholded_population],
-            [self.parameters["SchoolWeight"], self.parameters["PopWeight"]],
-            write_to_layer=self.parameters["InfrastructureSuitability"],
-        )
-        return {"InfrastructureSuitability": sum}
+    def _analysis_buffer(self) -> float:
+        # Schools outside the study area affect the distances
+        return self.parameters["MaxDistancefromExistingSchools"]
 
     def name(self):
         return "Social suitability"
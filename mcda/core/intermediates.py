@@ -0,0 +1,135 @@
+"""
+Lifecycle of intermediate results.
+
+Small intermediate rasters, e.g. district level grids, are placed in GDAL's
+in-memory file system instead of temporary files, as long as all the
+intermediates in memory fit the memory budget. Larger ones spill to disk.
+Intermediates are freed as soon as no raster source reads them any more.
+
+Temporary files of a run are written to a directory of the run, which is
+removed once the run has finished, apart from the results of the run.
+"""
+import os
+import shutil
+import threading
+import uuid
+import weakref
+from typing import Dict, Iterable, Optional
+
+from osgeo import gdal
+
+from .raster_engine import FileRaster, RasterGrid
+
+
+def estimated_size(grid: RasterGrid, data_type: int) -> int:
+    """
+    Size in bytes of an uncompressed single band raster on the grid, with
+    the GDAL data type.
+    """
+    return grid.xsize * grid.ysize * (gdal.GetDataTypeSize(data_type) // 8)
+
+
+class IntermediateStore:
+    """
+    Paths of intermediate rasters, in memory or in the directory on disk.
+    The memory budget in bytes applies to the intermediates of all the stores
+    in the process, since model branches and batch runs share the memory.
+    """
+
+    _lock = threading.Lock()
+    _in_memory = 0
+
+    def __init__(self, budget: int, directory: str) -> None:
+        self.budget = budget
+        self.directory = directory
+        # Size in memory of the intermediates of this store by path, zero for
+        # intermediates on disk
+        self.entries: Dict[str, int] = {}
+
+    def fits(self, size: int) -> bool:
+        with self._lock:
+            return IntermediateStore._in_memory + size <= self.budget
+
+    def path(self, name: str, size: int, spill_path: Optional[str] = None) -> str:
+        """
+        Path to write an intermediate of the estimated size to. Intermediates
+        that do not fit the budget are written to spill_path, if given, or to
+        a temporary file. The store does not free spill paths.
+        """
+        unique = f"{uuid.uuid4().hex}_{name}"
+        with self._lock:
+            if IntermediateStore._in_memory + size <= self.budget:
+                IntermediateStore._in_memory += size
+                path = f"/vsimem/mcda/{unique}"
+                self.entries[path] = size
+                return path
+        if spill_path:
+            return spill_path
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, unique)
+        with self._lock:
+            self.entries[path] = 0
+        return path
+
+    def raster(self, path: str) -> FileRaster:
+        """
+        Block engine source of an intermediate written to the path. The
+        intermediate is freed once the source and all sources resampled from
+        it are gone.
+        """
+        source = FileRaster(path)
+        if path in self.entries:
+            weakref.finalize(source, self.release, path)
+        return source
+
+    def release(self, path: str) -> None:
+        """
+        Free an intermediate, e.g. one that was never completely written.
+        """
+        with self._lock:
+            size = self.entries.pop(path, None)
+            if size is None:
+                return
+            IntermediateStore._in_memory -= size
+        # Files on disk may still be open on some platforms, in which case
+        # they are left for the temporary directory clean up
+        gdal.Unlink(path)
+        if gdal.VSIStatL(f"{path}.aux.xml") is not None:
+            gdal.Unlink(f"{path}.aux.xml")
+
+    def clear(self) -> None:
+        """
+        Free all the intermediates of the store.
+        """
+        for path in list(self.entries):
+            self.release(path)
+
+
+def remove_temporary_directory(directory: str, keep: Iterable[str] = ()) -> None:
+    """
+    Remove the temporary directory of a run, except the files to keep, e.g.
+    results displayed as temporary layers. Files still open on some
+    platforms are left for the temporary directory clean up.
+    """
+    kept = {os.path.normcase(os.path.abspath(path)) for path in keep if path}
+    if not os.path.isdir(directory):
+        return
+    for entry in os.scandir(directory):
+        path = os.path.normcase(os.path.abspath(entry.path))
+        # Sidecar files, e.g. .aux.xml, are kept with their raster
+        if any(
+            path == kept_path or path.startswith(f"{kept_path}.") for kept_path in kept
+        ):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    try:
+        # Only empty directories are removed
+        os.rmdir(directory)
+    except OSError:
+        pass
@@ -0,0 +1,271 @@
+"""
+Name : MCDA pipeline
+Group : Final models
+"""
+
+from typing import Any, Dict, Optional, Tuple, Type
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingContext,
+    QgsProcessingFeedback,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingParameterVectorLayer,
+)
+
+from .base_model import BaseModel
+from .economic_model import EconomicSuitability
+from .environmental_model import EnvironmentalSuitability
+from .hri_model import NaturalHazardRisksForSchools
+from .infrastructure_model import InfrastructureSuitability
+from .raster_engine import RasterSource, as_scaled_sum, sum_range, write_rasters
+from .raster_statistics import get_statistics
+
+# Stages of the pipeline in the order they are run: the model, the output
+# parameter that saves the stage result and the name of the result layer.
+# The suitability stages are combined in the order of the MCDA weights.
+STAGES: Dict[str, Tuple[Type[BaseModel], str, str]] = {
+    "Hazard": (NaturalHazardRisksForSchools, "OutputRaster", "Hazard Index"),
+    "Environmental": (
+        EnvironmentalSuitability,
+        "EnvironmentalSuitability",
+        "Environmental suitability",
+    ),
+    "Economic": (EconomicSuitability, "EconomicSuitability", "Economic suitability"),
+    "Infrastructure": (
+        InfrastructureSuitability,
+        "InfrastructureSuitability",
+        "Infrastructure suitability",
+    ),
+}
+SUITABILITY_STAGES = ["Environmental", "Economic", "Infrastructure"]
+
+
+class McdaPipeline(BaseModel):
+    """
+    This class implements an algorithm running the hazard, suitability and
+    MCDA models in one go. Stage results are passed on as block engine
+    rasters on the analysis grid, so they are never written to disk and
+    reprojected again. Only the MCDA result and the stage results the caller
+    asks for are written, all in a single pass.
+    """
+
+    def initAlgorithm(self, config=None):  # noqa: N802
+        # The stages take their parameters as dictionaries in the format of the
+        # panels, so the algorithm cannot be run in the processing toolbox
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                "ProjectedReferenceSystem",
+                "Projected Reference System",
+                defaultValue="EPSG:4326",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "Studyarea",
+                "Study area",
+                types=[QgsProcessing.TypeVectorPolygon],
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                "OutputRaster", "MCDA", createByDefault=True, defaultValue=None
+            )
+        )
+
+    def processAlgorithm(  # noqa: N802
+        self,
+        parameters: Dict[str, Any],
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+    ) -> Dict[str, Any]:
+        self.startAlgorithm(parameters, context, feedback, steps=len(STAGES) + 2)
+        # Parameters common to all the stages, e.g. the study area
+        shared = {key: value for key, value in parameters.items() if key not in STAGES}
+        stages: Dict[str, BaseModel] = {}
+        hazard_statistics: Optional[Dict[str, float]] = None
+        results: Dict[str, RasterSource] = {}
+        # Smallest and largest values of the results, to store them without
+        # clipping
+        ranges: Dict[str, Optional[Tuple[float, float]]] = {}
+        for index, (name, (model, _, _)) in enumerate(STAGES.items()):
+            if name not in parameters:
+                # Only the hazard index may be given as a layer instead
+                continue
+            self.feedback.setCurrentStep(index)
+            stage_parameters = {
+                **shared,
+                # Stage results can only be passed on as block engine rasters
+                "UseBlockEngine": True,
+                **parameters[name],
+            }
+            if self.study_area:
+                # The study area is only prepared once for all the stages
+                stage_parameters["Studyarea"] = self.study_area
+            if name == "Environmental" and "Hazard" in results:
+                stage_parameters["MultiHazardRisk"] = results["Hazard"]
+                stage_parameters["MultiHazardRiskStatistics"] = hazard_statistics
+            stage = model()
+            stage.startAlgorithm(
+                stage_parameters,
+                context,
+                self.feedback,
+                steps=2 * len(stage_parameters.get("Layers", [])) or 1,
+            )
+            criteria = stage._criteria(stage_parameters)
+            if criteria is None or self.feedback.isCanceled():
+                return {}
+            stages[name] = stage
+            results[name] = stage._weighted_sum(*criteria)
+            ranges[name] = stage._sum_range(stage_parameters, criteria[1])
+            if name == "Hazard":
+                results[name], hazard_statistics = self._store_hazard(
+                    results[name], ranges[name]
+                )
+
+        self.feedback.setCurrentStep(len(STAGES))
+        mcda = self._weighted_sum(
+            [results[name] for name in SUITABILITY_STAGES], parameters["Weights"]
+        )
+        ranges["MCDA"] = sum_range(
+            parameters["Weights"], [ranges[name] for name in SUITABILITY_STAGES]
+        )
+        outputs = self._outputs(parameters, mcda, results, ranges)
+        paths = [
+            path or self._temporary_path(f"{name}.tif")
+            for name, (_, path, _) in outputs.items()
+        ]
+        # Results are masked to the study area and the MCDA result is
+        # summarized by zone in the same pass
+        zonal = self._zonal_accumulator(mcda.grid)
+        write_rasters(
+            [
+                as_scaled_sum(
+                    self._mask_to_study_area(source.resampled(mcda.grid)),
+                    self.sum_data_type,
+                    value_range,
+                )
+                for source, _, value_range in outputs.values()
+            ],
+            paths,
+            feedback=self.feedback,
+            workers=self.workers,
+            profiles=[
+                self.output_profile if path else "fast-temp"
+                for _, path, _ in outputs.values()
+            ],
+            observers=[
+                [zonal[0].update] if zonal and name == "MCDA" else []
+                for name in outputs
+            ],
+        )
+        if self.feedback.isCanceled():
+            return {}
+        self._write_zonal_statistics(zonal)
+        results_by_name = dict(zip(outputs, paths))
+
+        # sample schools if asked for
+        self.feedback.setCurrentStep(len(STAGES) + 1)
+        hazard = parameters.get("Hazard", {})
+        if hazard.get("Schools") and hazard.get("SampledOutput"):
+            schools = stages["Hazard"]
+            # The hazard index is sampled in memory unless it was saved
+            hazard_index = results_by_name.get("Hazard Index") or as_scaled_sum(
+                self._mask_to_study_area(results["Hazard"].resampled(mcda.grid)),
+                self.sum_data_type,
+                ranges["Hazard"],
+            )
+            results_by_name["Hazard Index at Schools"] = schools._sample_layer(
+                hazard_index,
+                schools._clip_vector_to_studyarea(hazard["Schools"])
+                if self.studyarea
+                else hazard["Schools"],
+            )
+
+        results_by_name.update(self._zonal_results())
+
+        layer_names = parameters.get("LayerNames", {})
+        return {
+            layer_names.get(name, name): path for name, path in results_by_name.items()
+        }
+
+    def _store_hazard(
+        self, hazard: RasterSource, value_range: Optional[Tuple[float, float]]
+    ) -> Tuple[RasterSource, Dict[str, float]]:
+        """
+        Write the hazard index masked to the study area and stored like the
+        hazard model stores it, and return it with its statistics gathered
+        while writing. The environmental stage classifies it by its minimum
+        and maximum, so it would otherwise be computed twice, and over the
+        whole extent instead of the study area.
+        """
+        stored = as_scaled_sum(
+            self._mask_to_study_area(hazard), self.sum_data_type, value_range
+        )
+        result = self._raster_source(self._write_raster(stored))
+        # Statistics of the stored values were memoized while writing
+        return result, get_statistics(result).as_dict()
+
+    def _outputs(
+        self,
+        parameters: Dict[str, Any],
+        mcda: RasterSource,
+        results: Dict[str, RasterSource],
+        ranges: Dict[str, Optional[Tuple[float, float]]],
+    ) -> Dict[str, Tuple[RasterSource, str, Optional[Tuple[float, float]]]]:
+        """
+        Rasters to write by the name of their result layer, with the path
+        asked for and their value range.
+        """
+        outputs = {"MCDA": (mcda, parameters.get("OutputRaster"), ranges["MCDA"])}
+        for name, (_, output, layer_name) in STAGES.items():
+            stage_parameters = parameters.get(name, {})
+            if name in results and stage_parameters.get(output):
+                outputs[layer_name] = (
+                    results[name],
+                    stage_parameters.get(output),
+                    ranges[name],
+                )
+        return outputs
+
+    def name(self):
+        return "MCDA pipeline"
+
+    def displayName(self):  # noqa: N802
+        return "MCDA pipeline"
+
+    def group(self):
+        return "Final models"
+
+    def groupId(self):  # noqa: N802
+        return "Final models"
+
+    @classmethod
+    def shortHelpString(cls):  # noqa: N802
+        return """<html><body><h2>Algorithm description</h2>
+<p>This algorithm runs the hazard risk index, the environmental, economic
+and infrastructure suitability and the MCDA models in one go. The results
+of the stages are passed on to the next stages without writing them to
+disk, so only the inputs are reprojected.</p>
+<h2>Input parameters</h2>
+<h3>Hazard, Environmental, Economic, Infrastructure</h3>
+<p>Parameters of each stage, as for the separate models. The hazard stage
+is optional, if the environmental stage is given a hazard index layer.
+Setting the output of a stage saves its result, too.</p>
+<h3>Weights</h3>
+<p>Weights of the environmental, economic and infrastructure suitability
+in the MCDA.</p>
+<h3>Study area</h3>
+<p>A polygon vector layer delimiting the area of analysis.</p>
+<h2>Outputs</h2>
+<h3>MCDA</h3>
+<p>Raster layer ranging from 1 (More suitable) to 4 (Less suitable).</p>
+<br><p>Algorithm author: Development unit at IIEP-UNESCO
+(development@iiep.unesco.org)</p><p>Algorithm version: 1.0</p>
+</body></html>
+"""
+
+    def createInstance(self):  # noqa: N802
+        return McdaPipeline()
@@ -0,0 +1,73 @@
+"""
+Sampling rasters at points in bulk.
+
+Point coordinates are converted to pixel indices all at once and grouped by
+block window, so each block with points is read only once, however many
+points it has. Block engine sources are sampled the same way, so results
+can be sampled before they are written to disk.
+"""
+from typing import Sequence
+
+import numpy as np
+
+from .raster_engine import (
+    BLOCK_SIZE,
+    RasterSource,
+    Window,
+    compute_blocks,
+    stored_values,
+)
+
+
+def sample_points(
+    source: RasterSource,
+    xs: Sequence[float],
+    ys: Sequence[float],
+    block_size: int = BLOCK_SIZE,
+    workers: int = 1,
+) -> np.ndarray:
+    """
+    Values of the source at the points, given in the coordinates of its grid,
+    as they are stored once the source is written. Points outside the grid or
+    on nodata pixels are NaN.
+    """
+    grid = source.grid
+    x0, pixel_width, _, y0, _, pixel_height = grid.geotransform
+    with np.errstate(invalid="ignore"):
+        columns = np.floor((np.asarray(xs, dtype=np.float64) - x0) / pixel_width)
+        rows = np.floor((np.asarray(ys, dtype=np.float64) - y0) / pixel_height)
+    values = np.full(columns.shape, np.nan)
+    inside = np.flatnonzero(
+        (columns >= 0) & (columns < grid.xsize) & (rows >= 0) & (rows < grid.ysize)
+    )
+    if not len(inside):
+        return values
+    columns = columns[inside].astype(np.int64)
+    rows = rows[inside].astype(np.int64)
+    block_columns = -(-grid.xsize // block_size)
+    blocks = (rows // block_size) * block_columns + columns // block_size
+    order = np.argsort(blocks, kind="stable")
+    blocks = blocks[order]
+    # Points of each block are a contiguous run once sorted by block
+    block_ids, starts = np.unique(blocks, return_index=True)
+    ends = np.append(starts[1:], len(blocks))
+    windows = []
+    for block in block_ids:
+        xoff = int(block % block_columns) * block_size
+        yoff = int(block // block_columns) * block_size
+        windows.append(
+            Window(
+                xoff,
+                yoff,
+                min(block_size, grid.xsize - xoff),
+                min(block_size, grid.ysize - yoff),
+            )
+        )
+    for (window, block), start, end in zip(
+        compute_blocks(source.read, windows, workers), starts, ends
+    ):
+        points = order[start:end]
+        values[inside[points]] = block[
+            rows[points] - window.yoff, columns[points] - window.xoff
+        ]
+    return stored_values(source, values)
@@ -0,0 +1,32 @@
+"""Processing provider of the plugin algorithms."""
+from qgis.core import QgsProcessingProvider
+from qgis.PyQt.QtGui import QIcon
+
+from ..qgis_plugin_tools.tools.resources import resources_path
+from .batch_model import BatchRun
+from .pipeline_model import McdaPipeline
+from .sensitivity_model import WeightSensitivity
+
+
+class McdaProvider(QgsProcessingProvider):
+    """
+    Provides the algorithms that can be run without the plugin dialog, e.g.
+    with qgis_process. The model algorithms take their parameters from the
+    panels, so they are not registered. The pipeline takes the parameters of
+    the models as dictionaries, so it can be run with processing.run. The
+    weight sensitivity has parameters of its own for the toolbox.
+    """
+
+    def loadAlgorithms(self) -> None:  # noqa: N802
+        self.addAlgorithm(BatchRun())
+        self.addAlgorithm(McdaPipeline())
+        self.addAlgorithm(WeightSensitivity())
+
+    def id(self) -> str:
+        return "mcda"
+
+    def name(self) -> str:
+        return "School placement MCDA"
+
+    def icon(self) -> QIcon:
+        return QIcon(resources_path("icons", "iiep_logo.svg"))
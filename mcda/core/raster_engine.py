@@ -0,0 +1,1115 @@
+"""
+In-process raster engine.
+
+Instead of running every raster calculator step as a separate GDAL process
+that writes a full GeoTIFF to disk, steps are expressed as lazy rasters.
+A lazy raster only knows how to compute a given block window from its
+sources. Chaining lazy rasters fuses the steps, so the whole chain is
+evaluated in a single read-compute-write pass over block windows.
+"""
+import math
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import numpy as np
+from osgeo import gdal, osr
+
+# Default block window size in pixels. 512x512 Float64 blocks are 2 MB each,
+# so even long chains stay well within memory.
+BLOCK_SIZE = 512
+# Nodata value used when writing floating point results
+FLOAT_NODATA = -9999.0
+# Suitability classes 1...4 are stored as bytes, with zero reserved for nodata
+CLASS_DATA_TYPE = "Byte"
+CLASS_NODATA = 0
+# Range of the suitability classes
+CLASS_RANGE = (1.0, 4.0)
+# Weighted sums are stored as integers scaled by at least these factors, with
+# the largest value reserved for nodata. Sums of classes 1...4 or of layers
+# normalized to 0...1 fit both unchanged, given weights that sum to one.
+SUM_SCALES = {"Byte": 0.02, "UInt16": 0.0001}
+
+GDAL_NUMPY_TYPES = {
+    "Byte": np.uint8,
+    "UInt16": np.uint16,
+    "Int16": np.int16,
+    "UInt32": np.uint32,
+    "Int32": np.int32,
+    "Float32": np.float32,
+    "Float64": np.float64,
+}
+
+GDAL_DATA_TYPES = {
+    "Byte": gdal.GDT_Byte,
+    "UInt16": gdal.GDT_UInt16,
+    "Int16": gdal.GDT_Int16,
+    "UInt32": gdal.GDT_UInt32,
+    "Int32": gdal.GDT_Int32,
+    "Float32": gdal.GDT_Float32,
+    "Float64": gdal.GDT_Float64,
+}
+
+
+class Window(NamedTuple):
+    """Block window in pixel coordinates."""
+
+    xoff: int
+    yoff: int
+    xsize: int
+    ysize: int
+
+
+class RasterGrid:
+    """
+    Pixel grid of a raster: size, geotransform and CRS. Rasters on the same
+    grid can be processed block by block without resampling.
+    """
+
+    def __init__(
+        self, geotransform: Sequence[float], xsize: int, ysize: int, crs_wkt: str
+    ) -> None:
+        self.geotransform = tuple(geotransform)
+        self.xsize = xsize
+        self.ysize = ysize
+        self.crs_wkt = crs_wkt
+
+    @classmethod
+    def from_dataset(cls, dataset: gdal.Dataset) -> "RasterGrid":
+        return cls(
+            dataset.GetGeoTransform(),
+            dataset.RasterXSize,
+            dataset.RasterYSize,
+            dataset.GetProjection(),
+        )
+
+    @classmethod
+    def union(cls, grids: Sequence["RasterGrid"]) -> "RasterGrid":
+        """
+        Grid covering the union of the given grids, with the pixel size and
+        CRS of the first grid. This is the output grid gdal_merge would use.
+        """
+        first = grids[0]
+        xmin = min(grid.bounds[0] for grid in grids)
+        ymin = min(grid.bounds[1] for grid in grids)
+        xmax = max(grid.bounds[2] for grid in grids)
+        ymax = max(grid.bounds[3] for grid in grids)
+        xsize = int(round((xmax - xmin) / first.pixel_width))
+        ysize = int(round((ymax - ymin) / first.pixel_height))
+        return cls(
+            (xmin, first.pixel_width, 0, ymax, 0, -first.pixel_height),
+            max(xsize, 1),
+            max(ysize, 1),
+            first.crs_wkt,
+        )
+
+    @classmethod
+    def from_bounds(
+        cls,
+        bounds: Sequence[float],
+        pixel_size: float,
+        crs_wkt: str,
+    ) -> "RasterGrid":
+        """
+        Grid covering the bounds (xmin, ymin, xmax, ymax), with its edges
+        snapped outwards to multiples of the pixel size. Grids of overlapping
+        areas with the same pixel size are then always pixel aligned.
+        """
+        xmin = math.floor(bounds[0] / pixel_size) * pixel_size
+        ymin = math.floor(bounds[1] / pixel_size) * pixel_size
+        xmax = math.ceil(bounds[2] / pixel_size) * pixel_size
+        ymax = math.ceil(bounds[3] / pixel_size) * pixel_size
+        return cls(
+            (xmin, pixel_size, 0, ymax, 0, -pixel_size),
+            max(int(round((xmax - xmin) / pixel_size)), 1),
+            max(int(round((ymax - ymin) / pixel_size)), 1),
+            crs_wkt,
+        )
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """
+        Grid extent as xmin, ymin, xmax, ymax.
+        """
+        x, y = self.geotransform[0], self.geotransform[3]
+        width = self.xsize * self.geotransform[1]
+        height = self.ysize * self.geotransform[5]
+        return (
+            min(x, x + width),
+            min(y, y + height),
+            max(x, x + width),
+            max(y, y + height),
+        )
+
+    @property
+    def pixel_width(self) -> float:
+        return abs(self.geotransform[1])
+
+    @property
+    def pixel_height(self) -> float:
+        return abs(self.geotransform[5])
+
+    def matches(self, other: "RasterGrid") -> bool:
+        """
+        Whether the two grids are pixel aligned. Allow for small floating point
+        differences in the geotransform.
+        """
+        if (self.xsize, self.ysize) != (other.xsize, other.ysize):
+            return False
+        tolerance = 1e-6 * max(self.pixel_width, self.pixel_height)
+        if not all(
+            abs(a - b) <= tolerance
+            for a, b in zip(self.geotransform, other.geotransform)
+        ):
+            return False
+        if self.crs_wkt and other.crs_wkt and self.crs_wkt != other.crs_wkt:
+            srs = osr.SpatialReference(wkt=self.crs_wkt)
+            return bool(srs.IsSame(osr.SpatialReference(wkt=other.crs_wkt)))
+        return True
+
+    def expanded(self, distance: float) -> "RasterGrid":
+        """
+        Grid extended on every side by the whole pixels covering the distance,
+        pixel aligned with this grid.
+        """
+        columns = math.ceil(distance / self.pixel_width)
+        rows = math.ceil(distance / self.pixel_height)
+        x, width, _, y, _, height = self.geotransform
+        return RasterGrid(
+            (x - columns * width, width, 0, y - rows * height, 0, height),
+            self.xsize + 2 * columns,
+            self.ysize + 2 * rows,
+            self.crs_wkt,
+        )
+
+    def offset_in(self, other: "RasterGrid") -> Optional[Tuple[int, int]]:
+        """
+        Column and row of the first pixel of this grid in the other grid, or
+        None if this grid is not a pixel aligned part of the other.
+        """
+        tolerance = 1e-6
+        if (
+            abs(self.geotransform[1] - other.geotransform[1])
+            > tolerance * other.pixel_width
+            or abs(self.geotransform[5] - other.geotransform[5])
+            > tolerance * other.pixel_height
+        ):
+            return None
+        column = (self.geotransform[0] - other.geotransform[0]) / other.geotransform[1]
+        row = (self.geotransform[3] - other.geotransform[3]) / other.geotransform[5]
+        if abs(column - round(column)) > tolerance or abs(row - round(row)) > tolerance:
+            return None
+        column, row = int(round(column)), int(round(row))
+        if (
+            column < 0
+            or row < 0
+            or column + self.xsize > other.xsize
+            or row + self.ysize > other.ysize
+        ):
+            return None
+        return column, row
+
+    def windows(self, block_size: int = BLOCK_SIZE) -> Iterator[Window]:
+        """
+        Iterate over the grid in block windows, row by row.
+        """
+        for yoff in range(0, self.ysize, block_size):
+            for xoff in range(0, self.xsize, block_size):
+                yield Window(
+                    xoff,
+                    yoff,
+                    min(block_size, self.xsize - xoff),
+                    min(block_size, self.ysize - yoff),
+                )
+
+    def window_count(self, block_size: int = BLOCK_SIZE) -> int:
+        return -(-self.xsize // block_size) * -(-self.ysize // block_size)
+
+
+def padded_window(
+    grid: RasterGrid, window: Window, halo: Tuple[int, int]
+) -> Tuple[Window, int, int]:
+    """
+    Window padded with a halo of (columns, rows), clipped to the grid. Also
+    return the offset of the original window inside the padded window.
+    """
+    xoff = max(window.xoff - halo[0], 0)
+    yoff = max(window.yoff - halo[1], 0)
+    xend = min(window.xoff + window.xsize + halo[0], grid.xsize)
+    yend = min(window.yoff + window.ysize + halo[1], grid.ysize)
+    return (
+        Window(xoff, yoff, xend - xoff, yend - yoff),
+        window.xoff - xoff,
+        window.yoff - yoff,
+    )
+
+
+class RasterSource:
+    """
+    Anything that can return raster values for a block window. Values are
+    returned as Float64 arrays with nodata pixels set to NaN.
+    """
+
+    grid: RasterGrid
+    # Data type and nodata value the raster is written with, unless otherwise
+    # requested. Values are stored as (value - offset) / scale.
+    data_type = "Float32"
+    output_nodata: Optional[float] = FLOAT_NODATA
+    scale = 1.0
+    offset = 0.0
+
+    def read(self, window: Window) -> np.ndarray:
+        raise NotImplementedError()
+
+    def resampled(self, grid: RasterGrid) -> "RasterSource":
+        """
+        The same raster on another pixel grid. Pixels are resampled on the fly
+        with nearest neighbour, without writing a new raster.
+        """
+        raise NotImplementedError()
+
+    def map(
+        self, func: Callable[[np.ndarray], np.ndarray], propagate_nodata: bool = True
+    ) -> "LazyRaster":
+        """
+        Apply a pixel-wise function lazily. The function is fused with the
+        rest of the chain and only evaluated when blocks are read.
+        """
+        return LazyRaster([self], func, propagate_nodata=propagate_nodata)
+
+    def cropped(self, grid: RasterGrid) -> "CroppedRaster":
+        """
+        Part of the raster on a pixel aligned grid within its own grid. Unlike
+        resampling, pixels are read as is, e.g. distances to features outside
+        the smaller grid.
+        """
+        return CroppedRaster(self, grid)
+
+    def stored_as(
+        self,
+        data_type: str,
+        nodata: Optional[float],
+        scale: float = 1.0,
+        offset: float = 0.0,
+    ) -> "StoredRaster":
+        """
+        The same raster, written with another data type, nodata and scaling.
+        """
+        return StoredRaster(self, data_type, nodata, scale, offset)
+
+    def masked(self, mask: "RasterSource") -> "MaskedRaster":
+        """
+        The same raster with nodata where the mask is nodata.
+        """
+        return MaskedRaster(self, mask)
+
+
+class StoredRaster(RasterSource):
+    """
+    Raster source with the data type and scaling it is written with.
+    """
+
+    def __init__(
+        self,
+        source: RasterSource,
+        data_type: str,
+        nodata: Optional[float],
+        scale: float = 1.0,
+        offset: float = 0.0,
+    ) -> None:
+        self.source = source
+        self.grid = source.grid
+        self.data_type = data_type
+        self.output_nodata = nodata
+        self.scale = scale
+        self.offset = offset
+
+    def read(self, window: Window) -> np.ndarray:
+        return self.source.read(window)
+
+    def resampled(self, grid: RasterGrid) -> "StoredRaster":
+        return StoredRaster(
+            self.source.resampled(grid),
+            self.data_type,
+            self.output_nodata,
+            self.scale,
+            self.offset,
+        )
+
+
+class CroppedRaster(RasterSource):
+    """
+    Raster source read from a window of a source on a larger aligned grid.
+    """
+
+    def __init__(self, source: RasterSource, grid: RasterGrid) -> None:
+        offset = grid.offset_in(source.grid)
+        if offset is None:
+            raise ValueError("Grid is not an aligned part of the source grid")
+        self.source = source
+        self.grid = grid
+        self.column, self.row = offset
+        self.data_type = source.data_type
+        self.output_nodata = source.output_nodata
+        self.scale = source.scale
+        self.offset = source.offset
+
+    def read(self, window: Window) -> np.ndarray:
+        return self.source.read(
+            Window(
+                window.xoff + self.column,
+                window.yoff + self.row,
+                window.xsize,
+                window.ysize,
+            )
+        )
+
+    def resampled(self, grid: RasterGrid) -> RasterSource:
+        if grid.matches(self.grid):
+            return self
+        if grid.offset_in(self.source.grid) is not None:
+            return CroppedRaster(self.source, grid)
+        return self.source.resampled(grid)
+
+
+class MaskedRaster(RasterSource):
+    """
+    Raster source with nodata outside a mask, e.g. the study area. Blocks
+    entirely outside the mask are not read from the source at all, so the
+    work done depends on the area of the mask instead of its extent.
+    """
+
+    def __init__(self, source: RasterSource, mask: RasterSource) -> None:
+        if not mask.grid.matches(source.grid):
+            mask = mask.resampled(source.grid)
+        self.source = source
+        self.mask = mask
+        self.grid = source.grid
+        self.data_type = source.data_type
+        self.output_nodata = source.output_nodata
+        self.scale = source.scale
+        self.offset = source.offset
+
+    def read(self, window: Window) -> np.ndarray:
+        outside = np.isnan(self.mask.read(window))
+        if outside.all():
+            return np.full((window.ysize, window.xsize), np.nan)
+        block = self.source.read(window)
+        if outside.any():
+            block = np.where(outside, np.nan, block)
+        return block
+
+    def resampled(self, grid: RasterGrid) -> "MaskedRaster":
+        return MaskedRaster(self.source.resampled(grid), self.mask.resampled(grid))
+
+
+def as_classes(source: RasterSource) -> RasterSource:
+    """
+    Suitability classes stored as bytes.
+    """
+    return source.stored_as(CLASS_DATA_TYPE, CLASS_NODATA)
+
+
+def sum_range(
+    weights: Sequence[float], ranges: Sequence[Optional[Tuple[float, float]]]
+) -> Optional[Tuple[float, float]]:
+    """
+    Smallest and largest weighted sum of values within the ranges, or None if
+    the range of any of the values is unknown.
+    """
+    if any(value_range is None for value_range in ranges):
+        return None
+    products = [
+        (weight * value_range[0], weight * value_range[1])
+        for weight, value_range in zip(weights, ranges)
+        if value_range is not None
+    ]
+    return (
+        sum(min(product) for product in products),
+        sum(max(product) for product in products),
+    )
+
+
+def as_scaled_sum(
+    source: RasterSource,
+    data_type: str = "UInt16",
+    value_range: Optional[Tuple[float, float]] = None,
+) -> RasterSource:
+    """
+    Weighted sum stored as scaled integers of the given data type, or as is
+    if the data type is not one of SUM_SCALES, e.g. Float32. The scale and
+    offset are chosen so that the whole value range of the sum fits the data
+    type, see sum_range. Sums of unknown range are stored as Float32, so that
+    no values are clipped.
+    """
+    if data_type not in SUM_SCALES:
+        return source.stored_as(data_type, FLOAT_NODATA)
+    if value_range is None:
+        return source.stored_as("Float32", FLOAT_NODATA)
+    low, high = value_range
+    # Integer types are unsigned, so negative sums are offset
+    offset = min(low, 0.0)
+    nodata = np.iinfo(GDAL_NUMPY_TYPES[data_type]).max
+    scale = max(SUM_SCALES[data_type], (high - offset) / (nodata - 1))
+    return source.stored_as(data_type, nodata, scale=scale, offset=offset)
+
+
+class FileRaster(RasterSource):
+    """
+    Single band of a raster file readable by GDAL.
+    """
+
+    def __init__(self, path: str, band: int = 1, use_nodata: bool = True) -> None:
+        self.path = path
+        self.band_number = band
+        self.use_nodata = use_nodata
+        # Raster a resampled raster is read from
+        self.parent: Optional[FileRaster] = None
+        # GDAL datasets must not be shared between threads, so each thread
+        # opens its own
+        self._local = threading.local()
+        self.grid = RasterGrid.from_dataset(self.dataset)
+        self.nodata = self.band.GetNoDataValue() if use_nodata else None
+        # Scaled integers are read as the values they stand for
+        self.scale = self.band.GetScale() or 1.0
+        self.offset = self.band.GetOffset() or 0.0
+        # Rasters with a nodata value are written as they are stored
+        data_type = gdal.GetDataTypeName(self.band.DataType)
+        if self.nodata is not None and data_type in GDAL_NUMPY_TYPES:
+            self.data_type = data_type
+            self.output_nodata = self.nodata
+
+    @property
+    def dataset(self) -> gdal.Dataset:
+        dataset = getattr(self._local, "dataset", None)
+        if dataset is None:
+            dataset = gdal.Open(self.path)
+            if dataset is None:
+                raise ValueError(f"Could not open raster {self.path}")
+            self._local.dataset = dataset
+        return dataset
+
+    @property
+    def band(self) -> gdal.Band:
+        return self.dataset.GetRasterBand(self.band_number)
+
+    def read(self, window: Window) -> np.ndarray:
+        data = self.band.ReadAsArray(*window).astype(np.float64)
+        # NaN nodata values are already NaN
+        if self.nodata is not None and not np.isnan(self.nodata):
+            data[data == self.nodata] = np.nan
+        if self.scale != 1 or self.offset != 0:
+            data = data * self.scale + self.offset
+        return data
+
+    def resampled(self, grid: RasterGrid) -> "FileRaster":
+        if grid.matches(self.grid):
+            return self
+        # A warped VRT only stores the warp instructions. Pixels are resampled
+        # when blocks are read.
+        path = f"/vsimem/{uuid.uuid4().hex}.vrt"
+        options = gdal.WarpOptions(
+            format="VRT",
+            outputBounds=grid.bounds,
+            width=grid.xsize,
+            height=grid.ysize,
+            dstSRS=grid.crs_wkt or None,
+            resampleAlg="near",
+        )
+        if gdal.Warp(path, self.dataset, options=options) is None:
+            raise ValueError(f"Could not resample raster {self.path}")
+        resampled = FileRaster(path, self.band_number, self.use_nodata)
+        # The VRT reads this raster, so it must not be freed before the VRT
+        resampled.parent = self
+        return resampled
+
+
+class LazyRaster(RasterSource):
+    """
+    Pixel-wise function of one or more aligned raster sources, evaluated
+    block by block on demand.
+
+    If propagate_nodata is set, pixels that are nodata in any of the sources
+    will be nodata in the result, like in the GDAL raster calculator.
+    Otherwise the function itself is responsible for handling NaN input.
+    """
+
+    def __init__(
+        self,
+        sources: List[RasterSource],
+        func: Callable[..., np.ndarray],
+        propagate_nodata: bool = True,
+    ) -> None:
+        if not sources:
+            raise ValueError("Lazy raster needs at least one source")
+        for source in sources[1:]:
+            if not source.grid.matches(sources[0].grid):
+                raise ValueError("Lazy raster sources must be pixel aligned")
+        self.sources = sources
+        self.func = func
+        self.propagate_nodata = propagate_nodata
+        self.grid = sources[0].grid
+
+    def read(self, window: Window) -> np.ndarray:
+        arrays = [source.read(window) for source in self.sources]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = np.asarray(self.func(*arrays), dtype=np.float64)
+        if self.propagate_nodata:
+            nodata = np.zeros(result.shape, dtype=bool)
+            for array in arrays:
+                nodata |= np.isnan(array)
+            result[nodata] = np.nan
+        return result
+
+    def resampled(self, grid: RasterGrid) -> "LazyRaster":
+        # Pixel-wise functions can be applied after nearest neighbour
+        # resampling of the sources without changing the result
+        return LazyRaster(
+            [source.resampled(grid) for source in self.sources],
+            self.func,
+            propagate_nodata=self.propagate_nodata,
+        )
+
+
+def classify_distance(
+    distance: np.ndarray,
+    min_distance: float,
+    max_distance: float,
+    further_is_better: bool = False,
+    too_close_classification: int = 4,
+    too_far_classification: int = 4,
+) -> np.ndarray:
+    """
+    Classify distances to suitability classes. Distances are divided to three
+    concentric bands between min_distance and max_distance, plus fixed classes
+    for too close and too far. Same formula as the raster calculator
+    expression used by the processing implementation.
+    """
+    too_close = distance <= min_distance
+    close = (distance > min_distance) & (distance <= max_distance / 3)
+    medium = (distance > max_distance / 3) & (distance < 2 * max_distance / 3)
+    far = (distance >= 2 * max_distance / 3) & (distance < max_distance)
+    too_far = distance >= max_distance
+    if further_is_better:
+        close_class, far_class = 3, 1
+    else:
+        close_class, far_class = 1, 3
+    return (
+        too_close_classification * too_close
+        + close_class * close
+        + 2 * medium
+        + far_class * far
+        + too_far_classification * too_far
+    ).astype(np.float64)
+
+
+# Classification of values in the quarters of the positive value range, as a
+# raster calculator expression of band A. Values of exactly zero are suitable
+# and the minimum is in the first class, clamped explicitly instead of relying
+# on class zero being stored as one.
+VALUE_CLASS_EXPRESSION = (
+    "maximum(ceil(4*(A - {minimum})/({maximum} - {minimum}))*(A > 0) + (A == 0), 1)"
+)
+
+
+def classify_value(values: np.ndarray, minimum: float, maximum: float) -> np.ndarray:
+    """
+    Classify values to suitability classes 1...4 from the minimum to the
+    maximum. Same formula as VALUE_CLASS_EXPRESSION, used by the processing
+    implementation.
+    """
+    return np.maximum(
+        np.ceil(4 * (values - minimum) / (maximum - minimum)) * (values > 0)
+        + (values == 0),
+        1,
+    )
+
+
+def align_sources(
+    sources: Sequence[RasterSource], grid: Optional[RasterGrid] = None
+) -> List[RasterSource]:
+    """
+    Virtual stack of raster sources on a common grid. By default, the grid
+    covers all the sources with the pixel size of the first source. Only the
+    sources that are not already on the grid are resampled.
+    """
+    if grid is None:
+        grid = RasterGrid.union([source.grid for source in sources])
+    return [source.resampled(grid) for source in sources]
+
+
+class WeightedSum(RasterSource):
+    """
+    Weighted sum of raster sources, accumulated block by block into a single
+    buffer. Any number of rasters may be summed without materializing them
+    as a multiband raster, and only one input block is held in memory at a
+    time. Sources not on the same grid are aligned first.
+    """
+
+    def __init__(
+        self, sources: Sequence[RasterSource], weights: Sequence[float]
+    ) -> None:
+        if len(sources) != len(weights):
+            raise ValueError("Each raster needs a weight")
+        if not all(source.grid.matches(sources[0].grid) for source in sources):
+            sources = align_sources(sources)
+        self.sources = list(sources)
+        self.weights = list(weights)
+        self.grid = self.sources[0].grid
+
+    def read(self, window: Window) -> np.ndarray:
+        total = np.zeros((window.ysize, window.xsize), dtype=np.float64)
+        for source, weight in zip(self.sources, self.weights):
+            # NaN (nodata) in any input propagates to the sum
+            total += weight * source.read(window)
+        return total
+
+    def resampled(self, grid: RasterGrid) -> "WeightedSum":
+        return WeightedSum(
+            [source.resampled(grid) for source in self.sources], self.weights
+        )
+
+
+def weighted_sum(
+    sources: Sequence[RasterSource], weights: Sequence[float]
+) -> WeightedSum:
+    """
+    Lazy weighted sum of raster sources.
+    """
+    return WeightedSum(sources, weights)
+
+
+T = TypeVar("T")
+
+
+def compute_blocks(
+    compute: Callable[[Window], T], windows: Iterable[Window], workers: int = 1
+) -> Iterator[Tuple[Window, T]]:
+    """
+    Compute blocks with a pool of worker threads, yielding them in window
+    order. NumPy and GDAL release the GIL for the heavy work, so blocks are
+    computed in parallel. Only a few blocks per worker are in flight at a time
+    to bound memory use.
+    """
+    if workers <= 1:
+        for window in windows:
+            yield window, compute(window)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: Deque[Tuple[Window, Any]] = deque()
+        for window in windows:
+            pending.append((window, executor.submit(compute, window)))
+            if len(pending) >= 2 * workers:
+                done, future = pending.popleft()
+                yield done, future.result()
+        while pending:
+            done, future = pending.popleft()
+            yield done, future.result()
+
+
+class OutputProfile(NamedTuple):
+    """
+    How rasters are stored. Blocks are always written to a tiled GeoTIFF
+    with the creation options. Profiles with COG options are then copied to
+    a Cloud Optimized GeoTIFF, with overviews built in the same block pass.
+    """
+
+    options: Tuple[str, ...]
+    cog_options: Optional[Tuple[str, ...]] = None
+
+
+OUTPUT_PROFILES = {
+    # Intermediate results, read back once by the next step
+    "fast-temp": OutputProfile(("TILED=YES", "SPARSE_OK=TRUE", "BIGTIFF=IF_SAFER")),
+    # Final results to display in QGIS and share. ZSTD compresses faster,
+    # but it is missing from some GDAL builds.
+    "deliverable": OutputProfile(
+        ("TILED=YES", "SPARSE_OK=TRUE", "BIGTIFF=IF_SAFER"),
+        ("COMPRESS=DEFLATE", "PREDICTOR=YES", "BIGTIFF=IF_SAFER"),
+    ),
+    "deliverable-zstd": OutputProfile(
+        ("TILED=YES", "SPARSE_OK=TRUE", "BIGTIFF=IF_SAFER"),
+        ("COMPRESS=ZSTD", "PREDICTOR=YES", "BIGTIFF=IF_SAFER"),
+    ),
+}
+
+
+def output_profile(profile: Union[str, OutputProfile]) -> OutputProfile:
+    """
+    Output profile by name, e.g. the profile parameter of a model.
+    """
+    if isinstance(profile, OutputProfile):
+        return profile
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile {profile}")
+    return OUTPUT_PROFILES[profile]
+
+
+def overview_factors(xsize: int, ysize: int, block_size: int) -> List[int]:
+    """
+    Overview levels down to the size of a single block, as the COG driver
+    would build them. Factors are capped at the block size, so every block
+    maps to whole pixels of every overview.
+    """
+    factors: List[int] = []
+    factor = 1
+    while max(xsize, ysize) > block_size * factor and factor * 2 <= block_size:
+        factor *= 2
+        factors.append(factor)
+    return factors
+
+
+def downsample(block: np.ndarray, factor: int, average: bool = True) -> np.ndarray:
+    """
+    Downsample a block by an integer factor. Averages leave out nodata, and
+    only pixels without any data are nodata. Classes take the nearest value
+    instead, since their averages are not classes.
+    """
+    if not average:
+        return block[::factor, ::factor]
+    rows, cols = block.shape
+    padded = np.full((-(-rows // factor) * factor, -(-cols // factor) * factor), np.nan)
+    padded[:rows, :cols] = block
+    tiles = padded.reshape(
+        padded.shape[0] // factor, factor, padded.shape[1] // factor, factor
+    )
+    valid = ~np.isnan(tiles)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, tiles, 0).sum(axis=(1, 3))
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def _create_raster(
+    grid: RasterGrid,
+    path: str,
+    data_type: str,
+    nodata: Optional[float],
+    block_size: int,
+    options: Sequence[str] = OUTPUT_PROFILES["fast-temp"].options,
+    scale: float = 1.0,
+    offset: float = 0.0,
+) -> gdal.Dataset:
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(
+        path,
+        grid.xsize,
+        grid.ysize,
+        1,
+        GDAL_DATA_TYPES[data_type],
+        options=[*options, f"BLOCKXSIZE={block_size}", f"BLOCKYSIZE={block_size}"],
+    )
+    if dataset is None:
+        raise IOError(f"Could not create raster {path}")
+    dataset.SetGeoTransform(grid.geotransform)
+    dataset.SetProjection(grid.crs_wkt)
+    band = dataset.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    if scale != 1 or offset != 0:
+        band.SetScale(scale)
+        band.SetOffset(offset)
+    return dataset
+
+
+def copy_to_profile(
+    source_path: str, path: str, profile: Union[str, OutputProfile]
+) -> str:
+    """
+    Copy a raster written by GDAL algorithms to the path in the output
+    profile. The COG driver builds the overviews of these.
+    """
+    profile = output_profile(profile)
+    if profile.cog_options is None:
+        options = gdal.TranslateOptions(creationOptions=list(profile.options))
+    else:
+        options = gdal.TranslateOptions(
+            format="COG", creationOptions=list(profile.cog_options)
+        )
+    if gdal.Translate(path, source_path, options=options) is None:
+        raise IOError(f"Could not write raster {path}")
+    copy_scaling(source_path, path)
+    return path
+
+
+def copy_scaling(source_path: str, target_path: str) -> None:
+    """
+    Copy the scale and offset of a raster to a raster warped from it, in case
+    the warp did not keep them. Otherwise the scaled integers of the target
+    would be read as is.
+    """
+    source = gdal.Open(source_path)
+    if source is None:
+        return
+    band = source.GetRasterBand(1)
+    scale, offset = band.GetScale() or 1.0, band.GetOffset() or 0.0
+    if scale == 1 and offset == 0:
+        return
+    target = gdal.Open(target_path, gdal.GA_Update)
+    if target is None:
+        return
+    target_band = target.GetRasterBand(1)
+    if (target_band.GetScale(), target_band.GetOffset()) != (scale, offset):
+        target_band.SetScale(scale)
+        target_band.SetOffset(offset)
+    target = None
+
+
+def cutline_nodata(source_path: str, nodata: Optional[float] = None) -> float:
+    """
+    Nodata value for warping a raster with a cutline. Without one, the area
+    outside the cutline is filled with zeros, which are read as valid values,
+    e.g. elevations next to the boundary. The nodata of the source is kept,
+    floats without one get NaN and integers the largest value of their type.
+    """
+    if nodata is not None:
+        return nodata
+    source = gdal.Open(source_path)
+    if source is None:
+        return math.nan
+    band = source.GetRasterBand(1)
+    if band.GetNoDataValue() is not None:
+        return band.GetNoDataValue()
+    dtype = GDAL_NUMPY_TYPES.get(gdal.GetDataTypeName(band.DataType), np.float64)
+    if np.issubdtype(dtype, np.floating):
+        return math.nan
+    return float(np.iinfo(dtype).max)
+
+
+def _encode(
+    block: np.ndarray,
+    data_type: str,
+    nodata: Optional[float],
+    scale: float = 1.0,
+    offset: float = 0.0,
+) -> np.ndarray:
+    """
+    Values of a block as stored in the data type. Integer values are rounded
+    and clipped to the range of the type, leaving out the nodata value.
+    """
+    missing = np.isnan(block)
+    if scale != 1 or offset != 0:
+        block = (block - offset) / scale
+    dtype = np.dtype(GDAL_NUMPY_TYPES[data_type])
+    if np.issubdtype(dtype, np.integer):
+        low, high = np.iinfo(dtype).min, np.iinfo(dtype).max
+        if nodata == low:
+            low += 1
+        elif nodata == high:
+            high -= 1
+        block = np.clip(np.rint(np.where(missing, low, block)), low, high)
+    if nodata is not None:
+        block = np.where(missing, nodata, block)
+    return block.astype(dtype)
+
+
+def stored_values(
+    source: RasterSource, values: np.ndarray, data_type: Optional[str] = None
+) -> np.ndarray:
+    """
+    Values of the source as they are read back once the source is written,
+    by default in its own data type, e.g. weighted sums rounded to their
+    scaled integers.
+    """
+    missing = np.isnan(values)
+    stored = _encode(
+        values,
+        data_type or source.data_type,
+        source.output_nodata,
+        source.scale,
+        source.offset,
+    ).astype(np.float64)
+    stored = stored * source.scale + source.offset
+    stored[missing] = np.nan
+    return stored
+
+
+class _RasterWriter:
+    """
+    Writes the blocks of a source to a raster in an output profile. For COG
+    profiles, the blocks are downsampled to the overviews as they are written,
+    and the tiled GeoTIFF is copied to a COG once all blocks are written.
+    """
+
+    def __init__(
+        self,
+        source: RasterSource,
+        path: str,
+        data_type: str,
+        nodata: Optional[float],
+        block_size: int,
+        profile: Union[str, OutputProfile],
+    ) -> None:
+        self.source = source
+        self.path = path
+        self.data_type = data_type
+        self.nodata = nodata
+        self.profile = output_profile(profile)
+        # The COG driver can only copy a complete raster
+        self.target = f"{path}.partial.tif" if self.profile.cog_options else path
+        self.dataset = _create_raster(
+            source.grid,
+            self.target,
+            data_type,
+            nodata,
+            block_size,
+            self.profile.options,
+            source.scale,
+            source.offset,
+        )
+        self.band = self.dataset.GetRasterBand(1)
+        self.factors = (
+            overview_factors(source.grid.xsize, source.grid.ysize, block_size)
+            if self.profile.cog_options
+            else []
+        )
+        if self.factors:
+            # Empty overview levels, filled block by block
+            self.dataset.BuildOverviews("NONE", self.factors)
+        integers = np.issubdtype(np.dtype(GDAL_NUMPY_TYPES[data_type]), np.integer)
+        self.average = not integers or source.scale != 1 or source.offset != 0
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        return _encode(
+            block, self.data_type, self.nodata, self.source.scale, self.source.offset
+        )
+
+    def write(self, window: Window, block: np.ndarray) -> None:
+        if self.nodata is not None and np.isnan(block).all():
+            # GDAL fills blocks that are never written with nodata, and
+            # leaves them out of sparse files
+            return
+        self.band.WriteArray(self._encode(block), window.xoff, window.yoff)
+        for index, factor in enumerate(self.factors):
+            self.band.GetOverview(index).WriteArray(
+                self._encode(downsample(block, factor, self.average)),
+                window.xoff // factor,
+                window.yoff // factor,
+            )
+
+    def close(self, complete: bool = True) -> None:
+        """
+        Flush the raster. Incomplete COG rasters are not copied.
+        """
+        self.band.FlushCache()
+        self.band = None
+        self.dataset = None
+        if self.target == self.path:
+            return
+        if complete:
+            options = gdal.TranslateOptions(
+                format="COG", creationOptions=list(self.profile.cog_options)
+            )
+            if gdal.Translate(self.path, self.target, options=options) is None:
+                raise IOError(f"Could not write raster {self.path}")
+        gdal.GetDriverByName("GTiff").Delete(self.target)
+
+
+def write_raster(
+    source: RasterSource,
+    path: str,
+    data_type: Optional[str] = None,
+    nodata: Optional[float] = None,
+    feedback: Optional[Any] = None,
+    block_size: int = BLOCK_SIZE,
+    observers: Sequence[Callable[[Window, np.ndarray], None]] = (),
+    workers: int = 1,
+    profile: Union[str, OutputProfile] = "fast-temp",
+) -> str:
+    """
+    Evaluate the source block by block and write the result to a GeoTIFF in
+    the output profile. Feedback may be any QgsFeedback: progress is reported
+    per block and the write is stopped if the feedback is canceled.
+
+    Observers are called with each computed block before it is written, so
+    e.g. statistics of the result can be gathered in the same pass. With
+    more than one worker, blocks are computed in parallel, but observers are
+    still called and blocks written in window order.
+    """
+    grid = source.grid
+    data_type = data_type if data_type else source.data_type
+    nodata = nodata if nodata is not None else source.output_nodata
+    writer = _RasterWriter(source, path, data_type, nodata, block_size, profile)
+    total = grid.window_count(block_size)
+    blocks = compute_blocks(source.read, grid.windows(block_size), workers)
+    for index, (window, block) in enumerate(blocks):
+        if feedback and feedback.isCanceled():
+            break
+        for observer in observers:
+            observer(window, block)
+        writer.write(window, block)
+        if feedback:
+            feedback.setProgress(100 * (index + 1) / total)
+    writer.close(complete=not (feedback and feedback.isCanceled()))
+    return path
+
+
+def write_rasters(
+    sources: Sequence[RasterSource],
+    paths: Sequence[str],
+    feedback: Optional[Any] = None,
+    block_size: int = BLOCK_SIZE,
+    workers: int = 1,
+    profiles: Optional[Sequence[Union[str, OutputProfile]]] = None,
+    observers: Optional[
+        Sequence[Sequence[Callable[[Window, np.ndarray], None]]]
+    ] = None,
+) -> List[str]:
+    """
+    Write several sources on the same grid in a single block pass. Sources
+    computed from the same intermediate results can share them, since each
+    window is read from every source before moving to the next window. By
+    default, all the rasters are written in the fast-temp profile. Observers
+    of each source are called like in write_raster.
+    """
+    grid = sources[0].grid
+    if not all(source.grid.matches(grid) for source in sources):
+        raise ValueError("Sources written together must be on the same grid")
+    writers = [
+        _RasterWriter(
+            source,
+            path,
+            source.data_type,
+            source.output_nodata,
+            block_size,
+            profile,
+        )
+        for source, path, profile in zip(
+            sources, paths, profiles or ["fast-temp"] * len(sources)
+        )
+    ]
+    total = grid.window_count(block_size)
+    blocks = compute_blocks(
+        lambda window: [source.read(window) for source in sources],
+        grid.windows(block_size),
+        workers,
+    )
+    for index, (window, source_blocks) in enumerate(blocks):
+        if feedback and feedback.isCanceled():
+            break
+        for writer, block, block_observers in zip(
+            writers, source_blocks, observers or [()] * len(sources)
+        ):
+            for observer in block_observers:
+                observer(window, block)
+            writer.write(window, block)
+        if feedback:
+            feedback.setProgress(100 * (index + 1) / total)
+    complete = not (feedback and feedback.isCanceled())
+    for writer in writers:
+        writer.close(complete)
+    return list(paths)
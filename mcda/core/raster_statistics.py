@@ -0,0 +1,328 @@
+"""
+Streaming raster statistics.
+
+Statistics are computed in a single pass over block windows and memoized by
+raster path, modification time, size and band, so the same raster is never
+scanned twice just to get its statistics.
+"""
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from osgeo import gdal
+
+from .raster_engine import (
+    BLOCK_SIZE,
+    FileRaster,
+    RasterGrid,
+    RasterSource,
+    Window,
+    compute_blocks,
+)
+
+# Maximum number of memoized statistics
+CACHE_SIZE = 256
+
+
+class RasterStatistics:
+    """
+    Statistics of valid (not nodata) pixels of a raster band. The optional
+    histogram has equal width bins over histogram_range.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        min: float,
+        max: float,
+        sum: float,
+        sum_of_squares: float,
+        histogram: Optional[np.ndarray] = None,
+        histogram_range: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        self.count = count
+        self.min = min
+        self.max = max
+        self.sum = sum
+        self.sum_of_squares = sum_of_squares
+        self.histogram = histogram
+        self.histogram_range = histogram_range
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else float("nan")
+
+    @property
+    def std_dev(self) -> float:
+        if not self.count:
+            return float("nan")
+        variance = self.sum_of_squares / self.count - self.mean**2
+        return float(np.sqrt(max(variance, 0)))
+
+    def as_dict(self) -> Dict[str, float]:
+        """
+        Statistics with the same keys as native:rasterlayerstatistics output.
+        """
+        return {
+            "MIN": self.min,
+            "MAX": self.max,
+            "RANGE": self.max - self.min,
+            "SUM": self.sum,
+            "MEAN": self.mean,
+            "STD_DEV": self.std_dev,
+            "SUM_OF_SQUARES": self.sum_of_squares,
+        }
+
+
+class StatisticsAccumulator:
+    """
+    Accumulates statistics block by block. Can be fed with the blocks of any
+    block pass, so statistics of a result are available as soon as it has
+    been written.
+    """
+
+    def __init__(
+        self,
+        histogram_bins: Optional[int] = None,
+        histogram_range: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        if histogram_bins and not histogram_range:
+            raise ValueError("Histogram in a single pass needs a value range")
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+        self.histogram_range = histogram_range
+        self.histogram = (
+            np.zeros(histogram_bins, dtype=np.int64) if histogram_bins else None
+        )
+
+    def update(self, block: np.ndarray) -> None:
+        values = block[~np.isnan(block)]
+        if not values.size:
+            return
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.sum += float(values.sum())
+        self.sum_of_squares += float(np.square(values).sum())
+        if self.histogram is not None:
+            self.histogram += np.histogram(
+                values, bins=self.histogram.size, range=self.histogram_range
+            )[0]
+
+    def result(self) -> RasterStatistics:
+        return RasterStatistics(
+            self.count,
+            self.min,
+            self.max,
+            self.sum,
+            self.sum_of_squares,
+            self.histogram,
+            self.histogram_range,
+        )
+
+
+class ZonalAccumulator:
+    """
+    Accumulates statistics per zone block by block, e.g. per district while
+    a result is written. Zones are given as a raster of zone ids 1 to
+    zone_count on the grid of the result, with nodata outside the zones.
+    Values are also counted per class, rounded to the classes 1 to
+    class_count.
+    """
+
+    def __init__(
+        self, zones: RasterSource, zone_count: int, class_count: int = 4
+    ) -> None:
+        self.zones = zones
+        self.class_count = class_count
+        # Index zero collects nothing, so zone ids can be used as indices
+        size = zone_count + 1
+        self.count = np.zeros(size, dtype=np.int64)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+        self.sum = np.zeros(size)
+        self.sum_of_squares = np.zeros(size)
+        self.classes = np.zeros((size, class_count), dtype=np.int64)
+
+    def update(self, window: Window, block: np.ndarray) -> None:
+        zones = self.zones.read(window)
+        valid = ~np.isnan(zones) & ~np.isnan(block)
+        if not valid.any():
+            return
+        ids = zones[valid].astype(np.int64)
+        values = block[valid]
+        size = self.count.size
+        self.count += np.bincount(ids, minlength=size)
+        self.sum += np.bincount(ids, weights=values, minlength=size)
+        self.sum_of_squares += np.bincount(
+            ids, weights=np.square(values), minlength=size
+        )
+        np.minimum.at(self.min, ids, values)
+        np.maximum.at(self.max, ids, values)
+        classes = np.clip(np.rint(values), 1, self.class_count).astype(np.int64) - 1
+        self.classes += np.bincount(
+            ids * self.class_count + classes, minlength=size * self.class_count
+        ).reshape(size, self.class_count)
+
+    def result(self) -> List[RasterStatistics]:
+        """
+        Statistics of each zone in the order of the zone ids, with the class
+        counts as the histogram.
+        """
+        return [
+            RasterStatistics(
+                int(self.count[zone]),
+                float(self.min[zone]) if self.count[zone] else float("nan"),
+                float(self.max[zone]) if self.count[zone] else float("nan"),
+                float(self.sum[zone]),
+                float(self.sum_of_squares[zone]),
+                self.classes[zone],
+                (0.5, self.class_count + 0.5),
+            )
+            for zone in range(1, self.count.size)
+        ]
+
+
+_cache: "OrderedDict[Tuple[str, int, int, int], RasterStatistics]" = OrderedDict()
+# Statistics may be requested from concurrent model branches
+_cache_lock = threading.Lock()
+
+
+def _cache_key(path: str, band: int) -> Optional[Tuple[str, int, int, int]]:
+    """
+    Key of a version of a raster file. Rasters are often rewritten at the same
+    path within a second, so the key has the size and the modification time
+    in nanoseconds where the file system has it.
+    """
+    try:
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size, band)
+    except OSError:
+        # GDAL virtual file systems, e.g. /vsimem
+        pass
+    vsi_stat = gdal.VSIStatL(path)
+    if vsi_stat is None:
+        return None
+    return (path, vsi_stat.mtime * 10**9, vsi_stat.size, band)
+
+
+def cache_statistics(path: str, statistics: RasterStatistics, band: int = 1) -> None:
+    """
+    Store statistics computed elsewhere, e.g. while writing the raster.
+    """
+    key = _cache_key(path, band)
+    if key is None:
+        return
+    with _cache_lock:
+        _cache[key] = statistics
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def compute_statistics(
+    source: RasterSource,
+    histogram_bins: Optional[int] = None,
+    histogram_range: Optional[Sequence[float]] = None,
+    block_size: int = BLOCK_SIZE,
+) -> RasterStatistics:
+    """
+    Compute statistics of any raster source in a single block pass.
+    """
+    accumulator = StatisticsAccumulator(
+        histogram_bins, tuple(histogram_range) if histogram_range else None
+    )
+    for window in source.grid.windows(block_size):
+        accumulator.update(source.read(window))
+    return accumulator.result()
+
+
+def get_statistics(
+    source: RasterSource,
+    histogram_bins: Optional[int] = None,
+    histogram_range: Optional[Sequence[float]] = None,
+) -> RasterStatistics:
+    """
+    Get statistics of a raster source. Statistics of raster files are
+    memoized, so each file version is only scanned once.
+    """
+    key = None
+    if isinstance(source, FileRaster):
+        key = _cache_key(source.path, source.band_number)
+        with _cache_lock:
+            cached = _cache.get(key) if key else None
+            if cached and (
+                not histogram_bins
+                or (
+                    cached.histogram is not None
+                    and cached.histogram.size == histogram_bins
+                    and cached.histogram_range == tuple(histogram_range or ())
+                )
+            ):
+                _cache.move_to_end(key)
+                return cached
+    statistics = compute_statistics(source, histogram_bins, histogram_range)
+    if key:
+        cache_statistics(source.path, statistics, source.band_number)
+    return statistics
+
+
+def _cached_statistics(source: RasterSource) -> Optional[RasterStatistics]:
+    if not isinstance(source, FileRaster):
+        return None
+    key = _cache_key(source.path, source.band_number)
+    with _cache_lock:
+        cached = _cache.get(key) if key else None
+        if cached:
+            _cache.move_to_end(key)
+        return cached
+
+
+def _read_stack(sources: Sequence[RasterSource], window: Window) -> List[np.ndarray]:
+    return [source.read(window) for source in sources]
+
+
+def get_stack_statistics(
+    sources: Sequence[RasterSource], block_size: int = BLOCK_SIZE, workers: int = 1
+) -> List[RasterStatistics]:
+    """
+    Get statistics of several rasters, e.g. the layers of a stack to
+    normalize. Memoized statistics are reused, and the rest of the rasters
+    on the same grid are read in one shared block pass instead of a pass
+    each.
+    """
+    results: List[Optional[RasterStatistics]] = [
+        _cached_statistics(source) for source in sources
+    ]
+    groups: List[Tuple[RasterGrid, List[int]]] = []
+    for index, source in enumerate(sources):
+        if results[index] is not None:
+            continue
+        for grid, indices in groups:
+            if grid.matches(source.grid):
+                indices.append(index)
+                break
+        else:
+            groups.append((source.grid, [index]))
+    for grid, indices in groups:
+        accumulators = [StatisticsAccumulator() for _ in indices]
+        group = [sources[index] for index in indices]
+        blocks = compute_blocks(
+            partial(_read_stack, group), grid.windows(block_size), workers
+        )
+        for _, stack in blocks:
+            for accumulator, block in zip(accumulators, stack):
+                accumulator.update(block)
+        for index, accumulator in zip(indices, accumulators):
+            results[index] = accumulator.result()
+            source = sources[index]
+            if isinstance(source, FileRaster):
+                cache_statistics(source.path, accumulator.result(), source.band_number)
+    # Every raster has statistics by now
+    return [statistics for statistics in results if statistics is not None]
@@ -0,0 +1,212 @@
+"""
+Content-addressed on-disk cache for intermediate results.
+
+Results of processing algorithms are stored under a key computed from the
+algorithm id, its parameters and the identity of the input layers (source,
+modification time, size, feature count and extent). Rerunning a model with
+e.g. only a changed weight will then find all the unchanged intermediate
+results in the cache. The least recently used results are evicted when the
+cache grows over its size budget.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import Counter
+from typing import Any, Optional, Set
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsMapLayer,
+    QgsProcessingContext,
+    QgsProcessingUtils,
+    QgsRasterLayer,
+    QgsRectangle,
+    QgsVectorLayer,
+)
+
+# Bump to invalidate results cached by older versions of the models
+CACHE_VERSION = 1
+
+# Keys used by the runs of this process, counted by run. Concurrent runs, e.g.
+# the areas of a batch, must not evict results the other runs are using.
+_used_keys: "Counter[str]" = Counter()
+_used_lock = threading.Lock()
+
+
+def _release_keys(keys: Set[str]) -> None:
+    with _used_lock:
+        for key in keys:
+            _used_keys[key] -= 1
+            if _used_keys[key] <= 0:
+                del _used_keys[key]
+
+
+class UncacheableInput(Exception):
+    """Raised when the identity of an input cannot be determined."""
+
+
+def _file_identity(path: str) -> Optional[list]:
+    # OGR sources may have options after the path, e.g. "file.gpkg|layername=a"
+    file_path = path.split("|")[0]
+    if not os.path.isfile(file_path):
+        return None
+    stat = os.stat(file_path)
+    return [path, stat.st_mtime_ns, stat.st_size]
+
+
+def _layer_identity(layer: QgsMapLayer) -> list:
+    if layer.providerType() == "memory" or (
+        isinstance(layer, QgsVectorLayer) and layer.isModified()
+    ):
+        # Contents of memory layers and unsaved edits are not identified by
+        # the source
+        raise UncacheableInput(layer.name())
+    identity = _file_identity(layer.source()) or [layer.source()]
+    identity.append(layer.crs().authid() or layer.crs().toWkt())
+    if isinstance(layer, QgsVectorLayer):
+        identity.append(layer.featureCount())
+        identity.append(layer.subsetString())
+    if isinstance(layer, (QgsVectorLayer, QgsRasterLayer)):
+        identity.append(layer.extent().toString())
+    return identity
+
+
+def input_identity(value: Any, context: QgsProcessingContext) -> Any:
+    """
+    JSON serializable identity of a processing parameter value. Layers are
+    identified by their source and its modification time instead of their
+    id, which changes from session to session.
+    """
+    if isinstance(value, QgsMapLayer):
+        return _layer_identity(value)
+    if isinstance(value, QgsCoordinateReferenceSystem):
+        return value.authid() or value.toWkt()
+    if isinstance(value, QgsRectangle):
+        return value.toString()
+    if isinstance(value, (list, tuple)):
+        return [input_identity(item, context) for item in value]
+    if isinstance(value, dict):
+        return {key: input_identity(item, context) for key, item in value.items()}
+    if isinstance(value, str):
+        file_identity = _file_identity(value)
+        if file_identity:
+            return file_identity
+        # Results of earlier steps may be referred to by layer id
+        layer = QgsProcessingUtils.mapLayerFromString(value, context, False)
+        if layer is not None:
+            return _layer_identity(layer)
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return repr(value)
+
+
+def identity_key(value: Any, context: QgsProcessingContext) -> Optional[str]:
+    """
+    Hash of the identity of value, or None if it contains uncacheable inputs.
+    """
+    try:
+        identity = input_identity(value, context)
+    except UncacheableInput:
+        return None
+    content = json.dumps([CACHE_VERSION, identity], sort_keys=True, default=repr)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache directory with a size budget in bytes. Results used by any run of
+    the process that is still going on are never evicted. A run holds on to
+    its results until its cache is garbage collected.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.used: Set[str] = set()
+        weakref.finalize(self, _release_keys, self.used)
+        os.makedirs(directory, exist_ok=True)
+
+    def use(self, key: str) -> None:
+        """
+        Protect the result from eviction while this run is going on.
+        """
+        with _used_lock:
+            if key not in self.used:
+                self.used.add(key)
+                _used_keys[key] += 1
+
+    def key(
+        self, algorithm: str, parameters: dict, context: QgsProcessingContext
+    ) -> Optional[str]:
+        """
+        Key of the algorithm result, or None if the result cannot be cached.
+        """
+        return identity_key([algorithm, parameters], context)
+
+    def path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{key}{extension}")
+
+    def partial_path(self, key: str, extension: str) -> str:
+        """
+        Path to write the result to. The result is only added to the cache
+        once it is complete. Runs in other threads or processes may compute
+        the same result at the same time, so each writes to its own path.
+        """
+        self.use(key)
+        writer = f"{os.getpid()}_{threading.get_ident()}"
+        return os.path.join(self.directory, f"{key}.partial{writer}{extension}")
+
+    def get(self, key: str, extension: str) -> Optional[str]:
+        path = self.path(key, extension)
+        if not os.path.isfile(path):
+            return None
+        # Modification time is used as the last use time for eviction
+        os.utime(path)
+        self.use(key)
+        return path
+
+    def add(self, key: str, extension: str) -> str:
+        """
+        Move a complete result from its partial path to the cache.
+        """
+        path = self.path(key, extension)
+        os.replace(self.partial_path(key, extension), path)
+        self.use(key)
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        """
+        Delete least recently used results until the cache fits its budget.
+        """
+        with _used_lock:
+            used = set(_used_keys)
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.directory, "*")):
+            if ".partial" in os.path.basename(path):
+                # Still being written by some run
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted by a concurrent run
+                continue
+            total += stat.st_size
+            entries.append((stat.st_mtime, stat.st_size, path))
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            key = os.path.basename(path).split(".")[0]
+            if key in used:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # The file may be open in another process
+                pass
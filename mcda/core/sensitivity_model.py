@@ -0,0 +1,320 @@
+"""
+Name : Weight sensitivity
+Group : Multi-criteria decision analysis
+"""
+
+from typing import Any, Dict, List, Sequence, Union
+
+import numpy as np
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingContext,
+    QgsProcessingException,
+    QgsProcessingFeedback,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingParameterString,
+    QgsProcessingParameterVectorLayer,
+)
+
+from .combine_rasters import CombineRasters
+from .raster_engine import write_rasters
+from .weight_sampling import (
+    SAMPLING_METHODS,
+    STATISTICS,
+    SensitivityStatistics,
+    dirichlet_weights,
+    grid_weights,
+    one_at_a_time_weights,
+)
+
+# Output parameters of the sensitivity statistics
+OUTPUTS = {
+    "MEAN": "MeanOutput",
+    "STD_DEV": "StdDevOutput",
+    "STABILITY": "StabilityOutput",
+}
+
+
+class WeightSensitivity(CombineRasters):
+    """
+    This class implements an algorithm for testing how robust a weighted
+    sum of raster layers is to the chosen weights.
+    """
+
+    def initAlgorithm(self, config=None):  # noqa: N802
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                "Layers", "Layers", layerType=QgsProcessing.TypeRaster
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                "Weights", "Weights, separated by commas", defaultValue=None
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                "NormalizeLayers", "Normalize layers to 0...1", defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                "SamplingMethod",
+                "Weight sampling method",
+                options=SAMPLING_METHODS,
+                defaultValue=2,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "SampleCount",
+                "Maximum number of weight vectors",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=200,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "Perturbation",
+                "Relative change of each weight (one at a time)",
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0.5,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "Concentration",
+                "Concentration around the weights (Dirichlet)",
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=50,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "Seed",
+                "Random seed",
+                type=QgsProcessingParameterNumber.Integer,
+                optional=True,
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "ClassCount",
+                "Number of suitability classes for stability",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=2,
+                defaultValue=4,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                "MemoryBudget",
+                "Memory for weighted sums per block (MB)",
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=256,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterCrs(
+                "ProjectedReferenceSystem",
+                "Projected Reference System",
+                defaultValue="EPSG:4326",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                "Studyarea",
+                "Study area",
+                types=[QgsProcessing.TypeVectorPolygon],
+                optional=True,
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                "MeanOutput", "Mean", createByDefault=True, defaultValue=None
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                "StdDevOutput",
+                "Standard deviation",
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                "StabilityOutput",
+                "Class stability",
+                createByDefault=True,
+                defaultValue=None,
+            )
+        )
+
+    def processAlgorithm(  # noqa: N802
+        self,
+        parameters: Dict[str, Any],
+        context: QgsProcessingContext,
+        feedback: QgsProcessingFeedback,
+    ) -> Dict[str, Any]:
+        # Toolbox values are resolved to the layers and CRS the panels give
+        parameters = {
+            **parameters,
+            "Layers": self.parameterAsLayerList(parameters, "Layers", context),
+            "ProjectedReferenceSystem": self.parameterAsCrs(
+                parameters, "ProjectedReferenceSystem", context
+            ).authid(),
+            "Studyarea": self.parameterAsVectorLayer(parameters, "Studyarea", context),
+        }
+        self.startAlgorithm(
+            parameters, context, feedback, steps=2 * len(parameters["Layers"]) + 1
+        )
+        weights = self._parse_weights(parameters["Weights"])
+        if len(weights) != len(parameters["Layers"]):
+            raise QgsProcessingException("Each layer needs a weight")
+
+        layers = self._prepare_layers(parameters)
+        if layers is None:
+            return {}
+        sources = [self._raster_source(layer) for layer in layers]
+
+        self.feedback.setCurrentStep(2 * len(layers))
+        statistics = SensitivityStatistics(
+            sources,
+            weights,
+            self._weight_vectors(weights),
+            self._class_range(layers),
+            parameters.get("ClassCount") or 4,
+            (parameters.get("MemoryBudget") or 256) * 1024 * 1024,
+        )
+        # Outputs may be given as paths or as output layer definitions
+        outputs = [
+            self.parameterAsOutputLayer(parameters, OUTPUTS[name], context)
+            for name in STATISTICS
+        ]
+        paths = [
+            output or self._temporary_path(f"{name}.tif")
+            for name, output in zip(STATISTICS, outputs)
+        ]
+        # Results are masked to the study area in the same pass
+        write_rasters(
+            [
+                self._mask_to_study_area(statistics.statistic(name))
+                for name in STATISTICS
+            ],
+            paths,
+            feedback=self.feedback,
+            workers=self.workers,
+            profiles=[
+                self.output_profile if output else "fast-temp" for output in outputs
+            ],
+        )
+        if self.feedback.isCanceled():
+            return {}
+
+        layer_names = parameters.get("LayerNames", {})
+        return {
+            layer_names.get(OUTPUTS[name], OUTPUTS[name]): path
+            for name, path in zip(STATISTICS, paths)
+        }
+
+    def _parse_weights(self, weights: Union[str, Sequence[float]]) -> List[float]:
+        """
+        Weights may be given as a list or as a comma separated string.
+        """
+        if isinstance(weights, str):
+            return [float(weight) for weight in weights.split(",") if weight.strip()]
+        return [float(weight) for weight in weights]
+
+    def _weight_vectors(self, weights: List[float]) -> np.ndarray:
+        """
+        Sample weight vectors with the method given in the parameters.
+        """
+        count = self.parameters.get("SampleCount") or 200
+        method = SAMPLING_METHODS[self.parameters.get("SamplingMethod", 2)]
+        if method == "Grid":
+            return grid_weights(len(weights), count)
+        if method == "One at a time":
+            # Split the vectors evenly between the layers
+            return one_at_a_time_weights(
+                weights,
+                self.parameters.get("Perturbation", 0.5),
+                max(count // len(weights), 2),
+            )
+        return dirichlet_weights(
+            weights,
+            count,
+            self.parameters.get("Concentration") or 50,
+            self.parameters.get("Seed"),
+        )
+
+    def _class_range(self, layers: List[Any]) -> List[float]:
+        """
+        Range of the possible weighted sums, i.e. the range of all the layers.
+        """
+        if self.parameters["NormalizeLayers"]:
+            return [0.0, 1.0]
+        statistics = self._get_stack_statistics(layers)
+        return [
+            min(layer_statistics["MIN"] for layer_statistics in statistics),
+            max(layer_statistics["MAX"] for layer_statistics in statistics),
+        ]
+
+    def name(self):
+        return "Weight sensitivity"
+
+    def displayName(self):  # noqa: N802
+        return "Weight sensitivity"
+
+    def group(self):
+        return "Multi-criteria decision analysis"
+
+    def groupId(self):  # noqa: N802
+        return "Multi-criteria decision analysis"
+
+    @classmethod
+    def shortHelpString(cls):  # noqa: N802
+        return """<html><body><h2>Algorithm description</h2>
+<p>This algorithm tests how sensitive a weighted sum of raster layers,
+e.g. the MCDA suitability index, is to the chosen weights. The weighted
+sum is computed with a large number of weight vectors around the given
+weights, reading the input layers only once.</p>
+<h2>Input parameters</h2>
+<h3>Layers</h3>
+<p>Raster layers to sum, e.g. the economic, environmental and
+infrastructure suitability rasters.</p>
+<h3>Weights</h3>
+<p>The chosen weights of the layers, separated by commas.</p>
+<h3>Weight sampling method</h3>
+<p>Grid covers all weight combinations evenly. One at a time changes
+the weight of a single layer at a time by up to the relative change.
+Dirichlet samples random weights around the chosen weights; higher
+concentration gives weights closer to the chosen weights.</p>
+<h3>Memory for weighted sums per block</h3>
+<p>Larger values evaluate more weight vectors at once.</p>
+<h2>Outputs</h2>
+<h3>Mean</h3>
+<p>Mean of the weighted sums.</p>
+<h3>Standard deviation</h3>
+<p>Standard deviation of the weighted sums.</p>
+<h3>Class stability</h3>
+<p>Share of the weight vectors (0...1) for which the location stays
+in the same suitability class as with the chosen weights.</p>
+<br><p>Algorithm author: Development unit at IIEP-UNESCO
+(development@iiep.unesco.org)</p><p>Algorithm version: 1.0</p>
+</body></html>
+"""
+
+    def createInstance(self):  # noqa: N802
+        return WeightSensitivity()
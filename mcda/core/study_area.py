@@ -0,0 +1,183 @@
+"""
+Study area of a run, prepared once.
+
+Fixing, reprojecting and buffering a detailed study area polygon is
+expensive, so it is done once in startAlgorithm. The prepared study area is
+then reused by all the helpers of the model, and handed on to the stages of
+the pipeline.
+"""
+import hashlib
+import threading
+import uuid
+import weakref
+from typing import Dict, List, Optional, Union
+
+from osgeo import gdal
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsFields,
+    QgsGeometry,
+    QgsGeometryEngine,
+    QgsMemoryProviderUtils,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
+
+from .raster_engine import CLASS_DATA_TYPE, GDAL_DATA_TYPES, FileRaster, RasterGrid
+
+# Segments per quarter circle of study area buffers
+BUFFER_SEGMENTS = 5
+
+
+class StudyArea:
+    """
+    Study area in the projected reference system. It keeps:
+    - the fixed layer, for processing algorithms
+    - the projected layer and its dissolved geometry, simplified by the
+      tolerance if one is given
+    - the analysis grid covering the study area
+    - the study area written to a file, for GDAL
+    Buffers of the geometry, prepared geometry engines and the rasterized
+    mask are made on demand and reused.
+    """
+
+    def __init__(
+        self,
+        layer: Union[QgsVectorLayer, str],
+        projected: QgsVectorLayer,
+        crs: str,
+        grid: RasterGrid,
+        tolerance: float = 0,
+    ) -> None:
+        self.layer = layer
+        self.projected = projected
+        self.crs = crs
+        self.grid = grid
+        self.tolerance = tolerance
+        geometry = QgsGeometry.unaryUnion(
+            [feature.geometry() for feature in projected.getFeatures()]
+        )
+        self.geometry = geometry.simplify(tolerance) if tolerance else geometry
+        self.extent = projected.extent()
+        # Set by the model once the geometry is written to a file
+        self.cutline: Optional[str] = None
+        self._lock = threading.Lock()
+        self._buffers: Dict[float, QgsVectorLayer] = {}
+        self._mask: Optional[FileRaster] = None
+        # GEOS geometries are not shared between threads
+        self._engines = threading.local()
+
+    def identity(self) -> List[Union[str, float]]:
+        """
+        Hash of the geometry with its CRS and simplification tolerance, to tell
+        apart results clipped or masked to different study areas.
+        """
+        geometry = hashlib.sha256(bytes(self.geometry.asWkb())).hexdigest()
+        return [geometry, self.crs, self.tolerance]
+
+    def buffered(self, distance: float) -> QgsVectorLayer:
+        """
+        Memory layer of the study area buffered by the distance.
+        """
+        with self._lock:
+            if distance not in self._buffers:
+                layer = QgsMemoryProviderUtils.createMemoryLayer(
+                    "buffered",
+                    QgsFields(),
+                    QgsWkbTypes.MultiPolygon,
+                    QgsCoordinateReferenceSystem(self.crs),
+                )
+                feature = QgsFeature()
+                feature.setGeometry(self._buffer(distance))
+                layer.dataProvider().addFeatures([feature])
+                layer.updateExtents()
+                self._buffers[distance] = layer
+            return self._buffers[distance]
+
+    def _buffer(self, distance: float) -> QgsGeometry:
+        if not distance:
+            return self.geometry
+        return self.geometry.buffer(distance, BUFFER_SEGMENTS)
+
+    def engine(self, distance: float = 0) -> QgsGeometryEngine:
+        """
+        Prepared geometry engine of the study area buffered by the distance,
+        for fast repeated intersection tests in the calling thread.
+        """
+        engines = getattr(self._engines, "engines", None)
+        if engines is None:
+            engines = self._engines.engines = {}
+        if distance not in engines:
+            # The engine refers to the geometry, so both are kept
+            geometry = self._buffer(distance)
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            engines[distance] = (geometry, engine)
+        return engines[distance][1]
+
+    def points_within(
+        self,
+        layer: QgsVectorLayer,
+        distance: float,
+        transform_context: QgsCoordinateTransformContext,
+    ) -> QgsVectorLayer:
+        """
+        Memory layer of the points of the layer within the distance of the
+        study area. Clipping points only drops points, so the features are
+        tested with the prepared geometry instead of running a clip.
+        """
+        crs = QgsCoordinateReferenceSystem(self.crs)
+        to_area = QgsCoordinateTransform(layer.crs(), crs, transform_context)
+        bounds = self._buffer(distance).boundingBox()
+        request = QgsFeatureRequest().setFilterRect(
+            to_area.transformBoundingBox(
+                bounds, QgsCoordinateTransform.ReverseTransform
+            )
+        )
+        engine = self.engine(distance)
+        features = []
+        for feature in layer.getFeatures(request):
+            geometry = QgsGeometry(feature.geometry())
+            if geometry.isEmpty():
+                continue
+            geometry.transform(to_area)
+            if engine.intersects(geometry.constGet()):
+                features.append(feature)
+        clipped = QgsMemoryProviderUtils.createMemoryLayer(
+            layer.name(), layer.fields(), layer.wkbType(), layer.crs()
+        )
+        clipped.dataProvider().addFeatures(features)
+        clipped.updateExtents()
+        return clipped
+
+    def mask(self) -> FileRaster:
+        """
+        Study area rasterized on the analysis grid in memory: one inside the
+        study area, nodata outside. Pixels are inside if their center is.
+        """
+        with self._lock:
+            if self._mask is None:
+                if self.cutline is None:
+                    raise ValueError("Study area has not been written to a file")
+                path = f"/vsimem/mcda/{uuid.uuid4().hex}_mask.tif"
+                options = gdal.RasterizeOptions(
+                    format="GTiff",
+                    outputType=GDAL_DATA_TYPES[CLASS_DATA_TYPE],
+                    outputBounds=self.grid.bounds,
+                    width=self.grid.xsize,
+                    height=self.grid.ysize,
+                    outputSRS=self.grid.crs_wkt,
+                    burnValues=[1],
+                    initValues=[0],
+                    noData=0,
+                    creationOptions=["TILED=YES"],
+                )
+                if gdal.Rasterize(path, self.cutline, options=options) is None:
+                    raise ValueError("Could not rasterize the study area")
+                self._mask = FileRaster(path)
+                weakref.finalize(self, gdal.Unlink, path)
+            return self._mask
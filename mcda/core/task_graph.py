@@ -0,0 +1,90 @@
+"""
+Dependency graph of model steps.
+
+Models consist of branches that do not depend on each other, e.g. the road
+and waterway distances of the economic model. Expressed as a graph, each
+step is started as soon as the steps it depends on are done, so independent
+branches run concurrently on a thread pool. Child algorithms and the block
+engine spend their time in GDAL and NumPy, which release the GIL.
+"""
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Wraps a task function before it is run, e.g. to give it its own feedback
+TaskWrapper = Callable[[str, Callable[..., Any]], Callable[..., Any]]
+
+
+class TaskGraph:
+    """
+    Named tasks with dependencies. Each task is called with the results of
+    its dependencies, in the order the dependencies were given.
+    """
+
+    def __init__(self) -> None:
+        self.tasks: Dict[str, Tuple[Callable[..., Any], Tuple[str, ...]]] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        dependencies: Sequence[str] = (),
+    ) -> None:
+        if name in self.tasks:
+            raise ValueError(f"Task {name} already exists")
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise ValueError(f"Unknown dependency {dependency} of task {name}")
+        self.tasks[name] = (func, tuple(dependencies))
+
+    def width(self) -> int:
+        """
+        Number of tasks that may run at the same time, estimated as the
+        largest number of tasks at the same depth of the graph.
+        """
+        depths: Dict[str, int] = {}
+        # Dependencies are always added before the tasks that depend on them
+        for name, (_, dependencies) in self.tasks.items():
+            depths[name] = 1 + max((depths[d] for d in dependencies), default=0)
+        counts = Counter(depths.values())
+        return max(counts.values(), default=1)
+
+    def run(
+        self,
+        workers: int = 1,
+        wrap: Optional[TaskWrapper] = None,
+        on_done: Optional[Callable[[str, Any], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run all the tasks and return their results by name. on_done is called
+        in the calling thread as each task finishes. If a task fails, no more
+        tasks are started and the error is raised once running tasks are done.
+        """
+        results: Dict[str, Any] = {}
+        waiting: List[str] = list(self.tasks)
+        running: Dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            while waiting or running:
+                for name in [
+                    name
+                    for name in waiting
+                    if all(dependency in results for dependency in self.tasks[name][1])
+                ]:
+                    func, dependencies = self.tasks[name]
+                    if wrap:
+                        func = wrap(name, func)
+                    arguments = [results[dependency] for dependency in dependencies]
+                    running[executor.submit(func, *arguments)] = name
+                    waiting.remove(name)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error:
+                        # Let the running tasks finish, but start no new ones
+                        wait(running)
+                        raise error
+                    results[name] = future.result()
+                    if on_done:
+                        on_done(name, results[name])
+        return results
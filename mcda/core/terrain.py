@@ -0,0 +1,54 @@
+"""
+Terrain analysis with the block engine.
+
+Slope needs the neighbours of each pixel, so blocks are read with a halo of
+one pixel. Blocks are then independent and can be computed in parallel like
+any pixel-wise step.
+"""
+import numpy as np
+
+from .raster_engine import RasterGrid, RasterSource, Window, padded_window
+
+
+class SlopeRaster(RasterSource):
+    """
+    Slope of an elevation raster in degrees, with Horn's method like
+    gdaldem slope with -compute_edges. Neighbours that are nodata or outside
+    the raster are replaced by the center pixel. The elevation raster has to
+    be in a projected CRS with the same units as the elevations.
+    """
+
+    def __init__(self, dem: RasterSource) -> None:
+        self.dem = dem
+        self.grid = dem.grid
+
+    def read(self, window: Window) -> np.ndarray:
+        padded, x, y = padded_window(self.grid, window, (1, 1))
+        tile = np.full((window.ysize + 2, window.xsize + 2), np.nan)
+        # Rows and columns outside the grid stay nodata
+        tile[
+            1 - y : 1 - y + padded.ysize, 1 - x : 1 - x + padded.xsize
+        ] = self.dem.read(padded)
+        center = tile[1:-1, 1:-1]
+
+        def neighbour(row: int, column: int) -> np.ndarray:
+            values = tile[
+                1 + row : 1 + row + window.ysize,
+                1 + column : 1 + column + window.xsize,
+            ]
+            return np.where(np.isnan(values), center, values)
+
+        a, b, c = neighbour(-1, -1), neighbour(-1, 0), neighbour(-1, 1)
+        d, f = neighbour(0, -1), neighbour(0, 1)
+        g, h, i = neighbour(1, -1), neighbour(1, 0), neighbour(1, 1)
+        dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * self.grid.pixel_width)
+        dy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * self.grid.pixel_height)
+        slope = np.degrees(np.arctan(np.sqrt(dx**2 + dy**2)))
+        # Nodata in the center pixel propagates to the slope
+        slope[np.isnan(center)] = np.nan
+        return slope
+
+    def resampled(self, grid: RasterGrid) -> "SlopeRaster":
+        if grid.matches(self.grid):
+            return self
+        return SlopeRaster(self.dem.resampled(grid))
@@ -0,0 +1,266 @@
+"""
+Distance classification directly from vector features.
+
+Sparse inputs, e.g. schools or a few main roads over a large country, do not
+need to be rasterized to compute distances. Feature geometries are stored as
+line segments and indexed with an R-tree. For each part of a block, only the
+segments within max_distance are queried and the distance from the pixel
+centers to them is computed with NumPy. Parts of blocks with no features
+nearby are classified without any distance computation.
+
+Indexes are kept for the layers distances were last computed to, so that
+runs of the same inputs, e.g. the study areas of a batch, index them once.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from qgis.core import (
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsRectangle,
+    QgsSpatialIndex,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
+
+from .raster_engine import (
+    CLASS_DATA_TYPE,
+    CLASS_NODATA,
+    RasterGrid,
+    RasterSource,
+    Window,
+    classify_distance,
+)
+
+# Blocks are divided to tiles of this size when querying features, so that
+# only the pixels near features need distance computations
+QUERY_TILE_SIZE = 64
+# Maximum number of pixel-segment pairs computed at once
+MAX_PAIRS = 4_000_000
+# Number of indexes kept for later runs
+SHARED_INDEXES = 8
+
+_shared_indexes: "OrderedDict[str, VectorDistanceIndex]" = OrderedDict()
+_shared_indexes_lock = threading.Lock()
+
+
+def _geometry_segments(
+    geometry: QgsGeometry,
+) -> List[Tuple[float, float, float, float]]:
+    """
+    Point and line geometries as line segments. Points are segments of zero
+    length.
+    """
+    if geometry.type() == QgsWkbTypes.PointGeometry:
+        points = (
+            geometry.asMultiPoint() if geometry.isMultipart() else [geometry.asPoint()]
+        )
+        return [(point.x(), point.y(), point.x(), point.y()) for point in points]
+    lines = (
+        geometry.asMultiPolyline()
+        if geometry.isMultipart()
+        else [geometry.asPolyline()]
+    )
+    segments = []
+    for line in lines:
+        if len(line) == 1:
+            segments.append((line[0].x(), line[0].y(), line[0].x(), line[0].y()))
+        for start, end in zip(line[:-1], line[1:]):
+            segments.append((start.x(), start.y(), end.x(), end.y()))
+    return segments
+
+
+class VectorDistanceIndex:
+    """
+    Line segments of point or line features, with a spatial index for
+    querying the segments near a given area. The layer has to be in the CRS
+    of the grid the distances are computed on.
+    """
+
+    def __init__(self, layer: QgsVectorLayer) -> None:
+        if layer.geometryType() not in (
+            QgsWkbTypes.PointGeometry,
+            QgsWkbTypes.LineGeometry,
+        ):
+            raise ValueError("Distances can only be computed to points or lines")
+        self.index = QgsSpatialIndex()
+        self.ranges: Dict[int, Tuple[int, int]] = {}
+        segments: List[Tuple[float, float, float, float]] = []
+        request = QgsFeatureRequest().setNoAttributes()
+        for feature in layer.getFeatures(request):
+            if not feature.hasGeometry():
+                continue
+            feature_segments = _geometry_segments(feature.geometry())
+            if not feature_segments:
+                continue
+            self.ranges[feature.id()] = (
+                len(segments),
+                len(segments) + len(feature_segments),
+            )
+            segments.extend(feature_segments)
+            self.index.addFeature(feature)
+        self.segments = np.array(segments, dtype=np.float64).reshape(-1, 4)
+
+    def query(self, xmin: float, ymin: float, xmax: float, ymax: float) -> np.ndarray:
+        """
+        Segments of the features that intersect the rectangle.
+        """
+        ids = [
+            id
+            for id in self.index.intersects(QgsRectangle(xmin, ymin, xmax, ymax))
+            if id in self.ranges
+        ]
+        if not ids:
+            return self.segments[:0]
+        segments = np.concatenate(
+            [self.segments[slice(*self.ranges[id])] for id in ids]
+        )
+        # Long features may have most of their segments far away
+        x1, y1, x2, y2 = segments.T
+        near = (
+            (np.minimum(x1, x2) <= xmax)
+            & (np.maximum(x1, x2) >= xmin)
+            & (np.minimum(y1, y2) <= ymax)
+            & (np.maximum(y1, y2) >= ymin)
+        )
+        return segments[near]
+
+
+def shared_index(
+    key: Optional[str], build: Callable[[], VectorDistanceIndex]
+) -> VectorDistanceIndex:
+    """
+    Index built by build, shared by all the runs of the process with the same
+    key. Indexes without a key, e.g. of memory layers, are built every time.
+    """
+    if key is None:
+        return build()
+    with _shared_indexes_lock:
+        if key in _shared_indexes:
+            _shared_indexes.move_to_end(key)
+            return _shared_indexes[key]
+    index = build()
+    with _shared_indexes_lock:
+        # Another run may have built the same index meanwhile
+        index = _shared_indexes.setdefault(key, index)
+        _shared_indexes.move_to_end(key)
+        while len(_shared_indexes) > SHARED_INDEXES:
+            _shared_indexes.popitem(last=False)
+    return index
+
+
+def segment_distance(
+    x: np.ndarray, y: np.ndarray, segments: np.ndarray, max_distance: float
+) -> np.ndarray:
+    """
+    Distance from points (x, y) to the nearest of the segments, capped at
+    max_distance.
+    """
+    result = np.full(x.shape, float(max_distance))
+    if not len(segments):
+        return result
+    x = x.reshape(-1, 1)
+    y = y.reshape(-1, 1)
+    squared = result.reshape(-1) ** 2
+    chunk = max(1, MAX_PAIRS // max(x.size, 1))
+    for start in range(0, len(segments), chunk):
+        x1, y1, x2, y2 = segments[start : start + chunk].T
+        dx = x2 - x1
+        dy = y2 - y1
+        length = dx**2 + dy**2
+        # Position of the nearest point on each segment, as a fraction of the
+        # segment length
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(
+                length > 0, ((x - x1) * dx + (y - y1) * dy) / length, 0.0
+            ).clip(0, 1)
+        nearest = ((x1 + t * dx - x) ** 2 + (y1 + t * dy - y) ** 2).min(axis=1)
+        np.minimum(squared, nearest, out=squared)
+    return np.sqrt(squared).reshape(result.shape)
+
+
+class VectorDistanceClassRaster(RasterSource):
+    """
+    Suitability classes by distance to vector features, on the given grid.
+    """
+
+    data_type = CLASS_DATA_TYPE
+    output_nodata = CLASS_NODATA
+
+    def __init__(
+        self,
+        index: VectorDistanceIndex,
+        grid: RasterGrid,
+        min_distance: float,
+        max_distance: float,
+        further_is_better: bool = False,
+        too_close_classification: int = 4,
+        too_far_classification: int = 4,
+    ) -> None:
+        self.index = index
+        self.grid = grid
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.further_is_better = further_is_better
+        self.too_close_classification = too_close_classification
+        self.too_far_classification = too_far_classification
+
+    def distances(self, window: Window) -> np.ndarray:
+        """
+        Distances from pixel centers to the nearest feature, capped at
+        max_distance.
+        """
+        x0, width, _, y0, _, height = self.grid.geotransform
+        result = np.full((window.ysize, window.xsize), float(self.max_distance))
+        for tile in RasterGrid(
+            self.grid.geotransform, window.xsize, window.ysize, ""
+        ).windows(QUERY_TILE_SIZE):
+            # Pixel center coordinates of the tile
+            columns = window.xoff + tile.xoff + np.arange(tile.xsize) + 0.5
+            rows = window.yoff + tile.yoff + np.arange(tile.ysize) + 0.5
+            x = x0 + columns * width
+            y = y0 + rows * height
+            segments = self.index.query(
+                x.min() - self.max_distance,
+                y.min() - self.max_distance,
+                x.max() + self.max_distance,
+                y.max() + self.max_distance,
+            )
+            if not len(segments):
+                continue
+            xx, yy = np.meshgrid(x, y)
+            result[
+                tile.yoff : tile.yoff + tile.ysize,
+                tile.xoff : tile.xoff + tile.xsize,
+            ] = segment_distance(xx, yy, segments, self.max_distance)
+        return result
+
+    def classes(self, window: Window) -> np.ndarray:
+        """
+        Suitability class codes of the window as UInt8.
+        """
+        return classify_distance(
+            self.distances(window),
+            self.min_distance,
+            self.max_distance,
+            self.further_is_better,
+            self.too_close_classification,
+            self.too_far_classification,
+        ).astype(np.uint8)
+
+    def read(self, window: Window) -> np.ndarray:
+        return self.classes(window).astype(np.float64)
+
+    def resampled(self, grid: RasterGrid) -> "VectorDistanceClassRaster":
+        # Distances can be computed on any grid
+        return VectorDistanceClassRaster(
+            self.index,
+            grid,
+            self.min_distance,
+            self.max_distance,
+            self.further_is_better,
+            self.too_close_classification,
+            self.too_far_classification,
+        )
@@ -0,0 +1,198 @@
+"""
+Weight vector sampling and per-pixel sensitivity statistics.
+
+The weighted sums of all sampled weight vectors are evaluated at once for
+each block as a matrix product of the weight vectors and the stacked input
+block, so the inputs are read only once however many weight vectors there
+are. Weight vectors are processed in batches that fit a memory budget.
+"""
+import threading
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .raster_engine import RasterGrid, RasterSource, Window, align_sources
+
+# Methods of sampling weight vectors, in the order of the algorithm parameter
+SAMPLING_METHODS = ["Grid", "One at a time", "Dirichlet"]
+
+# Sensitivity statistics computed for each pixel
+STATISTICS = ["MEAN", "STD_DEV", "STABILITY"]
+
+
+def _normalized(weights: Sequence[float]) -> np.ndarray:
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def grid_weights(layer_count: int, max_count: int) -> np.ndarray:
+    """
+    Weight vectors on a regular grid over all weight combinations summing to
+    one. The grid is as dense as possible with at most max_count vectors. If
+    there are more layers than vectors, evenly spaced vectors of the coarsest
+    grid are picked.
+    """
+    divisions = 1
+    while _composition_count(divisions + 1, layer_count) <= max_count:
+        divisions += 1
+    vectors = np.array(list(_compositions(divisions, layer_count)), dtype=np.float64)
+    if len(vectors) > max_count:
+        vectors = vectors[np.linspace(0, len(vectors) - 1, max_count).astype(int)]
+    return vectors / divisions
+
+
+def _compositions(divisions: int, layer_count: int) -> Iterator[Tuple[int, ...]]:
+    if layer_count == 1:
+        yield (divisions,)
+        return
+    for first in range(divisions + 1):
+        for rest in _compositions(divisions - first, layer_count - 1):
+            yield (first,) + rest
+
+
+def _composition_count(divisions: int, layer_count: int) -> int:
+    """
+    Number of ways to divide the divisions between the layers.
+    """
+    count = 1
+    for index in range(1, layer_count):
+        count = count * (divisions + index) // index
+    return count
+
+
+def one_at_a_time_weights(
+    base_weights: Sequence[float], perturbation: float, steps: int
+) -> np.ndarray:
+    """
+    Weight vectors that change the weight of one layer at a time by up to
+    the relative perturbation in both directions. The other weights are
+    scaled so that the weights still sum to one.
+    """
+    base = _normalized(base_weights)
+    vectors = []
+    for index, weight in enumerate(base):
+        for change in np.linspace(-perturbation, perturbation, steps):
+            changed = min(max(weight * (1 + change), 0.0), 1.0)
+            others = base.copy()
+            others[index] = 0
+            remaining = others.sum()
+            vector = (
+                others * (1 - changed) / remaining
+                if remaining > 0
+                else np.zeros_like(base)
+            )
+            vector[index] = changed if remaining > 0 else 1.0
+            vectors.append(vector)
+    return np.array(vectors)
+
+
+def dirichlet_weights(
+    base_weights: Sequence[float],
+    count: int,
+    concentration: float,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Random weight vectors from a Dirichlet distribution centered on the base
+    weights. Higher concentration gives vectors closer to the base weights.
+    """
+    alpha = np.maximum(_normalized(base_weights) * concentration, 1e-6)
+    return np.random.default_rng(seed).dirichlet(alpha, count)
+
+
+class SensitivityStatistics:
+    """
+    Per-pixel statistics of the weighted sums of the sources with each of
+    the weight vectors: mean, standard deviation and stability. Stability
+    is the share of weight vectors that keep the pixel in the same of
+    class_count equal-width classes over class_range as the base weights.
+
+    Statistics of the latest window are kept, so that all the statistics can
+    be written in a single pass with write_rasters, also with several
+    worker threads.
+    """
+
+    def __init__(
+        self,
+        sources: Sequence[RasterSource],
+        base_weights: Sequence[float],
+        weight_vectors: np.ndarray,
+        class_range: Sequence[float],
+        class_count: int = 4,
+        memory_budget: int = 256 * 1024 * 1024,
+    ) -> None:
+        if len(sources) != len(base_weights):
+            raise ValueError("Each raster needs a weight")
+        if not all(source.grid.matches(sources[0].grid) for source in sources):
+            sources = align_sources(sources)
+        self.sources = list(sources)
+        self.grid: RasterGrid = self.sources[0].grid
+        self.base_weights = _normalized(base_weights)
+        self.weight_vectors = np.asarray(weight_vectors, dtype=np.float64)
+        self.class_range = tuple(class_range)
+        self.class_count = class_count
+        self.memory_budget = memory_budget
+        # Statistics of the latest window of each thread
+        self._latest = threading.local()
+
+    def batch_size(self, pixels: int) -> int:
+        """
+        Number of weight vectors evaluated at once for a block of pixels. Each
+        vector needs the weighted sums and their classes in memory.
+        """
+        return max(1, self.memory_budget // (pixels * 8 * 3))
+
+    def _classes(self, values: np.ndarray) -> np.ndarray:
+        low, high = self.class_range
+        width = (high - low) / self.class_count if high > low else 1.0
+        return np.clip((values - low) // width, 0, self.class_count - 1)
+
+    def compute(self, window: Window) -> List[np.ndarray]:
+        """
+        Mean, standard deviation and stability of the window.
+        """
+        if getattr(self._latest, "window", None) == window:
+            return self._latest.statistics
+        stack = np.stack([source.read(window).ravel() for source in self.sources])
+        nodata = np.isnan(stack).any(axis=0)
+        stack[:, nodata] = 0
+        base_classes = self._classes(self.base_weights @ stack)
+        total = np.zeros(stack.shape[1])
+        total_of_squares = np.zeros(stack.shape[1])
+        stable = np.zeros(stack.shape[1])
+        batch = self.batch_size(stack.shape[1])
+        for start in range(0, len(self.weight_vectors), batch):
+            values = self.weight_vectors[start : start + batch] @ stack
+            total += values.sum(axis=0)
+            total_of_squares += np.square(values).sum(axis=0)
+            stable += (self._classes(values) == base_classes).sum(axis=0)
+        count = len(self.weight_vectors)
+        mean = total / count
+        std_dev = np.sqrt(np.maximum(total_of_squares / count - mean**2, 0))
+        statistics = [mean, std_dev, stable / count]
+        for values in statistics:
+            values[nodata] = np.nan
+        shape = (window.ysize, window.xsize)
+        self._latest.window = window
+        self._latest.statistics = [values.reshape(shape) for values in statistics]
+        return self._latest.statistics
+
+    def statistic(self, name: str) -> "SensitivityRaster":
+        """
+        Raster source of one of the STATISTICS.
+        """
+        return SensitivityRaster(self, STATISTICS.index(name))
+
+
+class SensitivityRaster(RasterSource):
+    """
+    One statistic of SensitivityStatistics as a raster source.
+    """
+
+    def __init__(self, statistics: SensitivityStatistics, index: int) -> None:
+        self.statistics = statistics
+        self.index = index
+        self.grid = statistics.grid
+
+    def read(self, window: Window) -> np.ndarray:
+        return self.statistics.compute(window)[self.index].copy()
@@ -1,11 +1,13 @@
 from typing import Callable, List, Optional
 
 # from qgis.gui import QgisInterface
+from qgis.core import QgsApplication
 from qgis.PyQt.QtCore import QCoreApplication, QTranslator
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction, QWidget
 from qgis.utils import iface
 
+from mcda.core.provider import McdaProvider
 from mcda.qgis_plugin_tools.tools.custom_logging import setup_logger, teardown_logger
 from mcda.qgis_plugin_tools.tools.i18n import setup_translation
 from mcda.qgis_plugin_tools.tools.resources import (
@@ -52,7 +54,10 @@ class Plugin:
         self.actions: List[QAction] = []
         self.menu = Plugin.name
 
-        self.dlg = MainDialog()
+        self.provider: Optional[McdaProvider] = None
+        # The dialog is only created with the GUI, qgis_process only loads the
+        # processing provider
+        self.dlg: Optional[MainDialog] = None
 
     def add_action(
         self,
@@ -120,8 +125,15 @@ class Plugin:
 
         return action
 
+    def initProcessing(self) -> None:  # noqa N802
+        """Register the processing provider of the plugin."""
+        self.provider = McdaProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self) -> None:  # noqa N802
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
+        self.initProcessing()
+        self.dlg = MainDialog()
         self.add_action(
             # "",
             resources_path("icons", "iiep_logo.svg"),
@@ -140,8 +152,11 @@ class Plugin:
         for action in self.actions:
             iface.removePluginMenu(Plugin.name, action)
             iface.removeToolBarIcon(action)
+        if self.provider:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
         teardown_logger(PLUGIN_NAME)
 
     def run(self) -> None:
         """Run method that performs all the real work"""
-        self.dlg.show()
+        if self.dlg:
+            self.dlg.show()
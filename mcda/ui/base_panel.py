@@ -1,6 +1,7 @@
 """Panel core base class."""
 import logging
-from typing import Any, Dict, Optional
+import tempfile
+from typing import Any, Dict, List, Optional
 
 from qgis.core import (
     QgsApplication,
@@ -8,13 +9,22 @@ from qgis.core import (
     QgsProcessingAlgorithm,
     QgsProcessingAlgRunnerTask,
     QgsProcessingContext,
+    QgsProcessingUtils,
     QgsProject,
     QgsRasterLayer,
     QgsVectorLayer,
 )
 from qgis.gui import QgsFileWidget
-from qgis.PyQt.QtWidgets import QDialog, QProgressBar, QPushButton
+from qgis.PyQt.QtCore import QTimer
+from qgis.PyQt.QtWidgets import (
+    QCheckBox,
+    QDialog,
+    QDoubleSpinBox,
+    QProgressBar,
+    QPushButton,
+)
 
+from ..core.intermediates import remove_temporary_directory
 from ..definitions.gui import Panels
 from ..qgis_plugin_tools.tools.exceptions import QgsPluginNotImplementedException
 from ..qgis_plugin_tools.tools.logger_processing import LoggerProcessingFeedBack
@@ -22,6 +32,9 @@ from ..qgis_plugin_tools.tools.resources import plugin_name
 
 LOGGER = logging.getLogger(plugin_name())
 
+# Delay after the last weight change before the results are refreshed
+REFRESH_DELAY_MS = 500
+
 
 class BasePanel:
     """
@@ -36,9 +49,24 @@ class BasePanel:
         self._algorithm: Optional[QgsProcessingAlgorithm] = None
         self.elem_map: Dict[int, bool] = {}
         self.params: Dict[str, Any] = {}
+        # Parameters of the result files of the algorithm, left empty in
+        # previews so that the results are only displayed
+        self.output_params: List[str] = []
         self.task: Optional[QgsProcessingAlgRunnerTask] = None
         self.context = QgsProcessingContext()
         self.feedback = LoggerProcessingFeedBack(use_logger=True)
+        # Layers displayed by the latest run, replaced when the results are
+        # refreshed after weight changes
+        self.result_layer_ids: List[str] = []
+        # Temporary directory of the running task, and of the task whose
+        # temporary results are displayed
+        self.temporary_directory: Optional[str] = None
+        self.result_directory: Optional[str] = None
+        self.refreshing = False
+        self.refresh_timer = QTimer()
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(REFRESH_DELAY_MS)
+        self.refresh_timer.timeout.connect(self.__refresh_results)
 
     @property
     def panel(self) -> Panels:
@@ -99,6 +127,13 @@ class BasePanel:
         else:
             raise NotImplementedError
 
+    @property
+    def __chk_bx_preview(self) -> QCheckBox:
+        if self._name:
+            return getattr(self.dlg, f"{self._name}_chk_bx_preview")
+        else:
+            raise NotImplementedError
+
     def setup_panel(self) -> None:
         """Setup the UI for the panel."""
         self.__set_run_button()
@@ -137,6 +172,28 @@ class BasePanel:
         total = sum(weights)
         return [value / total for value in weights]
 
+    def _refresh_on_change(self, *spinboxes: QDoubleSpinBox) -> None:
+        """
+        Refresh temporary results when the weights in the spinboxes change.
+        Only the weighted sum is recomputed, since the prepared layers are
+        reused by the algorithm.
+        """
+        for spinbox in spinboxes:
+            spinbox.valueChanged.connect(self.__schedule_refresh)
+
+    def __schedule_refresh(self) -> None:
+        if self.result_layer_ids and not self.params.get("OutputRaster"):
+            # restart the timer, so that we only run once the user stops typing
+            self.refresh_timer.start()
+
+    def __refresh_results(self) -> None:
+        if self.task:
+            # try again once the running task has finished
+            self.refresh_timer.start()
+            return
+        self.refreshing = True
+        self.__run_model()
+
     def _set_file_extension(self, widget: QgsFileWidget, extension: str) -> None:
         if not widget.filePath().endswith(extension):
             widget.setFilePath(widget.filePath() + extension)
@@ -151,9 +208,19 @@ class BasePanel:
         """
         LOGGER.info("got results")
         LOGGER.info(results)
+        refreshing = self.refreshing
+        self.refreshing = False
         if successful:
+            if refreshing:
+                # replace the results of the previous run
+                QgsProject.instance().removeMapLayers(self.result_layer_ids)
+                if self.result_directory:
+                    remove_temporary_directory(self.result_directory)
+            self.result_layer_ids = []
             for layer_name, layer in results.items():
                 if layer:
+                    if self.params.get("Preview"):
+                        layer_name = f"{layer_name} (preview)"
                     # the raster layer will always be a tiff file (temporary or
                     # permanent)
                     result = QgsRasterLayer(layer, layer_name)
@@ -170,8 +237,26 @@ class BasePanel:
                             # it on.
                             result = self.context.takeResultLayer(layer)
                     QgsProject.instance().addMapLayer(result, False)
+                    self.result_layer_ids.append(result.id())
                     root = QgsProject.instance().layerTreeRoot()
                     root.insertChildNode(0, QgsLayerTreeLayer(result))
+        self.__remove_temporary_files(successful, results)
+
+    def __remove_temporary_files(
+        self, successful: bool, results: Dict[str, Any]
+    ) -> None:
+        """
+        Remove the temporary files of the finished task, except the results
+        displayed as temporary layers. Those are removed when the layers are
+        replaced by refreshed results.
+        """
+        if not self.temporary_directory:
+            return
+        kept = [layer for layer in results.values() if layer] if successful else []
+        remove_temporary_directory(self.temporary_directory, kept)
+        if successful:
+            self.result_directory = self.temporary_directory
+        self.temporary_directory = None
 
     def __run_model(self) -> None:
         # prevent clicking run if task is running
@@ -180,10 +265,25 @@ class BasePanel:
             self.__set_cancel_button()
             # Get the algorithm parameters from subclass
             self.params = self._get_params()
+            if self.__chk_bx_preview.isChecked():
+                # Previews run the same model at a coarse resolution, and are
+                # never saved over the full resolution results
+                self.params["Preview"] = True
+                for output in self.output_params:
+                    self.params[output] = ""
+            # Temporary files of the task are written to a directory of their
+            # own, so they can all be removed once the task has finished
+            self.temporary_directory = tempfile.mkdtemp(
+                prefix=f"{self.name}_", dir=QgsProcessingUtils.tempFolder()
+            )
+            self.params["TemporaryDirectory"] = self.temporary_directory
             self.algorithm.initAlgorithm()
             # each task needs its own feedback object! Reusing old feedback
             # will prevent task from being canceled
             self.feedback = LoggerProcessingFeedBack(use_logger=True)
+            # and its own context, so temporary layers of earlier tasks are
+            # not kept in the context
+            self.context = QgsProcessingContext()
             self.task = QgsProcessingAlgRunnerTask(
                 self.algorithm, self.params, self.context, self.feedback
             )
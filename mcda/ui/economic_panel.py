@@ -17,6 +17,7 @@ class EconomicSuitabilityPanel(BasePanel):
     def __init__(self, dialog: QDialog) -> None:
         super().__init__(dialog)
         self.algorithm = EconomicSuitability()
+        self.output_params = ["EconomicSuitability"]
         self.panel = Panels.EconomicSuitability
         self.name = "econ"
 
@@ -15,6 +15,7 @@ class EnvironmentalSuitabilityPanel(BasePanel):
         self.name = "env"
         self.panel = Panels.EnvironmentalSuitability
         self.algorithm = EnvironmentalSuitability()
+        self.output_params = ["EnvironmentalSuitability"]
 
     def setup_panel(self) -> None:
         super().setup_panel()
@@ -17,6 +17,7 @@ class HazardRiskIndexPanel(BasePanel):
     def __init__(self, dialog: QDialog) -> None:
         super().__init__(dialog)
         self.algorithm = NaturalHazardRisksForSchools()
+        self.output_params = ["OutputRaster", "SampledOutput"]
         self.panel = Panels.HazardRiskIndex
         self.name = "hri"
         self.minimum = 2
@@ -49,6 +50,7 @@ class HazardRiskIndexPanel(BasePanel):
             self.__set_combobox(combobox, layer_number)
             spinbox = getattr(self.dlg, f"hri_raster_layer_dspnb_{layer_number}")
             self.__set_spinbox(spinbox)
+            self._refresh_on_change(spinbox)
 
         self.dlg.groupbox_rasters.setLayout(self.dlg.hri_risk_layer_gridlayout)
 
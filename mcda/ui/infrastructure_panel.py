@@ -29,6 +29,7 @@ class InfrastructurePanel(BasePanel):
     def __init__(self, dialog: QDialog) -> None:
         super().__init__(dialog)
         self.algorithm = InfrastructureSuitability()
+        self.output_params = ["InfrastructureSuitability"]
         self.panel = Panels.Infrastructure
         self.name = "infra"
 
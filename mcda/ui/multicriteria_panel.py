@@ -19,6 +19,7 @@ class MultiCriteriaSuitabilityPanel(BasePanel):
         self.name = "mcda"
         self.panel = Panels.MultiCriteriaSuitability
         self.algorithm = Mcda()
+        self.output_params = ["OutputRaster"]
 
     def setup_panel(self) -> None:
         super().setup_panel()
@@ -47,6 +48,11 @@ class MultiCriteriaSuitabilityPanel(BasePanel):
         self.dlg.mcda_dbl_spn_bx_infra_weight.setMaximum(100)
         self.dlg.mcda_dbl_spn_bx_infra_weight.setClearValue(30)
         self.dlg.mcda_dbl_spn_bx_infra_weight.clear()
+        self._refresh_on_change(
+            self.dlg.mcda_dbl_spn_bx_env_weight,
+            self.dlg.mcda_dbl_spn_bx_econ_weight,
+            self.dlg.mcda_dbl_spn_bx_infra_weight,
+        )
 
         self.dlg.mcda_file_wdgt_save_output.setStorageMode(QgsFileWidget.SaveFile)
         self.dlg.mcda_file_wdgt_save_output.fileChanged.connect(
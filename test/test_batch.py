@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from mcda.core.batch import load_parameter_file
+
+
+def _write(path, config):
+    path.write_text(json.dumps(config), encoding="utf-8")
+    return str(path)
+
+
+def test_parameter_file_paths_are_relative_to_the_file(tmp_path):
+    (tmp_path / "districts.gpkg").touch()
+    (tmp_path / "dem.tif").touch()
+    config = load_parameter_file(
+        _write(
+            tmp_path / "batch.json",
+            {
+                "studyareas": "districts.gpkg",
+                "id_field": "id",
+                "steps": {
+                    "hri": {"Layers": ["dem.tif"]},
+                    "environmental": {
+                        "DigitalElevationModel": "dem.tif",
+                        "MultiHazardRisk": "@hri",
+                    },
+                },
+            },
+        )
+    )
+    assert config["studyareas"] == str(tmp_path / "districts.gpkg")
+    assert config["steps"]["hri"]["Layers"] == [str(tmp_path / "dem.tif")]
+    assert config["steps"]["environmental"]["MultiHazardRisk"] == "@hri"
+    assert config["output_directory"] == str(tmp_path / "results")
+
+
+def test_steps_may_only_refer_to_earlier_steps(tmp_path):
+    path = _write(
+        tmp_path / "batch.json",
+        {
+            "studyareas": [],
+            "steps": {
+                "hri": {"Layers": ["@mcda"]},
+                "mcda": {"Layers": ["@hri"]},
+            },
+        },
+    )
+    with pytest.raises(ValueError):
+        load_parameter_file(path)
+
+
+def test_parameter_file_needs_steps(tmp_path):
+    path = _write(tmp_path / "batch.json", {"studyareas": []})
+    with pytest.raises(ValueError, match="no steps"):
+        load_parameter_file(path)
@@ -0,0 +1,37 @@
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+
+from mcda.core.candidate_sites import top_candidates
+
+
+def _brute_force(array, count, separation):
+    # Greedy suppression over the fully sorted raster
+    rows, columns = np.nonzero(~np.isnan(array))
+    order = np.argsort(array[rows, columns], kind="stable")
+    kept = []
+    for row, column in zip(rows[order], columns[order]):
+        x, y = (column + 0.5) * 100, -(row + 0.5) * 100
+        if all(np.hypot(x - kx, y - ky) >= separation for kx, ky, _ in kept):
+            kept.append((x, y, array[row, column]))
+    return kept[:count]
+
+
+def test_best_pixels_are_kept_apart():
+    array = np.full((6, 8), 4.0)
+    array[1, 1] = 1.0
+    array[1, 2] = 1.5
+    array[4, 6] = 2.0
+    array[5, 0] = np.nan
+    candidates = top_candidates(ArraySource(array), 2, separation=250, block_size=3)
+    assert [candidate.score for candidate in candidates] == [1.0, 2.0]
+    assert (candidates[0].x, candidates[0].y) == (150, -150)
+
+
+def test_candidates_match_greedy_suppression():
+    array = np.random.default_rng(1).random((40, 50))
+    expected = _brute_force(array, 10, 450)
+    candidates = top_candidates(ArraySource(array), 10, separation=450, block_size=16)
+    assert [candidate.score for candidate in candidates] == [
+        score for _, _, score in expected
+    ]
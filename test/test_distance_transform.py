@@ -0,0 +1,49 @@
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+import pytest
+
+from mcda.core.distance_transform import DistanceClassRaster, euclidean_distance
+from mcda.core.raster_engine import RasterGrid, Window
+
+
+def brute_force_distance(features, pixel_width, pixel_height):
+    rows, columns = np.nonzero(features)
+    y, x = np.mgrid[0 : features.shape[0], 0 : features.shape[1]]
+    return np.sqrt(
+        ((y[..., np.newaxis] - rows) * pixel_height) ** 2
+        + ((x[..., np.newaxis] - columns) * pixel_width) ** 2
+    ).min(axis=-1)
+
+
+@pytest.mark.parametrize("max_distance", [None, 300, 10000])
+@pytest.mark.parametrize("pixel_size", [(1, 1), (100, 100), (30, 90)])
+def test_euclidean_distance_is_exact(max_distance, pixel_size):
+    features = np.random.default_rng(0).random((37, 23)) < 0.03
+    expected = brute_force_distance(features, *pixel_size)
+    distance = euclidean_distance(features, *pixel_size, max_distance=max_distance)
+    if max_distance is not None:
+        distance = np.minimum(distance, max_distance)
+        expected = np.minimum(expected, max_distance)
+    assert np.allclose(distance, expected)
+
+
+def test_euclidean_distance_without_features():
+    assert np.isinf(euclidean_distance(np.zeros((3, 3), dtype=bool))).all()
+
+
+def test_features_outside_the_study_area_change_the_classes_inside_it():
+    analysis_grid = RasterGrid((0, 100, 0, 0, 0, -100), 4, 4, "")
+    features = ArraySource(np.zeros((10, 10)))
+    features.grid = analysis_grid.expanded(300)
+    # A school one pixel west of the analysis grid
+    features.array[4, 2] = 1
+    classes = (
+        DistanceClassRaster(features, 0, 1000)
+        .cropped(analysis_grid)
+        .read(Window(0, 0, 4, 4))
+    )
+    assert classes[1, 0] == 1
+    # Without the school outside, the area is too far from any school
+    inside = ArraySource(features.array[3:7, 3:7])
+    assert (DistanceClassRaster(inside, 0, 1000).read(Window(0, 0, 4, 4)) == 4).all()
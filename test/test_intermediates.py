@@ -0,0 +1,45 @@
+import gc
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+from osgeo import gdal
+
+from mcda.core.intermediates import IntermediateStore, remove_temporary_directory
+from mcda.core.raster_engine import Window, write_raster
+
+
+def test_intermediates_over_the_budget_spill_to_disk(tmp_path):
+    store = IntermediateStore(100, str(tmp_path))
+    in_memory = store.path("small.tif", 60)
+    on_disk = store.path("large.tif", 60)
+    assert in_memory.startswith("/vsimem/")
+    assert on_disk.startswith(str(tmp_path))
+    store.clear()
+    # Freed memory is available to the next intermediates
+    assert store.path("large.tif", 100).startswith("/vsimem/")
+    store.clear()
+
+
+def test_intermediates_are_freed_with_their_last_reader(tmp_path):
+    store = IntermediateStore(1024, str(tmp_path))
+    path = store.path("ones.tif", 4 * 4 * 4)
+    write_raster(ArraySource(np.ones((4, 4))), path)
+    source = store.raster(path)
+    assert source.read(Window(0, 0, 4, 4)).sum() == 16
+    del source
+    gc.collect()
+    assert gdal.VSIStatL(path) is None
+
+
+def test_temporary_directory_is_removed_except_results(tmp_path):
+    directory = tmp_path / "run"
+    directory.mkdir()
+    for name in ["result.tif", "result.tif.aux.xml", "warped.tif", "studyarea.gpkg"]:
+        (directory / name).touch()
+    remove_temporary_directory(str(directory), [str(directory / "result.tif")])
+    assert sorted(path.name for path in directory.iterdir()) == [
+        "result.tif",
+        "result.tif.aux.xml",
+    ]
+    remove_temporary_directory(str(directory))
+    assert not directory.exists()
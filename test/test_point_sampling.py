@@ -0,0 +1,31 @@
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+
+from mcda.core.point_sampling import sample_points
+from mcda.core.raster_engine import as_scaled_sum
+
+
+def test_points_are_sampled_by_block():
+    source = ArraySource(np.arange(20, dtype=float).reshape(4, 5))
+    reads = []
+    read = source.read
+    source.read = lambda window: reads.append(window) or read(window)
+    # Pixels are 100 units wide, rows go down from y = 0
+    values = sample_points(
+        source,
+        [50, 450, 160, 90, 1000, np.nan],
+        [-50, -350, -50, -10, -50, -50],
+        block_size=2,
+    )
+    assert values[:4].tolist() == [0, 19, 1, 0]
+    assert np.isnan(values[4:]).all()
+    # Each block with points is read once
+    assert len(reads) == 2
+
+
+def test_sampled_values_are_stored_values():
+    source = as_scaled_sum(ArraySource([[1.23456, np.nan]]), "UInt16", (1, 4))
+    values = sample_points(source, [50, 150], [-50, -50])
+    assert values[0] == source.scale * round(1.23456 / source.scale)
+    assert np.isnan(values[1])
@@ -0,0 +1,183 @@
+import numpy as np
+from osgeo import gdal
+
+from mcda.core.raster_engine import (
+    VALUE_CLASS_EXPRESSION,
+    FileRaster,
+    RasterGrid,
+    RasterSource,
+    Window,
+    _encode,
+    as_classes,
+    as_scaled_sum,
+    classify_distance,
+    classify_value,
+    compute_blocks,
+    downsample,
+    overview_factors,
+    sum_range,
+    weighted_sum,
+)
+
+
+class ArraySource(RasterSource):
+    def __init__(self, array):
+        self.array = np.asarray(array, dtype=np.float64)
+        self.grid = RasterGrid(
+            (0, 100, 0, 0, 0, -100), self.array.shape[1], self.array.shape[0], ""
+        )
+
+    def read(self, window):
+        return self.array[
+            window.yoff : window.yoff + window.ysize,
+            window.xoff : window.xoff + window.xsize,
+        ]
+
+
+def test_grid_windows_cover_grid():
+    grid = RasterGrid((0, 100, 0, 0, 0, -100), 5, 3, "")
+    windows = list(grid.windows(2))
+    assert len(windows) == grid.window_count(2) == 6
+    assert sum(window.xsize * window.ysize for window in windows) == 15
+
+
+def test_classify_distance():
+    distance = np.array([0, 50, 300, 400, 600])
+    assert classify_distance(distance, 20, 600).tolist() == [4, 1, 2, 3, 4]
+    assert classify_distance(distance, 20, 600, further_is_better=True).tolist() == [
+        4,
+        3,
+        2,
+        1,
+        4,
+    ]
+
+
+def test_value_classes_are_the_same_in_both_implementations():
+    values = np.array([0.5, 0.6, 1.0, 1.5, 2.5, 0.0, np.nan])
+    classes = classify_value(values, 0.5, 2.5)
+    # The minimum is in the first class, not class zero
+    assert classes[:6].tolist() == [1, 1, 1, 2, 4, 1]
+    # The raster calculator evaluates the expression with numpy
+    expression = VALUE_CLASS_EXPRESSION.format(minimum=0.5, maximum=2.5)
+    calculated = eval(expression, vars(np), {"A": values})
+    assert np.array_equal(calculated, classes, equal_nan=True)
+
+
+def test_fused_weighted_sum_propagates_nodata():
+    first = ArraySource([[1, 2, np.nan]])
+    second = ArraySource([[4, 4, 4]]).map(lambda values: values / 2)
+    result = weighted_sum([first, second], [0.5, 0.5]).read(Window(0, 0, 3, 1))
+    assert result[0, :2].tolist() == [1.5, 2]
+    assert np.isnan(result[0, 2])
+
+
+def test_weighted_sum_has_no_layer_limit():
+    sources = [ArraySource([[index, 1]]) for index in range(30)]
+    result = weighted_sum(sources, [1 / 30] * 30).read(Window(0, 0, 2, 1))
+    assert np.allclose(result, [[14.5, 1]])
+
+
+def test_grid_from_bounds_is_snapped():
+    grid = RasterGrid.from_bounds((1050, -230, 1420, 10), 100, "")
+    assert grid.geotransform == (1000, 100, 0, 100, 0, -100)
+    assert (grid.xsize, grid.ysize) == (5, 4)
+    other = RasterGrid.from_bounds((1090, -290, 1500, 90), 100, "")
+    assert other.bounds[0] == grid.bounds[0]
+
+
+def test_parallel_blocks_are_in_window_order():
+    grid = RasterGrid((0, 100, 0, 0, 0, -100), 50, 40, "")
+    blocks = compute_blocks(lambda window: window.xoff, grid.windows(8), workers=4)
+    assert [block for _, block in blocks] == [window.xoff for window in grid.windows(8)]
+
+
+def test_scaled_sums_are_stored_as_rounded_integers():
+    source = as_scaled_sum(ArraySource([[1.0, 2.345, np.nan, 7.0]]), "Byte", (1, 4))
+    stored = _encode(
+        source.read(Window(0, 0, 4, 1)),
+        source.data_type,
+        source.output_nodata,
+        source.scale,
+        source.offset,
+    )
+    assert stored.dtype == np.uint8
+    # Values outside the range are clipped below the nodata value
+    assert stored.tolist() == [[50, 117, 255, 254]]
+
+
+def test_scaled_sums_fit_weights_that_do_not_sum_to_one():
+    source = ArraySource([[1.0, 2.0, 3.0, 4.0]])
+    weights = [100, 100, -50]
+    value_range = sum_range(weights, [(1, 4)] * 3)
+    assert value_range == (0, 750)
+    for data_type in ["Byte", "UInt16"]:
+        stored = as_scaled_sum(
+            weighted_sum([source] * 3, weights), data_type, value_range
+        )
+        encoded = _encode(
+            stored.read(Window(0, 0, 4, 1)),
+            stored.data_type,
+            stored.output_nodata,
+            stored.scale,
+            stored.offset,
+        )
+        decoded = encoded * stored.scale + stored.offset
+        # Rounded to the scale, but never clipped
+        assert np.allclose(decoded, [[150, 300, 450, 600]], atol=stored.scale)
+    # Sums of unknown range are not scaled
+    assert as_scaled_sum(source, "UInt16").data_type == "Float32"
+
+
+def test_classes_are_stored_as_bytes_with_zero_as_nodata():
+    source = as_classes(ArraySource([[0.0, 1.0, 4.0, np.nan]]))
+    stored = _encode(
+        source.read(Window(0, 0, 4, 1)), source.data_type, source.output_nodata
+    )
+    assert stored.dtype == np.uint8
+    # Class zero cannot be told apart from nodata, so it is stored as one
+    assert stored.tolist() == [[1, 1, 4, 0]]
+
+
+def test_overviews_go_down_to_a_single_block():
+    assert overview_factors(512, 300, 512) == []
+    assert overview_factors(2000, 300, 512) == [2, 4]
+    # Every block must map to whole overview pixels
+    assert overview_factors(10**6, 10, 16) == [2, 4, 8, 16]
+
+
+def test_downsampled_averages_leave_out_nodata():
+    block = np.array([[1.0, 3.0, 4.0], [np.nan, 2.0, np.nan], [np.nan, np.nan, 5.0]])
+    averaged = downsample(block, 2)
+    assert averaged[0].tolist() == [2.0, 4.0]
+    assert np.isnan(averaged[1, 0]) and averaged[1, 1] == 5.0
+    assert downsample(block, 2, average=False)[0].tolist() == [1.0, 4.0]
+
+
+def test_blocks_outside_the_mask_are_not_read():
+    source = ArraySource([[1, 2, 3, 4]])
+    reads = []
+    source.read = lambda window: reads.append(window) or ArraySource.read(
+        source, window
+    )
+    masked = source.masked(ArraySource([[1, np.nan, np.nan, np.nan]]))
+    inside = masked.read(Window(0, 0, 2, 1))
+    assert inside[0, 0] == 1 and np.isnan(inside[0, 1])
+    assert np.isnan(masked.read(Window(2, 0, 2, 1))).all()
+    assert reads == [Window(0, 0, 2, 1)]
+
+
+def test_scaled_rasters_with_nan_nodata_are_read_scaled():
+    path = "/vsimem/test_scaled_nan.tif"
+    dataset = gdal.GetDriverByName("GTiff").Create(path, 2, 1, 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((0, 100, 0, 0, 0, -100))
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(float("nan"))
+    band.SetScale(2)
+    band.SetOffset(1)
+    band.WriteArray(np.array([[3.0, np.nan]]))
+    dataset = None
+    values = FileRaster(path).read(Window(0, 0, 2, 1))
+    gdal.Unlink(path)
+    assert values[0, 0] == 7
+    assert np.isnan(values[0, 1])
@@ -0,0 +1,102 @@
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+
+from mcda.core.raster_engine import (
+    FileRaster,
+    as_scaled_sum,
+    stored_values,
+    write_raster,
+)
+from mcda.core.raster_statistics import (
+    StatisticsAccumulator,
+    ZonalAccumulator,
+    _cache_key,
+    cache_statistics,
+    compute_statistics,
+    get_stack_statistics,
+    get_statistics,
+)
+
+
+def test_streaming_statistics_match_numpy():
+    values = np.arange(20, dtype=np.float64).reshape(4, 5)
+    values[0, 0] = np.nan
+    accumulator = StatisticsAccumulator(histogram_bins=4, histogram_range=(0, 20))
+    for block in np.array_split(values, 3):
+        accumulator.update(block)
+    statistics = accumulator.result()
+    valid = values[~np.isnan(values)]
+    assert statistics.count == valid.size
+    assert statistics.min == 1
+    assert statistics.max == 19
+    assert np.isclose(statistics.mean, valid.mean())
+    assert np.isclose(statistics.std_dev, valid.std())
+    assert statistics.histogram.tolist() == [4, 5, 5, 5]
+
+
+def test_zonal_statistics_are_accumulated_per_zone():
+    zones = ArraySource([[1, 1, 2, np.nan], [2, 2, 2, 1]])
+    values = np.array([[1.2, 3.0, 4.0, 2.0], [np.nan, 2.0, 3.6, 1.0]])
+    accumulator = ZonalAccumulator(zones, zone_count=3)
+    for window in zones.grid.windows(2):
+        accumulator.update(
+            window,
+            values[
+                window.yoff : window.yoff + window.ysize,
+                window.xoff : window.xoff + window.xsize,
+            ],
+        )
+    first, second, empty = accumulator.result()
+    assert first.count == 3 and np.isclose(first.mean, 5.2 / 3)
+    assert (first.min, first.max) == (1.0, 3.0)
+    assert second.count == 3 and np.isclose(second.mean, 9.6 / 3)
+    assert first.histogram.tolist() == [2, 0, 1, 0]
+    assert second.histogram.tolist() == [0, 1, 0, 2]
+    assert empty.count == 0 and np.isnan(empty.mean)
+
+
+def test_rasters_rewritten_at_the_same_path_get_new_keys(tmp_path):
+    path = tmp_path / "result.tif"
+    path.write_bytes(b"first")
+    key = _cache_key(str(path), 1)
+    # Rewritten within the same second
+    path.write_bytes(b"second")
+    assert _cache_key(str(path), 1) != key
+
+
+def test_stack_statistics_are_gathered_in_one_pass():
+    reads = []
+
+    class CountingSource(ArraySource):
+        def read(self, window):
+            reads.append(window)
+            return super().read(window)
+
+    first = CountingSource(np.arange(12, dtype=np.float64).reshape(3, 4))
+    second = CountingSource(-np.ones((3, 4)))
+    statistics = get_stack_statistics([first, second], block_size=2, workers=2)
+    assert (statistics[0].min, statistics[0].max) == (0, 11)
+    assert (statistics[1].min, statistics[1].max) == (-1, -1)
+    # Each block of each raster is read once
+    assert len(reads) == 2 * first.grid.window_count(2)
+
+
+def test_statistics_gathered_while_writing_match_the_file(tmp_path):
+    # Sums are rounded to the scale of the stored integers
+    stored = as_scaled_sum(ArraySource([[1.00003, 2.5, 4.00007]]), "UInt16", (1, 4))
+    path = str(tmp_path / "sum.tif")
+    statistics = StatisticsAccumulator()
+    write_raster(
+        stored,
+        path,
+        observers=[
+            lambda window, block: statistics.update(stored_values(stored, block))
+        ],
+    )
+    cache_statistics(path, statistics.result())
+    memoized = get_statistics(FileRaster(path))
+    read_back = compute_statistics(FileRaster(path))
+    assert np.isclose(memoized.min, read_back.min)
+    assert np.isclose(memoized.max, read_back.max)
+    assert np.isclose(memoized.mean, read_back.mean)
@@ -0,0 +1,23 @@
+import os
+
+from mcda.core.result_cache import ResultCache
+
+
+def _add(cache, key, size):
+    with open(cache.partial_path(key, ".tif"), "wb") as file:
+        file.write(b"0" * size)
+    return cache.add(key, ".tif")
+
+
+def test_results_used_by_other_runs_are_not_evicted(tmp_path):
+    first = ResultCache(str(tmp_path), 150)
+    second = ResultCache(str(tmp_path), 150)
+    used = _add(first, "a", 100)
+    # The result of the first run is older, but still in use
+    os.utime(used, (0, 0))
+    _add(second, "b", 100)
+    assert os.path.exists(used)
+
+    del first
+    _add(second, "c", 100)
+    assert not os.path.exists(used)
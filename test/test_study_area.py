@@ -0,0 +1,40 @@
+import pytest
+from qgis.core import QgsFeature, QgsGeometry, QgsProject, QgsVectorLayer
+
+from mcda.core.raster_engine import RasterGrid
+from mcda.core.study_area import StudyArea
+
+
+def _layer(geometry_type, wkts):
+    layer = QgsVectorLayer(f"{geometry_type}?crs=EPSG:3857", "layer", "memory")
+    features = []
+    for wkt in wkts:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    layer.updateExtents()
+    return layer
+
+
+def _study_area():
+    area = _layer(
+        "Polygon",
+        ["POLYGON((0 0, 500 0, 500 500, 0 500, 0 0))"],
+    )
+    grid = RasterGrid.from_bounds((0, 0, 500, 500), 100, "")
+    return StudyArea(area, area, "EPSG:3857", grid)
+
+
+def test_points_within_buffered_study_area():
+    schools = _layer("Point", ["POINT(250 250)", "POINT(550 250)", "POINT(900 250)"])
+    study_area = _study_area()
+    context = QgsProject.instance().transformContext()
+    assert study_area.points_within(schools, 0, context).featureCount() == 1
+    assert study_area.points_within(schools, 100, context).featureCount() == 2
+
+
+def test_buffered_study_areas_are_reused():
+    study_area = _study_area()
+    assert study_area.buffered(100) is study_area.buffered(100)
+    assert study_area.buffered(100).extent().xMaximum() == pytest.approx(600)
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+from mcda.core.task_graph import TaskGraph
+
+
+def test_dependencies_get_results():
+    graph = TaskGraph()
+    graph.add("a", lambda: 1)
+    graph.add("b", lambda: 2)
+    graph.add("sum", lambda a, b: a + b, ["a", "b"])
+    assert graph.run(workers=2) == {"a": 1, "b": 2, "sum": 3}
+
+
+def test_independent_tasks_run_concurrently():
+    # Both tasks have to be running at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    graph = TaskGraph()
+    graph.add("a", barrier.wait)
+    graph.add("b", barrier.wait)
+    graph.run(workers=2)
+
+
+def test_errors_are_raised():
+    def fail():
+        raise RuntimeError("failed")
+
+    graph = TaskGraph()
+    graph.add("a", fail)
+    graph.add("b", lambda a: a, ["a"])
+    with pytest.raises(RuntimeError):
+        graph.run(workers=2)
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        TaskGraph().add("a", lambda b: b, ["b"])
+
+
+def test_width_is_the_number_of_concurrent_tasks():
+    graph = TaskGraph()
+    graph.add("roads", lambda: 1)
+    graph.add("waterways", lambda: 2)
+    graph.add("classified_roads", lambda roads: roads, ["roads"])
+    graph.add("classified_waterways", lambda waterways: waterways, ["waterways"])
+    graph.add("sum", lambda a, b: a + b, ["classified_roads", "classified_waterways"])
+    assert graph.width() == 2
+    assert TaskGraph().width() == 1
@@ -0,0 +1,54 @@
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+from osgeo import gdal
+
+from mcda.core.raster_engine import FileRaster, Window, cutline_nodata
+from mcda.core.terrain import SlopeRaster
+
+
+def test_slope_of_plane():
+    # Elevation rises 100 units per 100 unit pixel to the east
+    dem = ArraySource(np.tile(np.arange(6) * 100.0, (5, 1)))
+    slope = SlopeRaster(dem)
+    assert np.allclose(slope.read(Window(0, 0, 6, 5))[1:-1, 1:-1], 45)
+    # Windows in the middle see their neighbours through the halo
+    assert np.allclose(slope.read(Window(2, 1, 2, 2)), 45)
+    # Like gdaldem -compute_edges, missing neighbours get the center value
+    assert np.allclose(slope.read(Window(0, 2, 1, 1)), np.degrees(np.arctan(0.5)))
+
+
+def test_slope_nodata():
+    dem = ArraySource([[0, 0, 0], [0, np.nan, 0], [0, 0, 0]])
+    slope = SlopeRaster(dem).read(Window(0, 0, 3, 3))
+    assert np.isnan(slope[1, 1])
+    assert np.allclose(np.delete(slope.ravel(), 4), 0)
+
+
+def test_slope_is_flat_at_the_cutline_boundary():
+    # Flat terrain without a nodata value, warped with a cutline covering the
+    # middle of the raster
+    dem_path = "/vsimem/test_cutline_dem.tif"
+    dataset = gdal.GetDriverByName("GTiff").Create(dem_path, 6, 6, 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((0, 100, 0, 600, 0, -100))
+    dataset.GetRasterBand(1).Fill(1000)
+    dataset = None
+    cutline_path = "/vsimem/test_cutline.geojson"
+    gdal.FileFromMemBuffer(
+        cutline_path,
+        '{"type": "FeatureCollection", "features": [{"type": "Feature", '
+        '"properties": {}, "geometry": {"type": "Polygon", "coordinates": '
+        "[[[200, 200], [400, 200], [400, 400], [200, 400], [200, 200]]]}}]}",
+    )
+    warped_path = "/vsimem/test_cutline_warped.tif"
+    gdal.Warp(
+        warped_path,
+        dem_path,
+        cutlineDSName=cutline_path,
+        dstNodata=cutline_nodata(dem_path),
+    )
+    slope = SlopeRaster(FileRaster(warped_path)).read(Window(0, 0, 6, 6))
+    for path in (dem_path, cutline_path, warped_path):
+        gdal.Unlink(path)
+    assert np.isnan(slope[0, 0])
+    assert np.allclose(slope[2:4, 2:4], 0)
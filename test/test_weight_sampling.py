@@ -0,0 +1,40 @@
+from test.test_raster_engine import ArraySource
+
+import numpy as np
+
+from mcda.core.raster_engine import Window
+from mcda.core.weight_sampling import (
+    STATISTICS,
+    SensitivityStatistics,
+    dirichlet_weights,
+    grid_weights,
+    one_at_a_time_weights,
+)
+
+
+def test_weight_vectors_sum_to_one():
+    assert len(grid_weights(3, 20)) == 15
+    # More layers than vectors
+    assert len(grid_weights(5, 3)) == 3
+    for weights in (
+        grid_weights(3, 20),
+        one_at_a_time_weights([0.5, 0.3, 0.2], 0.5, 5),
+        dirichlet_weights([0.5, 0.3, 0.2], 100, 50, seed=1),
+    ):
+        assert np.allclose(weights.sum(axis=1), 1)
+
+
+def test_sensitivity_statistics_in_batches():
+    first = ArraySource([[1, 2, np.nan]])
+    second = ArraySource([[4, 2, 1]])
+    weights = np.array([[1, 0], [0.5, 0.5], [0, 1]])
+    statistics = SensitivityStatistics(
+        [first, second], [0.5, 0.5], weights, (1, 4), memory_budget=1
+    )
+    mean, std_dev, stability = (
+        statistics.statistic(name).read(Window(0, 0, 3, 1)) for name in STATISTICS
+    )
+    assert mean[0, :2].tolist() == [2.5, 2]
+    assert np.allclose(std_dev[0, :2], [np.sqrt(1.5), 0])
+    assert np.allclose(stability[0, :2], [1 / 3, 1])
+    assert np.isnan(mean[0, 2])